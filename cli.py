@@ -0,0 +1,7 @@
+import sys
+
+from ramain.cli import main
+
+# the guard is needed as worker processes import the main module
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,8 @@
 import sys
+from PySide6.QtCore import QSettings
 from PySide6.QtWidgets import QApplication
 from ramain.views.main_window import MainWindow
+from ramain.utils.settings import SETTINGS
 
 
 class App(QApplication):
@@ -8,6 +10,10 @@ class App(QApplication):
         super(App, self).__init__(sys_argv)
         self.setOrganizationName("RamAIn")
         self.setApplicationName("RamAIn")
+
+        # settings of the GUI are persistent, processing core itself does not depend on Qt
+        SETTINGS.set_backend(QSettings("RamAIn", "RamAIn"))
+
         self.main_view = MainWindow()  # self.model, self.main_controller)
         self.main_view.show()
 
@@ -0,0 +1,219 @@
+"""
+Command line runner of the saved pipelines, it processes batches of files without the GUI (and Qt), e.g.
+
+    python cli.py pipeline.json "data/**/*.mat" --workers 4 --out-dir processed --logs-dir logs
+
+The run is journaled next to its logs, the interrupted run is resumed by
+
+    python cli.py --resume logs/logs_<date>.journal.jsonl
+"""
+
+import os
+import sys
+import glob
+import argparse
+from typing import List, Optional
+
+from ramain.model import batch, journal, pipeline
+from ramain.utils.progress import FunctionProgress
+from ramain.utils.settings import (
+    SETTINGS,
+    JsonSettingsBackend,
+    MemorySettingsBackend,
+)
+
+
+def expand_files(patterns: List[str]) -> List[str]:
+    """
+    A function to expand the glob patterns (`**` matches any subdirectories) into sorted paths to the files.
+
+    Parameters:
+        patterns (List[str]): Paths or glob patterns.
+
+    Returns:
+        file_names (List[str]): Paths to the files, each one only once and in the order of the patterns.
+    """
+
+    file_names = []
+    for pattern in patterns:
+        for file_name in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(file_name) and file_name not in file_names:
+                file_names.append(file_name)
+
+    return file_names
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="ramain",
+        description="Apply the saved pipeline of the automatic processing on the batch of files.",
+    )
+    parser.add_argument(
+        "pipeline", nargs="?", help="pipeline file (.json, .yaml or .yml)"
+    )
+    parser.add_argument(
+        "files", nargs="*", help="files or glob patterns, e.g. 'data/**/*.mat'"
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        metavar="JOURNAL",
+        help="resume the interrupted run with the journal, its files and pipeline are used",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        help="number of files processed at once (default: 'batch/workers' setting or 1)",
+    )
+    parser.add_argument(
+        "-o",
+        "--out-dir",
+        help="directory of the saved and exported files, overrides the directories in the pipeline",
+    )
+    parser.add_argument(
+        "-l",
+        "--logs-dir",
+        default=os.getcwd(),
+        help="directory of the logs file (default: current directory)",
+    )
+    parser.add_argument(
+        "-s",
+        "--settings",
+        help='JSON file with the settings, e.g. {"processing/memory_budget": 2048}',
+    )
+    parser.add_argument(
+        "--step-cache",
+        action=argparse.BooleanOptionalAction,
+        help="resume from and save the cached states after the steps (default: 'step_cache/enabled' setting or off)",
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="do not report the progress"
+    )
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    The entry point of the command line runner.
+
+    Parameters:
+        argv (List[str]): Command line arguments, `sys.argv` is used if not provided. Default: None.
+
+    Returns:
+        exit_code (int): 0 if all the files were processed, 1 if some failed, 2 if the arguments are invalid.
+    """
+
+    parser = make_parser()
+    args = parser.parse_args(argv)
+
+    if args.workers is not None and args.workers < 1:
+        parser.error("number of workers has to be positive")
+
+    if args.settings is not None:
+        # the file is only read, the settings changed by the options are not written into it
+        SETTINGS.set_backend(
+            MemorySettingsBackend(JsonSettingsBackend(args.settings).values)
+        )
+    if args.step_cache is not None:
+        SETTINGS.setValue("step_cache/enabled", args.step_cache)
+
+    if args.resume is not None:
+        if args.pipeline is not None or args.out_dir is not None:
+            parser.error(
+                "pipeline, files and --out-dir are taken from the journal with --resume"
+            )
+
+        try:
+            file_names, steps, labels = journal.read_header(args.resume)
+        except (OSError, KeyError, journal.JournalError, pipeline.PipelineError) as e:
+            parser.error(str(e))
+
+        batch_steps = [
+            (
+                label,
+                pipeline.get_function(step.method),
+                pipeline.get_positional_params(step),
+            )
+            for label, step in zip(labels, steps)
+        ]
+        journal_file = args.resume
+
+    else:
+        if args.pipeline is None or not args.files:
+            parser.error("pipeline and files are required")
+
+        try:
+            steps = pipeline.load(args.pipeline)
+        except (OSError, ImportError, pipeline.PipelineError) as e:
+            parser.error(str(e))
+
+        if not steps:
+            parser.error(f"{args.pipeline}: pipeline has no steps")
+
+        file_names = expand_files(args.files)
+        if not file_names:
+            parser.error("no files match " + ", ".join(args.files))
+
+        if args.out_dir is not None:
+            os.makedirs(args.out_dir, exist_ok=True)
+            steps = pipeline.set_output_dir(steps, args.out_dir)
+
+        batch_steps = pipeline.to_batch_steps(steps)
+        journal_file = None
+
+    os.makedirs(args.logs_dir, exist_ok=True)
+    logs_file = batch.get_logs_path(args.logs_dir)
+    if journal_file is None:
+        journal_file = journal.get_journal_path(logs_file)
+
+    steps_count = len(file_names) * len(steps)
+    finished_steps = 0
+
+    def report_progress(steps_done: int) -> None:
+        nonlocal finished_steps
+        finished_steps += steps_done
+        print(
+            f"\r[PROGRESS]: {finished_steps}/{steps_count} steps",
+            end="",
+            file=sys.stderr,
+        )
+
+    try:
+        batch_journal = journal.Journal(
+            journal_file, file_names, batch_steps, resume=args.resume is not None
+        )
+    except (OSError, journal.JournalError) as e:
+        parser.error(str(e))
+
+    print(
+        f"[FILES]: {len(file_names)}; logs: {logs_file}; journal: {journal_file}",
+        file=sys.stderr,
+    )
+
+    with batch_journal, open(logs_file, "w", encoding="utf-8") as logs:
+        failed_files = batch.run(
+            file_names,
+            batch_steps,
+            logs,
+            n_workers=args.workers,
+            progress=None if args.quiet else FunctionProgress(report_progress),
+            journal=batch_journal,
+        )
+
+    if not args.quiet:
+        print(file=sys.stderr)
+
+    for file_name in failed_files:
+        print(f"[ERROR]: {file_name}", file=sys.stderr)
+    print(
+        f"[DONE]: {len(file_names) - len(failed_files)}/{len(file_names)} files processed",
+        file=sys.stderr,
+    )
+
+    return 1 if failed_files else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,652 @@
+"""
+Batch processing of files by a pipeline of `SpectralMap` methods. Files are processed one after another
+or, each file in one task, by a pool of worker processes. Logs of the files are written in the order of the files
+in both cases and an error in one file does not stop processing of the others.
+Pipeline ending with `stitched_decomposition_export` is applied on all the files at once in the calling process,
+the processed maps are kept memory-mapped from temporary files for it.
+Finished steps can be recorded into a journal (see `journal`), so that interrupted run can be resumed.
+"""
+
+import io
+import os
+import queue
+import shutil
+import tempfile
+import inspect
+import datetime
+import traceback
+import multiprocessing
+from concurrent import futures
+from typing import Any, Callable, Collection, List, Optional, TextIO, Tuple
+
+from ramain.model import cache, step_cache
+from ramain.model.spectal_map import SpectralMap
+from ramain.spectra_processing.decomposition.stitched_NMF import stitched_NMF
+from ramain.spectra_processing.export.to_graphics import export_stitched_maps_graphics
+from ramain.spectra_processing import executor
+from ramain.utils.progress import FunctionProgress, ProgressCallback
+from ramain.utils.settings import SETTINGS, MemorySettingsBackend
+
+# number of files processed at once, 1 - in the calling thread
+DEFAULT_WORKERS = 1
+
+# settings of the processing core the worker processes get from the calling one
+WORKER_SETTINGS = (
+    "processing/float32",
+    "cache/enabled",
+    "cache/dir",
+    "cache/max_size",
+    "saving/format",
+    "saving/compression",
+    "step_cache/enabled",
+    "step_cache/max_size",
+)
+
+# how often (in seconds) the progress of the workers is collected
+POLL_INTERVAL = 0.1
+
+# step of the pipeline: text (for the logs), `SpectralMap` method and its parameters
+Step = Tuple[str, Callable, list]
+
+# parameters with the directory of the outputs, recorded into the journal
+OUTPUT_DIR_PARAMS = ("out_folder_path", "out_dir")
+
+
+def get_workers() -> int:
+    """
+    A function to get the number of files processed at once from the settings.
+    """
+
+    return max(int(SETTINGS.value("batch/workers", DEFAULT_WORKERS)), 1)
+
+
+def get_logs_path(logs_dir: str) -> str:
+    """
+    A function to get path to a new logs file in the `logs_dir`, the file has name according to current time.
+    """
+
+    return os.path.join(
+        logs_dir,
+        "logs_" + datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S") + ".txt",
+    )
+
+
+def _get_temp_dir() -> Optional[str]:
+    """
+    Gets directory for the large temporary files (inside the directory of `cache`), as the system temporary
+    directory may be kept in the memory. None (the system one) if it cannot be created.
+    """
+
+    try:
+        cache_dir = cache.get_cache_dir()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return str(cache_dir)
+    except OSError:
+        return None
+
+
+def stitched_decomposition_export(
+    maps: List[SpectralMap], n_components: int, experiment_name: str, out_dir: str
+) -> None:
+    """
+    A function to decompose all the maps together by NMF and to export the results as graphics.
+    It has to be the last step of the pipeline as it is applied on all the processed maps at once.
+
+    Parameters:
+        maps (List[SpectralMap]): The processed maps.
+        n_components (int): Number of the NMF components.
+        experiment_name (str): Name of the exported files.
+        out_dir (str): Directory of the exported files.
+    """
+
+    # stitched spectra larger than the memory budget are decomposed out of core
+    nmf_transformed_data, nmf_components, unified_x_axis = stitched_NMF(
+        maps,
+        n_components=int(n_components),
+        temp_dir=_get_temp_dir(),
+    )
+
+    export_stitched_maps_graphics(
+        maps,
+        nmf_transformed_data,
+        nmf_components,
+        unified_x_axis,
+        experiment_name,
+        in_files=[spectral_map.in_file for spectral_map in maps],
+        out_dir=out_dir,
+    )
+
+
+def _get_output(function: Callable, params: list, result: Any) -> Optional[str]:
+    """
+    Gets where the outputs of the step went: path returned by the step or its output directory.
+    """
+
+    if isinstance(result, str):
+        return result
+
+    arguments = inspect.signature(function).bind_partial(None, *params).arguments
+    for name in OUTPUT_DIR_PARAMS:
+        if name in arguments:
+            return str(arguments[name])
+    return None
+
+
+def _save_last_states(
+    last_state: Optional[Tuple[str, step_cache.State]],
+    last_data_state: Optional[Tuple[str, step_cache.State]],
+    data_key: Optional[str],
+) -> None:
+    """
+    Caches the state after the last made cacheable step, so that the spectra are saved once per file.
+    If the spectra were changed by an earlier step (the last ones keep them, e.g. decompositions), the state
+    after that step is cached too and the last state shares its spectra.
+    """
+
+    if last_data_state is not None:
+        data_key = last_data_state[0] if step_cache.save(*last_data_state) else None
+    if last_state is not None and last_state is not last_data_state:
+        step_cache.save(*last_state, data_key)
+
+
+def _spill(
+    file_name: str, spectral_map: SpectralMap, spill_dir: str, key: str
+) -> SpectralMap:
+    """
+    Moves the spectra of the processed map into a memory-mapped file, so that the maps of the stitched pipeline
+    do not have to fit into the memory all at once. The map is kept in the memory if it cannot be saved.
+    """
+
+    if not step_cache.save(
+        key, spectral_map.get_state(), cache_dir=spill_dir, evict=False
+    ):
+        return spectral_map
+
+    state = step_cache.load(key, cache_dir=spill_dir)
+    return spectral_map if state is None else SpectralMap(file_name, state=state)
+
+
+def _log_finished_steps(
+    steps: List[Step],
+    steps_count: int,
+    logs: TextIO,
+    progress: Optional[ProgressCallback],
+) -> None:
+    """
+    Logs the steps finished by the previous run.
+    """
+
+    for step_index, (step_text, function, _) in enumerate(steps):
+        print(
+            f"[STEP {step_index + 1}/{steps_count}]: {step_text}; function: {function.__name__}",
+            file=logs,
+        )
+        print("[FINISHED]", file=logs)
+        if progress is not None:
+            progress.emit(1)
+
+
+def _process_map(
+    file_name: str,
+    steps: List[Step],
+    steps_count: int,
+    logs: TextIO,
+    progress: Optional[ProgressCallback],
+    finished_steps: Collection[int] = (),
+    on_step: Optional[Callable[[int, Optional[str]], None]] = None,
+) -> Optional[SpectralMap]:
+    """
+    Loads the map and applies the steps on it. If `step_cache` is enabled, the longest cached prefix of the steps
+    is skipped and the state after the last cacheable step is cached. Steps finished by the previous run are skipped if they
+    are not needed for the others (outputs and the steps after the last unfinished one).
+    Returns None if all the steps are finished, `on_step` is called with index and output of each made step.
+    """
+
+    for _, function, _ in steps:
+        if function is stitched_decomposition_export:
+            raise ValueError(
+                "Stitched Decomposition & Export has to be last in the pipeline."
+            )
+
+    unfinished_steps = [i for i in range(len(steps)) if i not in finished_steps]
+    if not unfinished_steps:
+        _log_finished_steps(steps, steps_count, logs, progress)
+        return None
+
+    keys = step_cache.get_keys(file_name, steps) if step_cache.is_enabled() else []
+
+    # key of the cached spectra of the current state, so that the steps that keep them do not save them again
+    curr_data, cached_steps, data_key = None, 0, None
+    for step_index in reversed(range(len(keys))):
+        state = step_cache.load(keys[step_index])
+        if state is not None:
+            curr_data = SpectralMap(file_name, state=state)
+            cached_steps = step_index + 1
+            if steps[step_index][1].__name__ not in step_cache.KEEP_DATA_STEPS:
+                data_key = keys[step_index]
+            break
+
+    if curr_data is None:
+        curr_data = SpectralMap(file_name)
+
+    # (key, state) after the last made cacheable step and after the last one of them that changed the spectra
+    last_state, last_data_state = None, None
+
+    for step_index, (step_text, function, params) in enumerate(steps):
+        print(
+            f"[STEP {step_index + 1}/{steps_count}]: {step_text}; function: {function.__name__}",
+            file=logs,
+        )
+
+        if step_index in finished_steps and (
+            step_index > unfinished_steps[-1]
+            or function.__name__ in step_cache.OUTPUT_STEPS
+        ):
+            print("[FINISHED]", file=logs)
+        elif step_index < cached_steps:
+            print("[CACHED]", file=logs)
+        else:
+            # function call
+            result = function(curr_data, *params)
+
+            print("[SUCCESS]", file=logs)
+            if on_step is not None:
+                on_step(step_index, _get_output(function, params, result))
+
+            if step_index < len(keys):
+                last_state = (keys[step_index], curr_data.get_state())
+                if function.__name__ not in step_cache.KEEP_DATA_STEPS:
+                    last_data_state = last_state
+
+        if step_index == len(keys) - 1:
+            _save_last_states(last_state, last_data_state, data_key)
+
+        if progress is not None:
+            progress.emit(1)
+
+    return curr_data
+
+
+def process_file(
+    file_name: str,
+    file_index: int,
+    files_count: int,
+    steps: List[Step],
+    progress: Optional[ProgressCallback] = None,
+    finished_steps: Collection[int] = (),
+    journal=None,
+) -> Tuple[str, bool]:
+    """
+    A function to apply the pipeline on one file.
+
+    Parameters:
+        file_name (str): Path to the file.
+        file_index (int): Position of the file in the batch (from 1), for the logs and the journal.
+        files_count (int): Number of the files in the batch, for the logs.
+        steps (List[Step]): The pipeline.
+        progress (ProgressCallback): Emitted with the number of finished steps. Default: None.
+        finished_steps (Collection[int]): Indices of the steps finished by the previous run. Default: ().
+        journal (Journal): Where the made steps are recorded (`record_step`). Default: None.
+
+    Returns:
+        result (Tuple[str, bool]): Logs of the processing of the file and whether it succeeded.
+    """
+
+    logs = io.StringIO()
+    reported_steps = 0
+
+    def update_progress(steps_done: int) -> None:
+        nonlocal reported_steps
+        reported_steps += steps_done
+        if progress is not None:
+            progress.emit(steps_done)
+
+    print(f"[FILE {file_index}/{files_count}]: {file_name}", file=logs)
+    try:
+        _process_map(
+            file_name,
+            steps,
+            len(steps),
+            logs,
+            FunctionProgress(update_progress),
+            finished_steps,
+            (
+                None
+                if journal is None
+                else lambda step_index, output: journal.record_step(
+                    file_index, step_index, output
+                )
+            ),
+        )
+        succeeded = True
+
+    except Exception as e:
+        em = traceback.format_exc()
+        print(f"[ERROR]: {e}", file=logs)
+        print(em, file=logs)
+        succeeded = False
+
+        # remaining steps of the file are not going to be made
+        update_progress(len(steps) - reported_steps)
+
+    print(file=logs)
+
+    return logs.getvalue(), succeeded
+
+
+class _QueueReporter:
+    """
+    Progress of one file and its made steps sent from the worker process to the calling process.
+    """
+
+    def __init__(self, messages_queue, file_index: int) -> None:
+        self.messages_queue = messages_queue
+        self.file_index = file_index
+
+    def emit(self, steps: int) -> None:
+        self.messages_queue.put(("progress", self.file_index, steps))
+
+    def record_step(
+        self, file_index: int, step_index: int, output: Optional[str]
+    ) -> None:
+        self.messages_queue.put(("step", file_index, step_index, output))
+
+
+def _init_worker(settings: dict) -> None:
+    SETTINGS.set_backend(MemorySettingsBackend(settings))
+
+
+def _get_worker_settings(n_workers: int) -> dict:
+    settings = {
+        key: SETTINGS.value(key)
+        for key in WORKER_SETTINGS
+        if SETTINGS.value(key) is not None
+    }
+
+    # files are the unit of parallelism, so the spectra of one file are processed serially
+    # within the share of the memory budget
+    settings["processing/backend"] = "serial"
+    settings["processing/memory_budget"] = max(
+        executor.get_memory_budget() // n_workers // 1024**2, 1
+    )
+    return settings
+
+
+def run_pipeline(
+    file_names: List[str],
+    steps: List[Step],
+    logs: TextIO,
+    n_workers: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+    journal=None,
+) -> List[str]:
+    """
+    A function to apply the pipeline on each of the files.
+
+    Parameters:
+        file_names (List[str]): Paths to the files.
+        steps (List[Step]): The pipeline, functions and parameters have to be picklable if `n_workers` > 1.
+        logs (TextIO): Where the logs of the files are written (in the order of the files).
+        n_workers (int): Number of worker processes, the files are processed in the calling thread if 1.
+            Taken from the settings if not provided. Default: None.
+        progress (ProgressCallback): Emitted (from the calling thread) with the number of finished steps,
+            steps of the failed files count as finished. Default: None.
+        journal (Journal): Journal of the run, the steps it has as finished are skipped and the made ones
+            are recorded into it (from the calling thread). Default: None.
+
+    Returns:
+        failed_files (List[str]): Paths to the files that could not be processed.
+    """
+
+    n_workers = get_workers() if n_workers is None else n_workers
+    n_workers = min(n_workers, len(file_names))
+    files_count = len(file_names)
+    failed_files = []
+
+    def get_finished_steps(file_index: int) -> Collection[int]:
+        return () if journal is None else journal.get_finished_steps(file_index)
+
+    if n_workers <= 1:
+        for i, file_name in enumerate(file_names, 1):
+            file_logs, succeeded = process_file(
+                file_name,
+                i,
+                files_count,
+                steps,
+                progress,
+                get_finished_steps(i),
+                journal,
+            )
+            logs.write(file_logs)
+            logs.flush()
+            if not succeeded:
+                failed_files.append(file_name)
+        return failed_files
+
+    # fresh worker processes do not inherit state of the calling process (e.g. GUI)
+    context = multiprocessing.get_context("spawn")
+
+    with context.Manager() as manager, futures.ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(_get_worker_settings(n_workers),),
+    ) as pool:
+        messages_queue = manager.Queue()
+        reporters = [
+            _QueueReporter(messages_queue, i) for i in range(1, files_count + 1)
+        ]
+        pending = [
+            pool.submit(
+                process_file,
+                file_name,
+                i,
+                files_count,
+                steps,
+                reporter,
+                get_finished_steps(i),
+                None if journal is None else reporter,
+            )
+            for i, (file_name, reporter) in enumerate(zip(file_names, reporters), 1)
+        ]
+
+        # steps reported by the workers per file (from 1)
+        reported_steps = [0] * (files_count + 1)
+
+        def handle_message(message: tuple) -> None:
+            if message[0] == "progress":
+                reported_steps[message[1]] += message[2]
+                if progress is not None:
+                    progress.emit(message[2])
+            elif journal is not None:
+                journal.record_step(*message[1:])
+
+        for i, (file_name, future) in enumerate(zip(file_names, pending), 1):
+            # progress of all the workers is reported while waiting for the logs of the next file
+            while True:
+                try:
+                    handle_message(messages_queue.get(timeout=POLL_INTERVAL))
+                except queue.Empty:
+                    if future.done():
+                        break
+
+            try:
+                file_logs, succeeded = future.result()
+                logs.write(file_logs)
+                if not succeeded:
+                    failed_files.append(file_name)
+
+            except Exception as e:
+                # the worker process itself failed (e.g. it ran out of memory)
+                print(f"[FILE {i}/{files_count}]: {file_name}", file=logs)
+                print(f"[ERROR]: {e}", file=logs)
+                print(
+                    "".join(traceback.format_exception(e)),
+                    file=logs,
+                )
+                print(file=logs)
+                failed_files.append(file_name)
+
+                # steps of the file reported before the worker failed are already counted
+                if progress is not None:
+                    progress.emit(len(steps) - reported_steps[i])
+
+            logs.flush()
+
+        # progress of the files finished after the last written one
+        while not messages_queue.empty():
+            handle_message(messages_queue.get())
+
+    return failed_files
+
+
+def run_stitched_pipeline(
+    file_names: List[str],
+    steps: List[Step],
+    logs: TextIO,
+    progress: Optional[ProgressCallback] = None,
+    journal=None,
+) -> List[str]:
+    """
+    A function to apply the pipeline ending with `stitched_decomposition_export` on all the files at once.
+    The maps are processed one after another and kept memory-mapped from temporary files (the checkpoints
+    if there is a journal) for the final step.
+
+    Parameters:
+        file_names (List[str]): Paths to the files.
+        steps (List[Step]): The pipeline.
+        logs (TextIO): Where the logs are written.
+        progress (ProgressCallback): Emitted with the number of finished steps. Default: None.
+        journal (Journal): Journal of the run, the processed maps are checkpointed into it, so that the resumed run
+            does not process them again. Default: None.
+
+    Returns:
+        failed_files (List[str]): Paths to the files that could not be processed, all of them if the final step failed.
+    """
+
+    files_count = len(file_names)
+    steps_count = len(steps)
+    finished_steps = 0
+
+    def update_progress(steps_done: int) -> None:
+        nonlocal finished_steps
+        finished_steps += steps_done
+        if progress is not None:
+            progress.emit(steps_done)
+
+    # the final step is recorded for all the files at once
+    if journal is not None and steps_count - 1 in journal.get_finished_steps(0):
+        print("[FINAL STEP]: stitched decomposition and export", file=logs)
+        print("[FINISHED]", file=logs)
+        print(file=logs)
+        update_progress(files_count * steps_count)
+        return []
+
+    processed_data = []
+    spill_dir = None
+    try:
+        for i, file_name in enumerate(file_names, 1):
+            print(f"[FILE {i}/{files_count}]: {file_name}", file=logs)
+
+            state = None if journal is None else journal.load_checkpoint(i)
+            if state is not None:
+                _log_finished_steps(
+                    steps[:-1], steps_count, logs, FunctionProgress(update_progress)
+                )
+                processed_data.append(SpectralMap(file_name, state=state))
+                continue
+
+            # the processed map is needed, so only the finished outputs are skipped
+            finished_outputs = [
+                step_index
+                for step_index in (
+                    () if journal is None else journal.get_finished_steps(i)
+                )
+                if steps[step_index][1].__name__ in step_cache.OUTPUT_STEPS
+            ]
+            curr_data = _process_map(
+                file_name,
+                steps[:-1],
+                steps_count,
+                logs,
+                FunctionProgress(update_progress),
+                finished_outputs,
+                (
+                    None
+                    if journal is None
+                    else lambda step_index, output: journal.record_step(
+                        i, step_index, output
+                    )
+                ),
+            )
+            if curr_data is None:
+                curr_data = SpectralMap(file_name)
+
+            if journal is not None:
+                journal.save_checkpoint(i, curr_data)
+                state = journal.load_checkpoint(i)
+                if state is not None:
+                    curr_data = SpectralMap(file_name, state=state)
+            else:
+                if spill_dir is None:
+                    spill_dir = tempfile.mkdtemp(
+                        prefix="stitched_", dir=_get_temp_dir()
+                    )
+                curr_data = _spill(file_name, curr_data, spill_dir, str(i))
+            processed_data.append(curr_data)
+
+        print("[FINAL STEP]: stitched decomposition and export", file=logs)
+
+        _, function, params = steps[-1]
+        result = function(processed_data, *params)
+        processed_data.clear()
+
+        print("[SUCCESS]", file=logs)
+        failed_files = []
+
+        if journal is not None:
+            journal.record_step(
+                0, steps_count - 1, _get_output(function, params, result)
+            )
+            journal.remove_checkpoints()
+
+    except Exception as e:
+        em = traceback.format_exc()
+        print(f"[ERROR]: {e}", file=logs)
+        print(em, file=logs)
+        failed_files = list(file_names)
+
+    finally:
+        # the maps are released before their files are removed
+        processed_data.clear()
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+    print(file=logs)
+    logs.flush()
+
+    # the final step and the steps that were not made
+    update_progress(files_count * steps_count - finished_steps)
+
+    return failed_files
+
+
+def run(
+    file_names: List[str],
+    steps: List[Step],
+    logs: TextIO,
+    n_workers: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+    journal=None,
+) -> List[str]:
+    """
+    A function to apply the pipeline on the files, see `run_pipeline` and `run_stitched_pipeline`.
+
+    Returns:
+        failed_files (List[str]): Paths to the files that could not be processed.
+    """
+
+    if steps and steps[-1][1] is stitched_decomposition_export:
+        return run_stitched_pipeline(file_names, steps, logs, progress, journal)
+
+    return run_pipeline(file_names, steps, logs, n_workers, progress, journal)
@@ -0,0 +1,362 @@
+"""
+Conversion cache of the loaded `.mat` files. Spectra are saved as raw `.npy` array (read back memory-mapped,
+i.e. without parsing or copying) and the rest of the MATLAB struct (skeleton without the spectra) together with
+x-axis, units and shape as `.json` metadata. Entries are keyed by path, size and modification time of the source.
+The cache is off by default as it takes a copy of each opened file.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import Callable, Collection, Dict, Optional, Tuple, Union
+
+from ramain.spectra_processing import executor
+from ramain.utils import paths
+from ramain.utils.settings import SETTINGS
+
+CACHE_VERSION = 1
+
+# maximal size (in MB) of the cached spectra, the least recently used entries are removed above it
+DEFAULT_MAX_SIZE = 2 * 1024
+
+
+def is_enabled() -> bool:
+    return SETTINGS.value("cache/enabled", False, type=bool)
+
+
+def get_cache_dir() -> Path:
+    """
+    A function to get the cache directory from the settings (user cache directory by default).
+    """
+
+    return Path(SETTINGS.value("cache/dir", paths.get_user_cache_dir()))
+
+
+def _get_key(source_path: Union[str, Path]) -> str:
+    stat = os.stat(source_path)
+    identity = f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(identity.encode()).hexdigest()
+
+
+def _encode(value) -> dict:
+    """
+    Encodes (part of) MATLAB struct loaded by `scipy.io.loadmat` into JSON serializable form.
+    """
+
+    if not isinstance(value, np.ndarray):
+        value = np.asarray(value)
+
+    if value.dtype.names is not None:  # struct
+        return {
+            "struct": list(value.dtype.names),
+            "shape": value.shape,
+            "items": [
+                [_encode(item[name]) for name in value.dtype.names]
+                for item in value.reshape(-1)
+            ],
+        }
+
+    if value.dtype == object:  # cell
+        return {
+            "cell": [_encode(item) for item in value.reshape(-1)],
+            "shape": value.shape,
+        }
+
+    if value.dtype.kind not in "biufU":
+        raise TypeError(f"values of type {value.dtype} cannot be cached")
+
+    return {"array": value.tolist(), "dtype": value.dtype.str, "shape": value.shape}
+
+
+def _decode(value: dict) -> np.ndarray:
+    """
+    Inverse of `_encode`.
+    """
+
+    if "struct" in value:
+        struct = np.empty(
+            len(value["items"]), dtype=[(name, object) for name in value["struct"]]
+        )
+        for i, item in enumerate(value["items"]):
+            for name, field in zip(value["struct"], item):
+                struct[i][name] = _decode(field)
+        return struct.reshape(value["shape"])
+
+    if "cell" in value:
+        cell = np.empty(len(value["cell"]), dtype=object)
+        for i, item in enumerate(value["cell"]):
+            cell[i] = _decode(item)
+        return cell.reshape(value["shape"])
+
+    return np.array(value["array"], dtype=value["dtype"]).reshape(value["shape"])
+
+
+def read_entry(
+    data_path: Union[str, Path],
+    metadata_path: Union[str, Path],
+    mmap_mode: Optional[str] = "c",
+) -> Optional[Tuple[dict, np.ndarray]]:
+    """
+    A function to read the entry of the cache (or any `.npy` spectra with `.json` metadata in the cache format).
+
+    Parameters:
+        data_path (str | Path): Path to the `.npy` spectra.
+        metadata_path (str | Path): Path to the `.json` metadata.
+        mmap_mode (str): See `np.load`, spectra are read into memory if None. Default: 'c'.
+
+    Returns:
+        entry (Tuple[dict, np.ndarray] | None): MATLAB dict (with empty spectra field) and 3D spectra,
+            None if the entry cannot be read.
+    """
+
+    try:
+        with open(metadata_path, "r") as file:
+            metadata = json.load(file)
+
+        if metadata["version"] != CACHE_VERSION:
+            return None
+
+        data = np.load(data_path, mmap_mode=mmap_mode)
+        mdict = {metadata["name"]: _decode(metadata["struct"])}
+
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return mdict, data
+
+
+def load(
+    source_path: Union[str, Path], cache_dir: Optional[Path] = None
+) -> Optional[Tuple[dict, np.ndarray]]:
+    """
+    A function to load cached conversion of the `source_path` file.
+
+    Parameters:
+        source_path (str | Path): Path to the source `.mat` file.
+        cache_dir (Path): Cache directory, taken from the settings if not provided. Default: None.
+
+    Returns:
+        cached (Tuple[dict, np.ndarray] | None): MATLAB dict (with empty spectra field) and 3D spectra memory-mapped
+            copy-on-write (changes are not written to the cache), None if the file is not cached.
+    """
+
+    cache_dir = get_cache_dir() if cache_dir is None else Path(cache_dir)
+    key = _get_key(source_path)
+    data_path = cache_dir.joinpath(f"{key}.npy")
+    metadata_path = cache_dir.joinpath(f"{key}.json")
+
+    if not (data_path.exists() and metadata_path.exists()):
+        return None
+
+    entry = read_entry(data_path, metadata_path)
+    if entry is None:
+        return None
+
+    # mark the entry as recently used
+    os.utime(data_path)
+
+    return entry
+
+
+def load_metadata(
+    source_path: Union[str, Path], cache_dir: Optional[Path] = None
+) -> Optional[Tuple[dict, np.dtype]]:
+    """
+    A function to load the metadata of cached conversion of the `source_path` file without its spectra.
+
+    Parameters:
+        source_path (str | Path): Path to the source `.mat` file.
+        cache_dir (Path): Cache directory, taken from the settings if not provided. Default: None.
+
+    Returns:
+        cached (Tuple[dict, np.dtype] | None): The metadata (see `save`) and dtype of the spectra,
+            None if the file is not cached.
+    """
+
+    cache_dir = get_cache_dir() if cache_dir is None else Path(cache_dir)
+    key = _get_key(source_path)
+    data_path = cache_dir.joinpath(f"{key}.npy")
+    metadata_path = cache_dir.joinpath(f"{key}.json")
+
+    try:
+        with open(metadata_path, "r") as file:
+            metadata = json.load(file)
+
+        if metadata["version"] != CACHE_VERSION:
+            return None
+
+        # only the header of the `.npy` file is read
+        with open(data_path, "rb") as file:
+            read_header = (
+                np.lib.format.read_array_header_1_0
+                if np.lib.format.read_magic(file) == (1, 0)
+                else np.lib.format.read_array_header_2_0
+            )
+            _, _, dtype = read_header(file)
+
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return metadata, dtype
+
+
+def save(
+    source_path: Union[str, Path],
+    mdict: dict,
+    data,
+    data_field: int,
+    units: str,
+    x_axis: np.ndarray,
+    cache_dir: Optional[Path] = None,
+) -> Optional[np.ndarray]:
+    """
+    A function to save the conversion of the `source_path` file into the cache.
+    Caching is optional, so the entry is just not created if the conversion cannot be saved.
+
+    Parameters:
+        source_path (str | Path): Path to the source `.mat` file.
+        mdict (dict): MATLAB dict as loaded by `scipy.io.loadmat`.
+        data (np.ndarray | MatlabHDF5Array): 3D spectra, lazy array is copied by blocks of rows.
+        data_field (int): Position of the spectra field in the struct, it is not saved into the metadata.
+        units (str): Units of the x-axis.
+        x_axis (np.ndarray): Values of the x-axis.
+        cache_dir (Path): Cache directory, taken from the settings if not provided. Default: None.
+
+    Returns:
+        data (np.ndarray | None): The cached spectra memory-mapped copy-on-write, None if they were not cached.
+    """
+
+    cache_dir = get_cache_dir() if cache_dir is None else Path(cache_dir)
+    key = _get_key(source_path)
+
+    try:
+        name = list(mdict)[-1]
+        skeleton = mdict[name].copy()
+        skeleton[0, 0][data_field] = np.empty((0, 0))
+
+        metadata = {
+            "version": CACHE_VERSION,
+            "source": os.path.abspath(source_path),
+            "name": name,
+            "shape": data.shape,
+            "units": str(units),
+            "x_axis": x_axis.tolist(),
+            "struct": _encode(skeleton),
+        }
+
+    except (TypeError, ValueError):
+        return None
+
+    def write_data(path: Path) -> None:
+        cached_data = np.lib.format.open_memmap(
+            path, mode="w+", dtype=data.dtype, shape=data.shape
+        )
+        for rows in executor.iterate_row_slices(cached_data, temporaries=1):
+            cached_data[rows] = data[rows]
+        cached_data.flush()
+
+    if not write_entry(
+        cache_dir,
+        key,
+        {".npy": write_data, ".json": lambda path: write_json(path, metadata)},
+    ):
+        return None
+
+    evict(cache_dir, "cache/max_size", DEFAULT_MAX_SIZE, keep=(key,))
+
+    return np.load(cache_dir.joinpath(f"{key}.npy"), mmap_mode="c")
+
+
+def write_json(file_path: Path, value) -> None:
+    with open(file_path, "w") as file:
+        json.dump(value, file)
+
+
+def write_entry(
+    cache_dir: Path, key: str, writers: Dict[str, Callable[[Path], None]]
+) -> bool:
+    """
+    A function to write files of the cache entry. They are written into temporary files first, so that interrupted
+    saving does not leave broken entry, and the temporary files are per process as more processes may save
+    the same entry at once.
+
+    Parameters:
+        cache_dir (Path): Cache directory.
+        key (str): Key of the entry, the files are named by it.
+        writers (Dict[str, Callable[[Path], None]]): Suffix of the file -> function writing it into the given path.
+            Files are moved into place in this order, so the last one completes the entry.
+
+    Returns:
+        written (bool): Whether the entry was written.
+    """
+
+    temp_paths = {
+        suffix: cache_dir.joinpath(f"{key}.{os.getpid()}.tmp{suffix}")
+        for suffix in writers
+    }
+
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+        for suffix, write in writers.items():
+            write(temp_paths[suffix])
+
+        for suffix, temp_path in temp_paths.items():
+            os.replace(temp_path, cache_dir.joinpath(f"{key}{suffix}"))
+
+    except (OSError, TypeError, ValueError):
+        for temp_path in temp_paths.values():
+            temp_path.unlink(missing_ok=True)
+        return False
+
+    return True
+
+
+def evict(
+    cache_dir: Path,
+    max_size_key: str,
+    default_max_size: int,
+    keep: Collection[str] = (),
+    suffixes: Collection[str] = (".json",),
+) -> None:
+    """
+    A function to remove the least recently used entries while the spectra (`.npy` files) in the cache directory
+    are larger than its maximal size.
+
+    Parameters:
+        cache_dir (Path): Cache directory.
+        max_size_key (str): Settings key of the maximal size (in MB).
+        default_max_size (int): Maximal size (in MB) if it is not set.
+        keep (Collection[str]): Keys of the entries that are not to be removed. Default: ().
+        suffixes (Collection[str]): Suffixes of the other files of the entries. Default: ('.json',).
+    """
+
+    max_size = int(SETTINGS.value(max_size_key, default_max_size)) * 1024**2
+
+    # other processes may add or remove the entries meanwhile
+    entries = []
+    for data_path in cache_dir.glob("*.npy"):
+        try:
+            entries.append((data_path, data_path.stat()))
+        except FileNotFoundError:
+            continue
+
+    entries.sort(key=lambda entry: entry[1].st_mtime)
+    size = sum(stat.st_size for _, stat in entries)
+
+    for data_path, stat in entries:
+        if size <= max_size:
+            break
+        if data_path.stem in keep or data_path.stem.endswith(".tmp"):
+            continue
+
+        # the spectra may be memory-mapped by an open map (and cannot be removed on Windows then)
+        try:
+            data_path.unlink(missing_ok=True)
+            for suffix in suffixes:
+                data_path.with_suffix(suffix).unlink(missing_ok=True)
+        except OSError:
+            continue
+        size -= stat.st_size
@@ -0,0 +1,365 @@
+"""
+Undo/redo history of the `SpectralMap` edits. Each entry keeps only what is needed to revert its step:
+the spectra of the changed pixels (spike removal), reference to the replaced data (cropping, linearization, ...)
+or compressed snapshot of the data changed in place (background removal, smoothing).
+Reverting an entry gives the entry that redoes the step, so both directions are symmetric.
+"""
+
+import os
+import zlib
+import numpy as np
+from collections import deque
+from concurrent import futures
+from typing import List, Optional
+
+from ramain.utils.settings import SETTINGS
+
+# memory (in MB) the history may take, the oldest entries are removed above it
+DEFAULT_MEMORY_BUDGET = 1024
+
+# zlib level of the snapshots, 0 stores them uncompressed
+DEFAULT_COMPRESSION = 1
+
+# byte planes that do not compress at least to this ratio (noise in the low bytes of the floats) are stored as they are
+MIN_COMPRESSION_RATIO = 0.9
+SAMPLE_SIZE = 1 << 16
+
+
+def get_memory_budget() -> int:
+    """
+    A function to get the memory budget of the history from the settings.
+
+    Returns:
+        memory_budget (int): Memory budget in bytes.
+    """
+
+    memory_budget = int(SETTINGS.value("history/memory_budget", DEFAULT_MEMORY_BUDGET))
+    return memory_budget * 1024**2
+
+
+def _compress_plane(plane: np.ndarray, level: int) -> bytes:
+    """
+    Compresses one byte plane, returns None if it is not worth it.
+    """
+
+    sample = plane[:SAMPLE_SIZE].tobytes()
+    if len(zlib.compress(sample, level)) > MIN_COMPRESSION_RATIO * len(sample):
+        return None
+    return zlib.compress(plane.tobytes(), level)
+
+
+class _Snapshot:
+    """
+    Copy of an array, compressed by byte planes (the bytes of the same significance are compressed together,
+    which works well for the sign and exponent bytes of the floats).
+    """
+
+    def __init__(self, array: np.ndarray, level: int) -> None:
+        self.shape = array.shape
+        self.dtype = array.dtype
+
+        if level == 0:
+            self.planes = None
+            self.data = np.array(array)
+            self.nbytes = self.data.nbytes
+            return
+
+        planes = (
+            np.ascontiguousarray(array).view(np.uint8).reshape((-1, array.itemsize))
+        )
+        planes = np.ascontiguousarray(planes.T)
+
+        # zlib releases GIL, so the planes are compressed in parallel
+        with futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as pool:
+            compressed = list(
+                pool.map(lambda plane: _compress_plane(plane, level), planes)
+            )
+
+        self.planes = [
+            plane.copy() if data is None else data
+            for plane, data in zip(planes, compressed)
+        ]
+        self.nbytes = sum(len(plane) for plane in self.planes)
+
+    def restore(self, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Restores the array, into `out` if it is provided.
+        """
+
+        if self.planes is None:
+            values = self.data
+        else:
+            planes = np.empty((self.dtype.itemsize, int(np.prod(self.shape))), np.uint8)
+            for i, plane in enumerate(self.planes):
+                planes[i] = (
+                    np.frombuffer(zlib.decompress(plane), np.uint8)
+                    if isinstance(plane, bytes)
+                    else plane
+                )
+            values = np.ascontiguousarray(planes.T).view(self.dtype).reshape(self.shape)
+
+        if out is None:
+            return values
+        out[...] = values
+        return out
+
+
+class _Entry:
+    """
+    Base class of the history entries.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def get_nbytes(self, spectral_map) -> int:
+        """
+        Memory the entry takes in addition to the current data of the `spectral_map`.
+        """
+
+        return 0
+
+    def revert(self, spectral_map) -> "_Entry":
+        """
+        Reverts the step on the `spectral_map` and returns the entry that redoes it.
+        """
+
+        raise NotImplementedError
+
+
+class _PixelsEntry(_Entry):
+    """
+    Spectra of the pixels that have been changed in place.
+    """
+
+    def __init__(self, name: str, spectral_map, x: np.ndarray, y: np.ndarray) -> None:
+        super().__init__(name)
+        self.x, self.y = x, y
+        self.spectra = spectral_map.data[x, y].copy()
+
+    def get_nbytes(self, spectral_map) -> int:
+        return self.spectra.nbytes
+
+    def revert(self, spectral_map) -> _Entry:
+        inverse = _PixelsEntry(self.name, spectral_map, self.x, self.y)
+
+        spectral_map.data[self.x, self.y] = self.spectra
+        spectral_map.mark_dirty(self.x, self.y)
+        spectral_map._reset_info()
+
+        return inverse
+
+
+class _ReferenceEntry(_Entry):
+    """
+    Data and x-axis that have been replaced by the step. No copy is needed as the replaced data are not changed anymore.
+    """
+
+    def __init__(self, name: str, spectral_map) -> None:
+        super().__init__(name)
+        self.data = spectral_map._data
+        self.x_axis = spectral_map.x_axis
+
+    def get_nbytes(self, spectral_map) -> int:
+        # cropped data are views of the replaced ones and lazy data are on the disk
+        if not isinstance(self.data, np.ndarray) or np.may_share_memory(
+            self.data, spectral_map._data
+        ):
+            return 0
+        return self.data.nbytes
+
+    def revert(self, spectral_map) -> _Entry:
+        inverse = _ReferenceEntry(self.name, spectral_map)
+
+        spectral_map.data = self.data
+        spectral_map.x_axis = self.x_axis
+
+        return inverse
+
+
+class _SnapshotEntry(_Entry):
+    """
+    Compressed copy of the data that are changed in place by the step.
+    """
+
+    def __init__(self, name: str, spectral_map, level: int) -> None:
+        super().__init__(name)
+        # the same array is restored, so that the views of it (e.g. cropped map) stay consistent
+        self.target = spectral_map.data
+        self.snapshot = _Snapshot(self.target, level)
+        self.x_axis = spectral_map.x_axis
+        self.level = level
+
+    def get_nbytes(self, spectral_map) -> int:
+        return self.snapshot.nbytes
+
+    def revert(self, spectral_map) -> _Entry:
+        inverse = _SnapshotEntry(self.name, spectral_map, self.level)
+
+        if spectral_map._data is self.target:
+            self.snapshot.restore(out=self.target)
+            spectral_map.data = self.target
+        else:
+            spectral_map.data = self.snapshot.restore()
+        spectral_map.x_axis = self.x_axis
+
+        return inverse
+
+
+class History:
+    """
+    Undo/redo history of the edits of one `SpectralMap` within a memory budget.
+    """
+
+    def __init__(
+        self, memory_budget: Optional[int] = None, compression: Optional[int] = None
+    ) -> None:
+        """
+        The constructor of the history.
+
+        Parameters:
+            memory_budget (int): Memory budget in bytes, taken from the settings if not provided. Default: None.
+            compression (int): zlib level of the snapshots (0 - no compression), taken from the settings
+                if not provided. Default: None.
+        """
+
+        self.memory_budget = (
+            get_memory_budget() if memory_budget is None else memory_budget
+        )
+        self.compression = (
+            int(SETTINGS.value("history/compression", DEFAULT_COMPRESSION))
+            if compression is None
+            else compression
+        )
+
+        self._undo = deque()
+        self._redo = []
+
+    def can_undo(self) -> bool:
+        return len(self._undo) > 0
+
+    def can_redo(self) -> bool:
+        return len(self._redo) > 0
+
+    def get_names(self) -> List[str]:
+        """
+        A function to get names of the steps that can be undone, the oldest first.
+        """
+
+        return [entry.name for entry in self._undo]
+
+    def clear(self) -> None:
+        self._undo.clear()
+        self._redo.clear()
+
+    def record_pixels(self, name: str, spectral_map, x, y) -> None:
+        """
+        A function to record the step that changes spectra of the given pixels in place.
+
+        Parameters:
+            name (str): Name of the step.
+            spectral_map (SpectralMap): The map before the step.
+            x (np.ndarray): x coordinates (rows) of the pixels.
+            y (np.ndarray): y coordinates (columns) of the pixels.
+        """
+
+        x, y = np.atleast_1d(x), np.atleast_1d(y)
+        self._push(_PixelsEntry(name, spectral_map, x, y), spectral_map)
+
+    def record_replace(self, name: str, spectral_map) -> None:
+        """
+        A function to record the step that replaces the data (and x-axis) of the map by new ones.
+
+        Parameters:
+            name (str): Name of the step.
+            spectral_map (SpectralMap): The map before the step.
+        """
+
+        self._push(_ReferenceEntry(name, spectral_map), spectral_map)
+
+    def record_snapshot(self, name: str, spectral_map) -> None:
+        """
+        A function to record the step that changes the whole data in place.
+
+        Parameters:
+            name (str): Name of the step.
+            spectral_map (SpectralMap): The map before the step.
+        """
+
+        # the data would be evicted right away, so they are not copied at all
+        if self.compression == 0 and spectral_map.data.nbytes > self.memory_budget:
+            self.clear()
+            return
+
+        self._push(_SnapshotEntry(name, spectral_map, self.compression), spectral_map)
+
+    def undo(self, spectral_map) -> Optional[str]:
+        """
+        A function to revert the last step.
+
+        Parameters:
+            spectral_map (SpectralMap): The map the history belongs to.
+
+        Returns:
+            name (str | None): Name of the reverted step, None if there is nothing to undo.
+        """
+
+        if not self._undo:
+            return None
+
+        entry = self._undo.pop()
+        self._redo.append(entry.revert(spectral_map))
+        self.evict(spectral_map)
+
+        return entry.name
+
+    def redo(self, spectral_map) -> Optional[str]:
+        """
+        A function to apply the last reverted step again.
+
+        Parameters:
+            spectral_map (SpectralMap): The map the history belongs to.
+
+        Returns:
+            name (str | None): Name of the step, None if there is nothing to redo.
+        """
+
+        if not self._redo:
+            return None
+
+        entry = self._redo.pop()
+        self._undo.append(entry.revert(spectral_map))
+        self.evict(spectral_map)
+
+        return entry.name
+
+    def get_nbytes(self, spectral_map) -> int:
+        """
+        A function to get the memory the history takes in addition to the current data of the `spectral_map`.
+        """
+
+        return sum(
+            entry.get_nbytes(spectral_map) for entry in list(self._undo) + self._redo
+        )
+
+    def _push(self, entry: _Entry, spectral_map) -> None:
+        # NOTE: steps are recorded before they are applied, `evict` has to be called after
+        self._undo.append(entry)
+        self._redo.clear()
+
+    def evict(self, spectral_map) -> None:
+        """
+        A function to remove the oldest entries (the farthest ones from the current state) while the history
+        is over the budget.
+
+        Parameters:
+            spectral_map (SpectralMap): The map the history belongs to.
+        """
+
+        while self.get_nbytes(spectral_map) > self.memory_budget:
+            if self._undo:
+                self._undo.popleft()
+            elif self._redo:
+                self._redo.pop(0)
+            else:
+                break
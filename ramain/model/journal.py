@@ -0,0 +1,268 @@
+"""
+Journal of the batch runs, so that the run interrupted by a crash (or reboot) can be resumed without making
+the finished work again. The journal is JSON lines file written next to the logs: the header with the files
+and the pipeline is followed by a record of each finished (file, step) pair with where its outputs went.
+Every record is flushed to the disk once it is written, a partially written last record is ignored.
+Maps processed by the stitched pipelines are checkpointed into a directory next to the journal until
+the final step is finished.
+"""
+
+import os
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from ramain.model import batch, pipeline, step_cache
+from ramain.model.spectal_map import SpectralMap
+
+JOURNAL_VERSION = 1
+
+JOURNAL_EXTENSION = ".journal.jsonl"
+
+
+class JournalError(ValueError):
+    """
+    Raised if the journal cannot be resumed.
+    """
+
+
+def get_journal_path(logs_path: Union[str, Path]) -> str:
+    """
+    A function to get path to the journal of the run with the given logs file.
+    """
+
+    return os.path.splitext(logs_path)[0] + JOURNAL_EXTENSION
+
+
+def _get_all_params(method: str, params: Union[list, dict]) -> dict:
+    """
+    Named parameters of the step including the defaults in the form read back from the journal, so that
+    the steps from the GUI (positional parameters without the defaults) and the resumed steps
+    (see `pipeline.get_positional_params`) are the same.
+    """
+
+    step = pipeline.make_step(method, params)
+    params = pipeline.make_step(method, pipeline.get_positional_params(step)).params
+
+    return json.loads(json.dumps(params, default=repr))
+
+
+def _describe_steps(steps: List[batch.Step]) -> List[dict]:
+    """
+    Describes the steps in the form of the pipeline files.
+    """
+
+    return [
+        {
+            "method": function.__name__,
+            "params": _get_all_params(function.__name__, params),
+            "label": step_text,
+        }
+        for step_text, function, params in steps
+    ]
+
+
+def _read_records(file_path: Union[str, Path]) -> List[dict]:
+    records = []
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            # the last record may have been interrupted
+            if not line.endswith("\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+
+    if not records or records[0].get("type") != "header":
+        raise JournalError(f"{file_path}: file is not a batch journal.")
+    if records[0].get("version") != JOURNAL_VERSION:
+        raise JournalError(f"{file_path}: journal version is not supported.")
+
+    return records
+
+
+def read_header(
+    file_path: Union[str, Path],
+) -> Tuple[List[str], List[pipeline.PipelineStep], List[str]]:
+    """
+    A function to read the files and the pipeline of the journaled run, e.g. to resume it.
+
+    Parameters:
+        file_path (str | Path): Path to the journal.
+
+    Returns:
+        header (Tuple[List[str], List[PipelineStep], List[str]]): Paths to the files, the pipeline
+            and texts of its steps.
+    """
+
+    header = _read_records(file_path)[0]
+    steps = [
+        pipeline.make_step(step["method"], step["params"]) for step in header["steps"]
+    ]
+    labels = [step["label"] for step in header["steps"]]
+
+    return header["files"], steps, labels
+
+
+class Journal:
+    """
+    Journal of one batch run, see `batch.run`. It is used from the thread that runs the batch.
+    """
+
+    def __init__(
+        self,
+        file_path: Union[str, Path],
+        file_names: List[str],
+        steps: List[batch.Step],
+        resume: bool = False,
+    ) -> None:
+        """
+        The constructor of the journal.
+
+        Parameters:
+            file_path (str | Path): Path to the journal.
+            file_names (List[str]): Paths to the files of the run.
+            steps (List[batch.Step]): The pipeline of the run.
+            resume (bool): Whether to continue the journal of the interrupted run (its files and pipeline
+                have to be the same), new journal is started otherwise. Default: False.
+        """
+
+        self.file_path = Path(file_path)
+        self.checkpoints_dir = Path(
+            str(self.file_path).removesuffix(JOURNAL_EXTENSION) + "_checkpoints"
+        )
+
+        # file index (from 1, 0 for the steps of all the files) -> step index -> output
+        self._finished: Dict[int, Dict[int, Optional[str]]] = {}
+        self._checkpoints = set()
+
+        header = {
+            "type": "header",
+            "version": JOURNAL_VERSION,
+            "files": [str(file_name) for file_name in file_names],
+            "steps": _describe_steps(steps),
+        }
+
+        if resume:
+            records = _read_records(self.file_path)
+            if records[0]["files"] != header["files"]:
+                raise JournalError(
+                    f"{self.file_path}: files differ from the journaled run."
+                )
+            if [
+                (step["method"], _get_all_params(step["method"], step["params"]))
+                for step in records[0]["steps"]
+            ] != [(step["method"], step["params"]) for step in header["steps"]]:
+                raise JournalError(
+                    f"{self.file_path}: pipeline differs from the journaled run."
+                )
+
+            for record in records[1:]:
+                if record["type"] == "step":
+                    self._finished.setdefault(record["file"], {})[record["step"]] = (
+                        record["output"]
+                    )
+                elif record["type"] == "checkpoint":
+                    self._checkpoints.add(record["file"])
+
+            # the interrupted record is overwritten
+            os.truncate(self.file_path, self._get_records_end(records))
+            self._file = open(self.file_path, "a", encoding="utf-8")
+        else:
+            self._file = open(self.file_path, "w", encoding="utf-8")
+            self._write(header)
+
+    def _get_records_end(self, records: List[dict]) -> int:
+        with open(self.file_path, "rb") as file:
+            end = 0
+            for _ in records:
+                end += len(file.readline())
+        return end
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, default=repr) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def get_finished_steps(self, file_index: int) -> Dict[int, Optional[str]]:
+        """
+        A function to get the finished steps of the file and where their outputs went.
+
+        Parameters:
+            file_index (int): Position of the file in the batch (from 1), 0 for the steps of all the files.
+
+        Returns:
+            finished_steps (Dict[int, str | None]): Index of the step -> its output (path or directory).
+        """
+
+        return dict(self._finished.get(file_index, {}))
+
+    def record_step(
+        self, file_index: int, step_index: int, output: Optional[str] = None
+    ) -> None:
+        """
+        A function to record the finished step.
+
+        Parameters:
+            file_index (int): Position of the file in the batch (from 1), 0 for the steps of all the files.
+            step_index (int): Index of the step in the pipeline.
+            output (str): Where the outputs of the step went. Default: None.
+        """
+
+        self._finished.setdefault(file_index, {})[step_index] = output
+        self._write(
+            {"type": "step", "file": file_index, "step": step_index, "output": output}
+        )
+
+    def save_checkpoint(self, file_index: int, spectral_map: SpectralMap) -> None:
+        """
+        A function to save the processed map, so that it is not processed again by the resumed run.
+        The checkpoint is optional, so it is just not recorded if it cannot be saved.
+
+        Parameters:
+            file_index (int): Position of the file in the batch (from 1).
+            spectral_map (SpectralMap): The processed map.
+        """
+
+        if step_cache.save(
+            str(file_index),
+            spectral_map.get_state(),
+            cache_dir=self.checkpoints_dir,
+            evict=False,
+        ):
+            self._checkpoints.add(file_index)
+            self._write({"type": "checkpoint", "file": file_index})
+
+    def load_checkpoint(self, file_index: int) -> Optional[step_cache.State]:
+        """
+        A function to load the processed map saved by `save_checkpoint`.
+
+        Parameters:
+            file_index (int): Position of the file in the batch (from 1).
+
+        Returns:
+            state (step_cache.State | None): State of the processed map, None if there is no checkpoint.
+        """
+
+        if file_index not in self._checkpoints:
+            return None
+        return step_cache.load(str(file_index), cache_dir=self.checkpoints_dir)
+
+    def remove_checkpoints(self) -> None:
+        """
+        A function to remove the checkpoints once they are not needed.
+        """
+
+        shutil.rmtree(self.checkpoints_dir, ignore_errors=True)
+        self._checkpoints.clear()
@@ -0,0 +1,404 @@
+"""
+Registry of the readers of the spectral maps. Format of the file is detected from its first bytes (magic numbers
+and header fields) and the file is read by the first registered reader that accepts it. Readers return the spectra
+either read into memory (eager) or kept on the disk and read by blocks when they are indexed (lazy).
+"""
+
+import json
+import struct
+import zipfile
+import scipy.io
+import numpy as np
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+from ramain.model import cache, matlab_hdf5
+
+# positions of the fields in the WITec struct
+SHAPE_FIELD = 5
+DATA_FIELD = 7
+AXIS_FIELD = 9
+N_FIELDS = 12
+
+# number of bytes the formats are detected from (HDF5 signature of v7.3 files is after 512 bytes long header)
+SNIFF_SIZE = 1024
+
+MATLAB_V5_MAGIC = b"MATLAB 5.0 MAT-file"
+NPY_MAGIC = b"\x93NUMPY"
+ZIP_MAGIC = b"PK\x03\x04"
+
+# names of the arrays in `.npz` files
+NPZ_DATA = "data"
+NPZ_X_AXIS = "x_axis"
+NPZ_UNITS = "units"
+
+
+class FormatError(ValueError):
+    """
+    Error of the file that is not in any of the registered formats or does not have the expected structure.
+    """
+
+
+class LoadedMap(NamedTuple):
+    """
+    Spectral map read by a `Reader`.
+
+    Attributes:
+        mdict (dict): MATLAB dict with WITec struct the map is saved with, its spectra field may be empty.
+        data (np.ndarray | MatlabHDF5Array): 3D spectra (rows, columns, points).
+        x_axis (np.ndarray): Values of the x-axis.
+        units (np.ndarray): Units of the x-axis.
+    """
+
+    mdict: dict
+    data: np.ndarray
+    x_axis: np.ndarray
+    units: np.ndarray
+
+
+def read_witec_fields(
+    file_path: Union[str, Path], mdict: dict
+) -> Tuple[Tuple[int, int], np.ndarray, np.ndarray]:
+    """
+    A function to read the shape of the map, x-axis and its units from the WITec struct.
+
+    Parameters:
+        file_path (str | Path): Path to the file the struct has been read from (for the error message).
+        mdict (dict): MATLAB dict as loaded by `scipy.io.loadmat`, the last variable is the struct.
+
+    Returns:
+        fields (Tuple[Tuple[int, int], np.ndarray, np.ndarray]): Number of rows and columns of the map, x-axis and units.
+    """
+
+    try:
+        matlab_data = mdict[list(mdict)[-1]][0, 0]
+        # WITec stores the size of the map as (columns, rows)
+        columns, rows = (int(size) for size in matlab_data[SHAPE_FIELD][0])
+        units = matlab_data[AXIS_FIELD][1][1]
+        x_axis = matlab_data[AXIS_FIELD][1][0][0]
+
+    except (IndexError, KeyError, TypeError, ValueError) as e:
+        raise FormatError(f"{file_path}: file does not have WITec structure; {e}")
+
+    return (rows, columns), x_axis, units
+
+
+def make_mdict(
+    map_shape: Tuple[int, int], x_axis: np.ndarray, units: np.ndarray
+) -> dict:
+    """
+    A function to make MATLAB dict with minimal WITec struct, so that maps read from other formats can be saved
+    into `.mat` files.
+
+    Parameters:
+        map_shape (Tuple[int, int]): Number of rows and columns of the map.
+        x_axis (np.ndarray): Values of the x-axis.
+        units (np.ndarray): Units of the x-axis.
+
+    Returns:
+        mdict (dict): MATLAB dict with the struct, its spectra field is empty.
+    """
+
+    matlab_struct = np.empty((1, 1), dtype=[(f"f{i}", object) for i in range(N_FIELDS)])
+    for i in range(N_FIELDS):
+        matlab_struct[0, 0][i] = np.zeros((1, 1))
+
+    axis = np.empty((2, 2), dtype=object)
+    axis[0, 0], axis[0, 1] = np.zeros((1, 1)), np.array([""])
+    axis[1, 0], axis[1, 1] = np.reshape(x_axis, (1, -1)), np.asarray(units)
+
+    matlab_struct[0, 0][SHAPE_FIELD] = np.array([map_shape[::-1]], dtype=np.int32)
+    matlab_struct[0, 0][DATA_FIELD] = np.empty((0, 0))
+    matlab_struct[0, 0][AXIS_FIELD] = axis
+
+    return {"map": matlab_struct}
+
+
+def _check_cube(file_path: Union[str, Path], data: np.ndarray) -> None:
+    if data.ndim != 3 or data.dtype.kind not in "iuf":
+        raise FormatError(
+            f"{file_path}: expected 3D numeric array (rows, columns, points), got {data.ndim}D {data.dtype}"
+        )
+
+
+def _memmap_npz_member(
+    file_path: Union[str, Path], member: str
+) -> Optional[np.ndarray]:
+    """
+    Memory-maps the `member` array of `.npz` file copy-on-write, if it is stored without compression.
+    """
+
+    with zipfile.ZipFile(file_path) as archive:
+        info = archive.getinfo(member)
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+
+    with open(file_path, "rb") as file:
+        # the array follows the local header of the member, its extra field can differ from the central directory
+        file.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", file.read(4))
+        file.seek(info.header_offset + 30 + name_length + extra_length)
+
+        read_header = (
+            np.lib.format.read_array_header_1_0
+            if np.lib.format.read_magic(file) == (1, 0)
+            else np.lib.format.read_array_header_2_0
+        )
+        shape, fortran_order, dtype = read_header(file)
+        offset = file.tell()
+
+    if fortran_order or dtype.hasobject:
+        return None
+
+    return np.memmap(file_path, dtype=dtype, mode="c", offset=offset, shape=shape)
+
+
+class Reader:
+    """
+    Base class of the readers of one format.
+    """
+
+    name = ""
+    extensions: Tuple[str, ...] = ()
+    # whether the conversions of the files are worth caching (see `cache`)
+    cacheable = False
+
+    def sniff(self, file_path: Path, header: bytes) -> bool:
+        """
+        A function to detect whether the file is in the format of the reader.
+
+        Parameters:
+            file_path (Path): Path to the file.
+            header (bytes): First (at most `SNIFF_SIZE`) bytes of the file.
+
+        Returns:
+            accepted (bool): Whether the reader can read the file.
+        """
+
+        raise NotImplementedError
+
+    def read(self, file_path: Path, lazy: bool = False) -> LoadedMap:
+        """
+        A function to read the spectral map.
+
+        Parameters:
+            file_path (Path): Path to the file.
+            lazy (bool): Whether the spectra should be kept on the disk if the format allows it. Default: False.
+
+        Returns:
+            loaded (LoadedMap): The read map.
+        """
+
+        raise NotImplementedError
+
+
+class WITecReader(Reader):
+    """
+    MATLAB v5 and v7.3 (HDF5) files exported by WITec software, spectra of v7.3 files can be read lazily.
+    """
+
+    name = "WITec MATLAB"
+    extensions = (".mat",)
+    cacheable = True
+
+    def sniff(self, file_path: Path, header: bytes) -> bool:
+        return header.startswith(MATLAB_V5_MAGIC) or (
+            header[
+                matlab_hdf5.HDF5_SIGNATURE_OFFSET : matlab_hdf5.HDF5_SIGNATURE_OFFSET
+                + len(matlab_hdf5.HDF5_SIGNATURE)
+            ]
+            == matlab_hdf5.HDF5_SIGNATURE
+        )
+
+    def read(self, file_path: Path, lazy: bool = False) -> LoadedMap:
+        if matlab_hdf5.is_hdf5_matlab(file_path):
+            # spectra stay on the disk
+            mdict, data_path = matlab_hdf5.loadmat(file_path, DATA_FIELD)
+        else:
+            mdict, data_path = {}, None
+            scipy.io.loadmat(file_path, mdict=mdict)
+
+        map_shape, x_axis, units = read_witec_fields(file_path, mdict)
+
+        try:
+            if data_path is not None:
+                data = matlab_hdf5.MatlabHDF5Array(file_path, data_path, map_shape)
+                if not lazy:
+                    data = np.asarray(data)
+            else:
+                data = np.reshape(
+                    mdict[list(mdict)[-1]][0, 0][DATA_FIELD], map_shape + (-1,)
+                )
+
+        except ValueError as e:
+            raise FormatError(f"{file_path}: spectra do not match the map shape; {e}")
+
+        return LoadedMap(mdict, data, x_axis, units)
+
+
+class CacheReader(Reader):
+    """
+    Spectra as `.npy` array with `.json` metadata of the same name, i.e. the format of the conversion cache.
+    """
+
+    name = "RamAIn cache"
+    extensions = (".npy",)
+
+    def sniff(self, file_path: Path, header: bytes) -> bool:
+        if not header.startswith(NPY_MAGIC):
+            return False
+
+        try:
+            with open(file_path.with_suffix(".json"), "r") as file:
+                metadata = json.load(file)
+            return isinstance(metadata, dict) and "struct" in metadata
+        except (OSError, ValueError):
+            return False
+
+    def read(self, file_path: Path, lazy: bool = False) -> LoadedMap:
+        entry = cache.read_entry(
+            file_path, file_path.with_suffix(".json"), "c" if lazy else None
+        )
+        if entry is None:
+            raise FormatError(f"{file_path}: invalid or outdated cache metadata")
+
+        mdict, data = entry
+        _, x_axis, units = read_witec_fields(file_path, mdict)
+        _check_cube(file_path, data)
+
+        return LoadedMap(mdict, data, x_axis, units)
+
+
+class NumpyReader(Reader):
+    """
+    Plain 3D (rows, columns, points) `.npy` array, x-axis are indices of the points.
+    """
+
+    name = "NumPy array"
+    extensions = (".npy",)
+
+    def sniff(self, file_path: Path, header: bytes) -> bool:
+        return header.startswith(NPY_MAGIC)
+
+    def read(self, file_path: Path, lazy: bool = False) -> LoadedMap:
+        data = np.load(file_path, mmap_mode="c" if lazy else None)
+        _check_cube(file_path, data)
+
+        x_axis = np.arange(data.shape[2], dtype=np.float64)
+        units = np.array([""])
+
+        return LoadedMap(make_mdict(data.shape[:2], x_axis, units), data, x_axis, units)
+
+
+class NumpyArchiveReader(Reader):
+    """
+    `.npz` archive with 3D `data` array and optional `x_axis` and `units`. Spectra are memory-mapped if lazy
+    and stored without compression.
+    """
+
+    name = "NumPy archive"
+    extensions = (".npz",)
+
+    def sniff(self, file_path: Path, header: bytes) -> bool:
+        if not header.startswith(ZIP_MAGIC):
+            return False
+
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                return f"{NPZ_DATA}.npy" in archive.namelist()
+        except zipfile.BadZipFile:
+            return False
+
+    def read(self, file_path: Path, lazy: bool = False) -> LoadedMap:
+        data = _memmap_npz_member(file_path, f"{NPZ_DATA}.npy") if lazy else None
+
+        with np.load(file_path) as archive:
+            if data is None:
+                data = archive[NPZ_DATA]
+            _check_cube(file_path, data)
+
+            x_axis = (
+                np.ravel(archive[NPZ_X_AXIS]).astype(np.float64)
+                if NPZ_X_AXIS in archive
+                else np.arange(data.shape[2], dtype=np.float64)
+            )
+            units = np.array([str(archive[NPZ_UNITS]) if NPZ_UNITS in archive else ""])
+
+        if len(x_axis) != data.shape[2]:
+            raise FormatError(f"{file_path}: x-axis does not match with the spectra")
+
+        return LoadedMap(make_mdict(data.shape[:2], x_axis, units), data, x_axis, units)
+
+
+_readers: List[Reader] = [
+    WITecReader(),
+    CacheReader(),
+    NumpyReader(),
+    NumpyArchiveReader(),
+]
+
+
+def register(reader: Reader, index: Optional[int] = None) -> None:
+    """
+    A function to register the `reader` of another format.
+
+    Parameters:
+        reader (Reader): The reader.
+        index (int): Position in the registry, readers are asked in order whether they accept the file,
+            the reader is appended if not provided. Default: None.
+    """
+
+    _readers.insert(len(_readers) if index is None else index, reader)
+
+
+def get_readers() -> List[Reader]:
+    return list(_readers)
+
+
+def get_extensions() -> Tuple[str, ...]:
+    """
+    A function to get extensions of the files of the registered formats.
+    """
+
+    return tuple(
+        dict.fromkeys(
+            extension for reader in _readers for extension in reader.extensions
+        )
+    )
+
+
+def get_reader(file_path: Union[str, Path]) -> Reader:
+    """
+    A function to detect format of the file from its first bytes.
+
+    Parameters:
+        file_path (str | Path): Path to the file.
+
+    Returns:
+        reader (Reader): The first registered reader that accepts the file.
+    """
+
+    file_path = Path(file_path)
+    with open(file_path, "rb") as file:
+        header = file.read(SNIFF_SIZE)
+
+    for reader in _readers:
+        if reader.sniff(file_path, header):
+            return reader
+
+    raise FormatError(f"{file_path}: unknown format of the file")
+
+
+def read(file_path: Union[str, Path], lazy: bool = False) -> LoadedMap:
+    """
+    A function to read the spectral map in any of the registered formats.
+
+    Parameters:
+        file_path (str | Path): Path to the file.
+        lazy (bool): See `Reader.read`. Default: False.
+
+    Returns:
+        loaded (LoadedMap): The read map.
+    """
+
+    return get_reader(file_path).read(Path(file_path), lazy)
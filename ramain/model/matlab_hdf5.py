@@ -0,0 +1,247 @@
+"""
+Reading of MATLAB v7.3 `.mat` files, which are HDF5 files with MATLAB specific attributes.
+The structure is converted into the same form as `scipy.io.loadmat` returns (which cannot read these files),
+only the spectra are kept on disk and read lazily by `MatlabHDF5Array`.
+"""
+
+from copy import copy as _copy
+import numpy as np
+from pathlib import Path
+from typing import Tuple, Union
+
+# v7.3 files have 512 bytes long MATLAB header followed by the HDF5 signature
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+HDF5_SIGNATURE_OFFSET = 512
+
+
+def _import_h5py():
+    try:
+        import h5py
+
+        return h5py
+
+    except ImportError:
+        raise ImportError("Install h5py to load MATLAB v7.3 (HDF5) files.")
+
+
+def is_hdf5_matlab(file_path: Union[str, Path]) -> bool:
+    """
+    A function to check whether the file is MATLAB v7.3 (HDF5) file.
+
+    Parameters:
+        file_path (str | Path): Path to the file.
+
+    Returns:
+        is_hdf5 (bool): True if the file has HDF5 signature at the position where MATLAB puts it.
+    """
+
+    with open(file_path, "rb") as file:
+        file.seek(HDF5_SIGNATURE_OFFSET)
+        return file.read(len(HDF5_SIGNATURE)) == HDF5_SIGNATURE
+
+
+def _get_matlab_class(obj) -> str:
+    matlab_class = obj.attrs.get("MATLAB_class", b"")
+    return matlab_class.decode() if isinstance(matlab_class, bytes) else matlab_class
+
+
+def _convert(h5_file, obj, lazy_field: int = -1) -> np.ndarray:
+    """
+    Converts HDF5 object written by MATLAB into the form `scipy.io.loadmat` would return for it.
+    MATLAB stores arrays in column-major order, so they have to be transposed.
+    Field of the struct on the `lazy_field` position is not read, empty array is put there instead.
+    """
+
+    h5py = _import_h5py()
+    matlab_class = _get_matlab_class(obj)
+
+    if isinstance(obj, h5py.Group):
+        # scalar struct; order of the fields is stored in the attribute
+        field_names = [
+            b"".join(field_name).decode() for field_name in obj.attrs["MATLAB_fields"]
+        ]
+        struct = np.empty((1, 1), dtype=[(name, object) for name in field_names])
+        for i, name in enumerate(field_names):
+            if i == lazy_field:
+                struct[0, 0][name] = np.empty((0, 0))
+            else:
+                struct[0, 0][name] = _convert(h5_file, obj[name])
+        return struct
+
+    if obj.attrs.get("MATLAB_empty", 0):
+        return np.empty((0, 0))
+
+    values = obj[()]
+
+    if matlab_class == "cell":
+        cell = np.empty(values.shape[::-1], dtype=object)
+        for index, reference in np.ndenumerate(values.T):
+            cell[index] = _convert(h5_file, h5_file[reference])
+        return cell
+
+    if matlab_class == "char":
+        return np.array(["".join(map(chr, values.T.ravel()))])
+
+    if matlab_class == "logical":
+        return values.T.astype(bool)
+
+    return values.T
+
+
+def loadmat(file_path: Union[str, Path], lazy_field: int) -> Tuple[dict, str]:
+    """
+    A function to load MATLAB v7.3 file with one struct in the same form as `scipy.io.loadmat` does.
+
+    Parameters:
+        file_path (str | Path): Path to the file.
+        lazy_field (int): Position of the struct field that is not to be read (spectra).
+
+    Returns:
+        result (Tuple[dict, str]): Dict of the MATLAB variables and HDF5 path of the not read field.
+    """
+
+    h5py = _import_h5py()
+
+    with h5py.File(file_path, "r") as h5_file:
+        # internal groups of MATLAB start with '#'
+        names = [name for name in h5_file if not name.startswith("#")]
+        name = names[-1]
+
+        struct = h5_file[name]
+        field_names = [
+            b"".join(field_name).decode()
+            for field_name in struct.attrs["MATLAB_fields"]
+        ]
+
+        mdict = {name: _convert(h5_file, struct, lazy_field)}
+        lazy_path = struct[field_names[lazy_field]].name
+
+    return mdict, lazy_path
+
+
+class MatlabHDF5Array:
+    """
+    Read-only 3D (rows, columns, points) view of the spectra stored as 2D (spectra, points) MATLAB array
+    in a v7.3 file. Only the spectra needed for the requested index are read from the disk.
+    """
+
+    def __init__(
+        self,
+        file_path: Union[str, Path],
+        dataset_path: str,
+        map_shape: Tuple[int, int],
+    ) -> None:
+        """
+        The constructor of the lazy array.
+
+        Parameters:
+            file_path (str | Path): Path to the MATLAB v7.3 file.
+            dataset_path (str): HDF5 path of the spectra dataset.
+            map_shape (Tuple[int, int]): Number of rows and columns of the map.
+        """
+
+        h5py = _import_h5py()
+
+        self.file_path = file_path
+        self.dataset_path = dataset_path
+
+        with h5py.File(file_path, "r") as h5_file:
+            dataset = h5_file[dataset_path]
+            # NOTE: MATLAB (spectra, points) array is stored transposed
+            n_points, n_spectra = dataset.shape
+            self.dtype = dataset.dtype
+
+        if n_spectra != map_shape[0] * map_shape[1]:
+            raise ValueError("map shape does not match with the number of spectra")
+
+        self.shape = (map_shape[0], map_shape[1], n_points)
+        self.ndim = 3
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def read_spectra(self, start: int, stop: int) -> np.ndarray:
+        """
+        A function to read spectra with flat (row-major) indices from `start` to `stop`.
+
+        Returns:
+            spectra (np.ndarray): 2D array of spectra, one spectrum per row.
+        """
+
+        h5py = _import_h5py()
+
+        with h5py.File(self.file_path, "r") as h5_file:
+            spectra = h5_file[self.dataset_path][:, start:stop].T
+
+        return np.ascontiguousarray(spectra, dtype=self.dtype)
+
+    def read_spectra_at(self, flat_indices: np.ndarray) -> np.ndarray:
+        """
+        A function to read spectra with flat (row-major) indices, each continuous run of the indices is read
+        by one hyperslab, so that e.g. columns of the map do not read the spectra between the selected ones.
+
+        Returns:
+            spectra (np.ndarray): 2D array of spectra in the order of the indices, one spectrum per row.
+        """
+
+        h5py = _import_h5py()
+
+        unique_indices, inverse = np.unique(flat_indices, return_inverse=True)
+        runs = np.split(
+            unique_indices, np.flatnonzero(np.diff(unique_indices) != 1) + 1
+        )
+
+        with h5py.File(self.file_path, "r") as h5_file:
+            dataset = h5_file[self.dataset_path]
+            spectra = np.concatenate(
+                [dataset[:, run[0] : run[-1] + 1] for run in runs], axis=1
+            ).T
+
+        return np.ascontiguousarray(spectra, dtype=self.dtype)[inverse]
+
+    def astype(self, dtype, copy: bool = True) -> "MatlabHDF5Array":
+        """
+        A function to get lazy array of the same spectra that are converted to `dtype` when they are read.
+        """
+
+        if not copy and np.dtype(dtype) == self.dtype:
+            return self
+
+        array = _copy(self)
+        array.dtype = np.dtype(dtype)
+        return array
+
+    def __getitem__(self, key) -> np.ndarray:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(item is Ellipsis for item in key) or len(key) > self.ndim:
+            raise IndexError("only basic indexing of the rows and columns is supported")
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        spectra_indices = np.arange(self.shape[0] * self.shape[1]).reshape(
+            self.shape[:2]
+        )[key[0], key[1]]
+
+        flat_indices = np.ravel(spectra_indices)
+        if flat_indices.size == 0:
+            return np.empty(np.shape(spectra_indices) + (self.shape[2],), self.dtype)[
+                ..., key[2]
+            ]
+
+        spectra = self.read_spectra_at(flat_indices)
+
+        return spectra.reshape(np.shape(spectra_indices) + (self.shape[2],))[
+            ..., key[2]
+        ]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        # the spectra are always read into a new array
+        if copy is False:
+            raise ValueError("spectra cannot be read without a copy")
+
+        spectra = self.read_spectra(0, self.shape[0] * self.shape[1])
+        return spectra.reshape(self.shape).astype(dtype or self.dtype, copy=False)
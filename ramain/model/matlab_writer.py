@@ -0,0 +1,520 @@
+"""
+Writing of the spectral maps into MATLAB `.mat` files without building a reshaped copy of the spectra.
+The struct is encoded by this module and the spectra field is streamed into the file by blocks, optionally compressed.
+MATLAB v5 files keep the arrays in column-major order, so the spectra are written by blocks of spectral points,
+v7.3 (HDF5) files are chunked and written by blocks of rows of the map. Saving can run in the background.
+"""
+
+import os
+import time
+import zlib
+import struct
+import tempfile
+import numpy as np
+from pathlib import Path
+from concurrent import futures
+from typing import BinaryIO, Callable, Optional, Tuple, Union
+
+from ramain.model import matlab_hdf5, metadata
+from ramain.spectra_processing import executor
+from ramain.utils.settings import SETTINGS
+
+FORMATS = ("v5", "v7.3")
+DEFAULT_FORMAT = "v5"
+
+# zlib (v5) or gzip (v7.3) level, 0 - no compression
+DEFAULT_COMPRESSION = 0
+
+# sizes of the v5 elements are 32-bit (and MATLAB does not read variables over 2 GB), larger maps are saved as v7.3
+V5_MAX_SIZE = 2**31 - 1
+
+# size of the chunks of the spectra dataset of v7.3 files
+CHUNK_SIZE = 1 << 20
+
+V73_USERBLOCK_SIZE = 512
+
+# MATLAB v5 data types and array classes, see `metadata`
+MI_INT8 = 1
+MI_UINT8 = 2
+MI_UINT16 = 4
+MI_INT32 = 5
+MI_UINT32 = 6
+MI_UTF8 = 16
+# NOTE: UTF types share dtypes with the integer ones
+MI_TYPES = {
+    np.dtype(dtype): mi_type
+    for mi_type, dtype in metadata.MI_DTYPES.items()
+    if mi_type < MI_UTF8
+}
+MX_CLASSES = {
+    np.dtype(dtype): mx_class for mx_class, dtype in metadata.MX_DTYPES.items()
+}
+MX_LOGICAL_CLASS = 9
+MX_COMPLEX_FLAG = 0x0800
+MX_LOGICAL_FLAG = 0x0200
+
+# MATLAB classes of the v7.3 datasets
+MATLAB_CLASSES = {
+    np.dtype("f8"): "double",
+    np.dtype("f4"): "single",
+    np.dtype("i1"): "int8",
+    np.dtype("u1"): "uint8",
+    np.dtype("i2"): "int16",
+    np.dtype("u2"): "uint16",
+    np.dtype("i4"): "int32",
+    np.dtype("u4"): "uint32",
+    np.dtype("i8"): "int64",
+    np.dtype("u8"): "uint64",
+}
+
+_pool = None
+
+
+def get_options() -> Tuple[str, int]:
+    """
+    A function to get the format and compression level of the saved files from the settings.
+
+    Returns:
+        options (Tuple[str, int]): One of `FORMATS` and compression level (0-9).
+    """
+
+    file_format = str(SETTINGS.value("saving/format", DEFAULT_FORMAT))
+    compression = int(SETTINGS.value("saving/compression", DEFAULT_COMPRESSION))
+    return file_format, min(max(compression, 0), 9)
+
+
+def _get_header(version: str) -> bytes:
+    text = (
+        f"MATLAB {version} MAT-file, Platform: {os.name}, "
+        f"Created on: {time.asctime()}"
+    )
+    if version == "7.3":
+        text += " HDF5 schema 1.00 ."
+
+    version_number = 0x0200 if version == "7.3" else 0x0100
+    return (
+        text.encode().ljust(116, b" ")[:116]
+        + b"\0" * 8
+        + struct.pack("<H", version_number)
+        + b"IM"
+    )
+
+
+def _get_dims(value: np.ndarray) -> Tuple[int, ...]:
+    # 1D arrays are saved as row vectors, as `scipy.io.savemat` does
+    return (1,) * (2 - value.ndim) + value.shape
+
+
+def _get_chars(value: np.ndarray) -> np.ndarray:
+    """
+    Converts array of strings (as `scipy.io.loadmat` returns char arrays) into 2D array of UTF-16 codes.
+    """
+
+    strings = [str(string) for string in value.reshape(-1)]
+    length = max((len(string) for string in strings), default=0)
+    return np.array(
+        [[ord(char) for char in string.ljust(length)] for string in strings],
+        dtype="<u2",
+    ).reshape((len(strings), length))
+
+
+def _element(mi_type: int, data: bytes) -> bytes:
+    return struct.pack("<II", mi_type, len(data)) + data + b"\0" * (-len(data) % 8)
+
+
+def _matrix_header(
+    mx_class: int, dims: Tuple[int, ...], flags: int = 0, name: str = ""
+) -> bytes:
+    return (
+        _element(MI_UINT32, struct.pack("<II", mx_class | flags, 0))
+        + _element(MI_INT32, np.asarray(dims, dtype="<i4").tobytes())
+        + _element(MI_INT8, name.encode())
+    )
+
+
+def _struct_header(value: np.ndarray, name: str = "") -> bytes:
+    names = value.dtype.names
+    length = max(len(field_name) for field_name in names) + 1
+
+    return (
+        _matrix_header(metadata.MX_STRUCT_CLASS, _get_dims(value), name=name)
+        + _element(MI_INT32, struct.pack("<i", length))
+        + _element(
+            MI_INT8,
+            b"".join(field_name.encode().ljust(length, b"\0") for field_name in names),
+        )
+    )
+
+
+def _encode_v5(value, name: str = "") -> bytes:
+    """
+    Encodes (part of) MATLAB struct loaded by `scipy.io.loadmat` into MATLAB v5 matrix element.
+    """
+
+    value = np.asarray(value)
+
+    if value.dtype.names is not None:  # struct
+        content = _struct_header(value, name) + b"".join(
+            _encode_v5(item[field_name])
+            for item in value.reshape(-1, order="F")
+            for field_name in value.dtype.names
+        )
+
+    elif value.dtype == object:  # cell
+        content = _matrix_header(
+            metadata.MX_CELL_CLASS, _get_dims(value), name=name
+        ) + b"".join(_encode_v5(item) for item in value.reshape(-1, order="F"))
+
+    elif value.dtype.kind == "U":
+        chars = _get_chars(value)
+        content = _matrix_header(
+            metadata.MX_CHAR_CLASS, chars.shape, name=name
+        ) + _element(MI_UINT16, chars.tobytes(order="F"))
+
+    elif value.dtype.kind == "b":
+        content = _matrix_header(
+            MX_LOGICAL_CLASS, _get_dims(value), MX_LOGICAL_FLAG, name
+        ) + _element(MI_UINT8, value.astype(np.uint8).tobytes(order="F"))
+
+    elif value.dtype.kind == "c":
+        real_dtype = np.dtype(value.real.dtype).newbyteorder("<")
+        content = (
+            _matrix_header(
+                MX_CLASSES[real_dtype], _get_dims(value), MX_COMPLEX_FLAG, name
+            )
+            + _element(
+                MI_TYPES[real_dtype], value.real.astype(real_dtype).tobytes(order="F")
+            )
+            + _element(
+                MI_TYPES[real_dtype], value.imag.astype(real_dtype).tobytes(order="F")
+            )
+        )
+
+    elif value.dtype.newbyteorder("<") in MX_CLASSES:
+        dtype = value.dtype.newbyteorder("<")
+        content = _matrix_header(MX_CLASSES[dtype], _get_dims(value), name=name) + (
+            _element(MI_TYPES[dtype], value.astype(dtype).tobytes(order="F"))
+        )
+
+    else:
+        raise TypeError(f"values of type {value.dtype} cannot be saved")
+
+    return _element(metadata.MI_MATRIX, content)
+
+
+class _Output:
+    """
+    Writer of the v5 variable into the file that compresses the written bytes on the fly if `compression` is set.
+    """
+
+    def __init__(self, file: BinaryIO, compression: int) -> None:
+        self.file = file
+        self.compressor = zlib.compressobj(compression) if compression else None
+        self.start = file.tell()
+
+        if self.compressor is not None:
+            # size of the compressed variable is written when it is known
+            file.write(struct.pack("<II", metadata.MI_COMPRESSED, 0))
+
+    def write(self, data) -> None:
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.file.write(data)
+
+    def close(self) -> None:
+        if self.compressor is None:
+            return
+
+        self.file.write(self.compressor.flush())
+        end = self.file.tell()
+
+        compressed_size = end - self.start - 8
+        if compressed_size > V5_MAX_SIZE:
+            raise ValueError("compressed spectra are too large for MATLAB v5 file")
+
+        self.file.seek(self.start + 4)
+        self.file.write(struct.pack("<I", compressed_size))
+        self.file.seek(end)
+
+
+def _stage(data) -> np.ndarray:
+    """
+    Copies lazily loaded spectra into a temporary memory-mapped file by blocks of rows, so that they can be read
+    by blocks of spectral points without reading the whole map for each of them.
+    """
+
+    staged = np.memmap(tempfile.TemporaryFile(), data.dtype, "w+", shape=data.shape)
+    for rows in executor.iterate_row_slices(data, temporaries=1):
+        staged[rows] = data[rows]
+    return staged
+
+
+def _save_v5(
+    file: BinaryIO,
+    name: str,
+    matlab_struct: np.ndarray,
+    data,
+    data_field: int,
+    compression: int,
+    memory_budget: int,
+) -> None:
+    dtype = np.dtype(data.dtype).newbyteorder("<")
+    n_points = data.shape[2]
+    n_spectra = data.shape[0] * data.shape[1]
+    data_size = n_spectra * n_points * dtype.itemsize
+
+    item = matlab_struct[0, 0]
+    field_names = matlab_struct.dtype.names
+
+    prefix = _struct_header(matlab_struct, name) + b"".join(
+        _encode_v5(item[field_name]) for field_name in field_names[:data_field]
+    )
+    data_header = _matrix_header(MX_CLASSES[dtype], (n_spectra, n_points))
+    data_tag = struct.pack("<II", MI_TYPES[dtype], data_size)
+    padding = b"\0" * (-data_size % 8)
+    suffix = b"".join(
+        _encode_v5(item[field_name]) for field_name in field_names[data_field + 1 :]
+    )
+
+    data_matrix_size = len(data_header) + len(data_tag) + data_size + len(padding)
+    size = len(prefix) + 8 + data_matrix_size + len(suffix)
+    if size > V5_MAX_SIZE:
+        raise ValueError("spectral map is too large for MATLAB v5 file, use v7.3")
+
+    if not isinstance(data, np.ndarray):
+        data = _stage(data)
+
+    output = _Output(file, compression)
+    output.write(struct.pack("<II", metadata.MI_MATRIX, size) + prefix)
+    output.write(
+        struct.pack("<II", metadata.MI_MATRIX, data_matrix_size)
+        + data_header
+        + data_tag
+    )
+
+    # (spectra, points) array in column-major order, i.e. all the spectra of the first point first;
+    # spectra of one point are in row-major order of the map
+    block_points = max(memory_budget // (n_spectra * dtype.itemsize), 1)
+    for start in range(0, n_points, block_points):
+        block = np.moveaxis(data[:, :, start : start + block_points], 2, 0)
+        output.write(memoryview(np.ascontiguousarray(block, dtype=dtype)).cast("B"))
+
+    output.write(padding + suffix)
+    output.close()
+
+
+def _write_hdf5(h5_file, group, name: str, value):
+    """
+    Writes (part of) MATLAB struct loaded by `scipy.io.loadmat` into the HDF5 `group` the way MATLAB v7.3 does,
+    i.e. in the form `matlab_hdf5` reads.
+    """
+
+    h5py = matlab_hdf5._import_h5py()
+    value = np.asarray(value)
+
+    if value.dtype.names is not None:  # struct
+        if value.size != 1:
+            raise TypeError("only scalar structs can be saved into MATLAB v7.3 file")
+
+        struct_group = group.create_group(name)
+        struct_group.attrs["MATLAB_class"] = np.bytes_("struct")
+        struct_group.attrs.create(
+            "MATLAB_fields",
+            np.array(
+                [np.array(list(field), dtype="S1") for field in value.dtype.names],
+                dtype=object,
+            ),
+            dtype=h5py.vlen_dtype(np.dtype("S1")),
+        )
+        for field_name in value.dtype.names:
+            _write_hdf5(
+                h5_file, struct_group, field_name, value.reshape(-1)[0][field_name]
+            )
+        return struct_group
+
+    if value.dtype.kind == "U":
+        matlab_class, value = "char", _get_chars(value)
+    elif value.dtype.kind == "b":
+        matlab_class, value = "logical", value.astype(np.uint8)
+    elif value.dtype == object:
+        matlab_class = "cell"
+    elif value.dtype.newbyteorder("<") in MATLAB_CLASSES:
+        matlab_class = MATLAB_CLASSES[value.dtype.newbyteorder("<")]
+    else:
+        raise TypeError(f"values of type {value.dtype} cannot be saved")
+
+    dims = _get_dims(value)
+
+    if value.size == 0:
+        # empty arrays are stored as their dimensions
+        dataset = group.create_dataset(name, data=np.array(dims, dtype=np.uint64))
+        dataset.attrs["MATLAB_empty"] = np.uint8(1)
+
+    elif matlab_class == "cell":
+        refs = h5_file.require_group("#refs#")
+        references = np.empty(dims[::-1], dtype=h5py.ref_dtype)
+        for index, item in np.ndenumerate(value.reshape(dims)):
+            references[index[::-1]] = _write_hdf5(
+                h5_file, refs, str(len(refs)), item
+            ).ref
+        dataset = group.create_dataset(name, data=references)
+
+    else:
+        dataset = group.create_dataset(name, data=value.reshape(dims).T)
+
+    dataset.attrs["MATLAB_class"] = np.bytes_(matlab_class)
+    return dataset
+
+
+def _save_v73(
+    file_path: Union[str, Path],
+    name: str,
+    matlab_struct: np.ndarray,
+    data,
+    data_field: int,
+    compression: int,
+    memory_budget: int,
+) -> None:
+    h5py = matlab_hdf5._import_h5py()
+    dtype = np.dtype(data.dtype)
+    n_points = data.shape[2]
+    n_spectra = data.shape[0] * data.shape[1]
+
+    # spectra field is created empty and written afterwards
+    item = matlab_struct[0, 0].copy()
+    item[data_field] = np.empty((0, 0))
+    data_field_name = matlab_struct.dtype.names[data_field]
+
+    with h5py.File(file_path, "w", userblock_size=V73_USERBLOCK_SIZE) as h5_file:
+        group = _write_hdf5(h5_file, h5_file, name, item)
+        del group[data_field_name]
+
+        # MATLAB (spectra, points) array is stored transposed, chunks are blocks of whole spectra
+        chunk_spectra = min(
+            max(CHUNK_SIZE // (n_points * dtype.itemsize), 1), n_spectra
+        )
+        dataset = group.create_dataset(
+            data_field_name,
+            shape=(n_points, n_spectra),
+            dtype=dtype,
+            chunks=(n_points, chunk_spectra),
+            compression="gzip" if compression else None,
+            compression_opts=compression if compression else None,
+            shuffle=bool(compression),
+        )
+        dataset.attrs["MATLAB_class"] = np.bytes_(MATLAB_CLASSES[dtype])
+
+        for rows in executor.iterate_row_slices(
+            data, temporaries=2, memory_budget=memory_budget
+        ):
+            block = data[rows]
+            start = rows.start * data.shape[1]
+            dataset[:, start : start + block.shape[0] * block.shape[1]] = block.reshape(
+                (-1, n_points)
+            ).T
+
+    with open(file_path, "r+b") as file:
+        file.write(_get_header("7.3"))
+
+
+def savemat(
+    file_path: Union[str, Path],
+    mdict: dict,
+    data,
+    data_field: int,
+    file_format: Optional[str] = None,
+    compression: Optional[int] = None,
+    memory_budget: Optional[int] = None,
+) -> str:
+    """
+    A function to save MATLAB struct with the spectra streamed into its `data_field` by blocks.
+    The file is written under a temporary name and renamed once it is complete.
+
+    Parameters:
+        file_path (str | Path): Path of the output file.
+        mdict (dict): MATLAB dict as loaded by `scipy.io.loadmat`, the last variable is saved.
+        data (np.ndarray | MatlabHDF5Array): 3D spectra, saved as 2D (spectra, points) array.
+        data_field (int): Position of the spectra field in the struct, its value in `mdict` is ignored.
+        file_format (str): One of `FORMATS`, maps too large for v5 are saved as v7.3. Taken from the settings
+            if not provided. Default: None.
+        compression (int): Compression level (0-9), taken from the settings if not provided. Default: None.
+        memory_budget (int): Memory budget for one block of spectra in bytes, see `executor.get_memory_budget`.
+            Default: None.
+
+    Returns:
+        file_format (str): Format the file has been saved in.
+    """
+
+    settings_format, settings_compression = get_options()
+    file_format = settings_format if file_format is None else file_format
+    compression = settings_compression if compression is None else compression
+    memory_budget = (
+        executor.get_memory_budget() if memory_budget is None else memory_budget
+    )
+
+    if file_format not in FORMATS:
+        raise ValueError(f"unknown format '{file_format}', expected one of {FORMATS}")
+
+    if file_format == "v5" and np.prod(data.shape) * data.dtype.itemsize > V5_MAX_SIZE:
+        file_format = "v7.3"
+
+    name = list(mdict)[-1]
+    temp_path = f"{file_path}.part"
+
+    try:
+        if file_format == "v5":
+            with open(temp_path, "wb") as file:
+                file.write(_get_header("5.0"))
+                _save_v5(
+                    file,
+                    name,
+                    mdict[name],
+                    data,
+                    data_field,
+                    compression,
+                    memory_budget,
+                )
+        else:
+            _save_v73(
+                temp_path,
+                name,
+                mdict[name],
+                data,
+                data_field,
+                compression,
+                memory_budget,
+            )
+
+        os.replace(temp_path, file_path)
+
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    return file_format
+
+
+def submit(
+    function: Callable, *args, callback: Optional[Callable] = None, **kwargs
+) -> futures.Future:
+    """
+    A function to run the saving `function` in the background. Files are saved one by one in the order
+    they were submitted.
+
+    Parameters:
+        function (Callable): Function that saves the file, e.g. `savemat`.
+        callback (Callable): Function called with the finished `Future` (from the saving thread). Default: None.
+
+    Returns:
+        future (concurrent.futures.Future): Future of the result of the `function`.
+    """
+
+    global _pool
+    if _pool is None:
+        _pool = futures.ThreadPoolExecutor(max_workers=1)
+
+    future = _pool.submit(function, *args, **kwargs)
+    if callback is not None:
+        future.add_done_callback(callback)
+
+    return future
@@ -0,0 +1,328 @@
+"""
+Reading of the basic information about the spectral map (shape, x-axis range, units and dtype) without loading
+the spectra, e.g. for the file browser. MATLAB v5 files are walked element by element and the spectra field
+is skipped without being decoded, v7.3 (HDF5) files and cached conversions are read without the spectra dataset.
+"""
+
+import os
+import zlib
+import functools
+import numpy as np
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple, Union
+
+from ramain.model import cache, loaders, matlab_hdf5
+
+# positions of the fields in the struct
+SHAPE_FIELD = loaders.SHAPE_FIELD
+DATA_FIELD = loaders.DATA_FIELD
+AXIS_FIELD = loaders.AXIS_FIELD
+
+# MATLAB v5 data types and array classes
+MI_MATRIX = 14
+MI_COMPRESSED = 15
+MI_DTYPES = {
+    1: "i1",
+    2: "u1",
+    3: "i2",
+    4: "u2",
+    5: "i4",
+    6: "u4",
+    7: "f4",
+    9: "f8",
+    12: "i8",
+    13: "u8",
+    16: "u1",
+    17: "u2",
+    18: "u4",
+}
+MX_DTYPES = {
+    6: "f8",
+    7: "f4",
+    8: "i1",
+    9: "u1",
+    10: "i2",
+    11: "u2",
+    12: "i4",
+    13: "u4",
+    14: "i8",
+    15: "u8",
+}
+MX_CELL_CLASS = 1
+MX_STRUCT_CLASS = 2
+MX_CHAR_CLASS = 4
+
+HEADER_SIZE = 128
+
+
+class _Stream:
+    """
+    Reader of (possibly zlib compressed) element of the file that keeps track of the number of read bytes
+    and skips bytes without keeping them in memory.
+    """
+
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, file: BinaryIO, compressed_size: Optional[int] = None) -> None:
+        self.file = file
+        self.position = 0
+        self.compressed_left = compressed_size or 0
+        self.decompressor = zlib.decompressobj() if compressed_size else None
+        self.buffer = b""
+
+    def read(self, n_bytes: int) -> bytes:
+        if self.decompressor is None:
+            data = self.file.read(n_bytes)
+        else:
+            # decompress only as much as is needed
+            while len(self.buffer) < n_bytes:
+                compressed = self.decompressor.unconsumed_tail
+                if not compressed and self.compressed_left > 0:
+                    compressed = self.file.read(
+                        min(self.CHUNK_SIZE, self.compressed_left)
+                    )
+                    self.compressed_left -= len(compressed)
+                if not compressed:
+                    break
+                self.buffer += self.decompressor.decompress(
+                    compressed, max(n_bytes - len(self.buffer), self.CHUNK_SIZE)
+                )
+            data, self.buffer = self.buffer[:n_bytes], self.buffer[n_bytes:]
+
+        if len(data) != n_bytes:
+            raise ValueError("unexpected end of the file")
+
+        self.position += n_bytes
+        return data
+
+    def skip(self, n_bytes: int) -> None:
+        if self.decompressor is None:
+            self.file.seek(n_bytes, os.SEEK_CUR)
+            self.position += n_bytes
+            return
+
+        while n_bytes > 0:
+            step = min(n_bytes, self.CHUNK_SIZE)
+            self.read(step)
+            n_bytes -= step
+
+
+def _read_element(stream: _Stream, byte_order: str) -> np.ndarray:
+    """
+    Reads one (possibly small) data element of numeric type.
+    """
+
+    tag = stream.read(8)
+    data_type, n_bytes = (int(value) for value in np.frombuffer(tag, byte_order + "u4"))
+
+    # small data element has the number of bytes in the upper half of the type and data in the tag
+    if data_type >> 16:
+        data_type, n_bytes = data_type & 0xFFFF, data_type >> 16
+        data = tag[4 : 4 + n_bytes]
+    else:
+        data = stream.read(n_bytes)
+        stream.skip(-n_bytes % 8)
+
+    return np.frombuffer(data, byte_order + MI_DTYPES[data_type])
+
+
+def _read_matrix_header(stream: _Stream, byte_order: str) -> Tuple[int, tuple, int]:
+    """
+    Reads the tag of the matrix element and its array flags, dimensions and name.
+
+    Returns:
+        header (Tuple[int, tuple, int]): Array class (None for empty element), dimensions
+            and stream position of the end of the element.
+    """
+
+    data_type, n_bytes = (
+        int(value) for value in np.frombuffer(stream.read(8), byte_order + "u4")
+    )
+    if data_type != MI_MATRIX:
+        raise ValueError(f"unexpected data type {data_type}, matrix expected")
+
+    end = stream.position + n_bytes
+    if n_bytes == 0:
+        return None, (0, 0), end
+
+    array_flags = _read_element(stream, byte_order)
+    dims = tuple(int(dim) for dim in _read_element(stream, byte_order))
+    _read_element(stream, byte_order)  # name
+
+    return int(array_flags[0]) & 0xFF, dims, end
+
+
+def _skip_matrix(stream: _Stream, byte_order: str) -> None:
+    data_type, n_bytes = np.frombuffer(stream.read(8), byte_order + "u4")
+    stream.skip(int(n_bytes))
+
+
+def _read_values(stream: _Stream, byte_order: str) -> np.ndarray:
+    """
+    Reads values of numeric or char matrix, imaginary part is ignored.
+    """
+
+    matrix_class, dims, end = _read_matrix_header(stream, byte_order)
+    if matrix_class is None:
+        return np.empty((0, 0))
+
+    values = _read_element(stream, byte_order)
+    stream.skip(end - stream.position)
+
+    if matrix_class == MX_CHAR_CLASS:
+        return np.array(["".join(map(chr, values))])
+    if matrix_class in MX_DTYPES:
+        values = values.astype(MX_DTYPES[matrix_class])
+
+    return values.reshape(dims, order="F")
+
+
+def _probe_v5(file_path: Union[str, Path]) -> dict:
+    with open(file_path, "rb") as file:
+        header = file.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE:
+            raise ValueError("not a MATLAB file")
+        byte_order = "<" if header[126:128] == b"IM" else ">"
+
+        # find the last variable, only tags are read
+        file_size = os.fstat(file.fileno()).st_size
+        variable = None
+        offset = HEADER_SIZE
+        while offset + 8 <= file_size:
+            file.seek(offset)
+            data_type, n_bytes = (
+                int(value) for value in np.frombuffer(file.read(8), byte_order + "u4")
+            )
+            variable = (offset, data_type, n_bytes)
+            # compressed elements are not padded
+            offset += 8 + n_bytes + (0 if data_type == MI_COMPRESSED else -n_bytes % 8)
+
+        if variable is None:
+            raise ValueError("no variable in the file")
+
+        offset, data_type, n_bytes = variable
+        if data_type == MI_COMPRESSED:
+            file.seek(offset + 8)
+            stream = _Stream(file, n_bytes)
+        else:
+            file.seek(offset)
+            stream = _Stream(file)
+
+        matrix_class, _, _ = _read_matrix_header(stream, byte_order)
+        if matrix_class != MX_STRUCT_CLASS:
+            raise ValueError("struct with the spectral map expected")
+
+        _read_element(stream, byte_order)  # field name length
+        _read_element(stream, byte_order)  # field names
+
+        for field in range(AXIS_FIELD + 1):
+            if field == SHAPE_FIELD:
+                map_shape = tuple(_read_values(stream, byte_order)[0])
+
+            elif field == DATA_FIELD:
+                # only the header of the spectra is read, the values are skipped
+                matrix_class, dims, end = _read_matrix_header(stream, byte_order)
+                stream.skip(end - stream.position)
+                n_values = int(np.prod(dims))
+                dtype = MX_DTYPES.get(matrix_class, "f8")
+
+            elif field == AXIS_FIELD:
+                matrix_class, dims, _ = _read_matrix_header(stream, byte_order)
+                if matrix_class != MX_CELL_CLASS:
+                    raise ValueError("cell with the x-axis expected")
+                # cell elements are stored in column-major order, x-axis and units are in the 2nd row
+                x_axis_index, units_index = 1, 1 + dims[0]
+                for index in range(units_index + 1):
+                    if index == x_axis_index:
+                        x_axis = _read_values(stream, byte_order)[0]
+                    elif index == units_index:
+                        units = _read_values(stream, byte_order)
+                    else:
+                        _skip_matrix(stream, byte_order)
+
+            else:
+                _skip_matrix(stream, byte_order)
+
+    rows, cols = map_shape[1], map_shape[0]
+    return _get_metadata((rows, cols, n_values // (rows * cols)), x_axis, units, dtype)
+
+
+def _probe_hdf5(file_path: Union[str, Path]) -> dict:
+    h5py = matlab_hdf5._import_h5py()
+
+    with h5py.File(file_path, "r") as h5_file:
+        names = [name for name in h5_file if not name.startswith("#")]
+        struct = h5_file[names[-1]]
+        field_names = [
+            b"".join(field_name).decode()
+            for field_name in struct.attrs["MATLAB_fields"]
+        ]
+
+        map_shape = tuple(
+            matlab_hdf5._convert(h5_file, struct[field_names[SHAPE_FIELD]])[0]
+        )
+        axis = matlab_hdf5._convert(h5_file, struct[field_names[AXIS_FIELD]])
+
+        # NOTE: MATLAB (spectra, points) array is stored transposed
+        dataset = struct[field_names[DATA_FIELD]]
+        n_points, dtype = dataset.shape[0], dataset.dtype
+
+    shape = (int(map_shape[1]), int(map_shape[0]), n_points)
+    return _get_metadata(shape, axis[1][0][0], axis[1][1], dtype)
+
+
+def _get_metadata(shape: tuple, x_axis: np.ndarray, units, dtype) -> dict:
+    units = np.ravel(units)
+    return {
+        "shape": tuple(int(size) for size in shape),
+        "x_range": (
+            (float(np.min(x_axis)), float(np.max(x_axis))) if len(x_axis) else None
+        ),
+        "units": "".join(map(str, units)) if units.dtype.kind == "U" else "",
+        "dtype": np.dtype(dtype),
+    }
+
+
+@functools.lru_cache(maxsize=1024)
+def _probe(file_path: str, size: int, mtime_ns: int) -> dict:
+    # NOTE: size and modification time are part of the key so that changed files are probed again
+    if cache.is_enabled():
+        cached = cache.load_metadata(file_path)
+        if cached is not None:
+            metadata, dtype = cached
+            matlab_data = cache._decode(metadata["struct"])[0, 0]
+            return _get_metadata(
+                metadata["shape"],
+                np.array(metadata["x_axis"]),
+                matlab_data[AXIS_FIELD][1][1],
+                dtype,
+            )
+
+    reader = loaders.get_reader(file_path)
+    if isinstance(reader, loaders.WITecReader):
+        if matlab_hdf5.is_hdf5_matlab(file_path):
+            return _probe_hdf5(file_path)
+        return _probe_v5(file_path)
+
+    # other formats are read lazily (memory-mapped) where it is possible
+    loaded = reader.read(Path(file_path), lazy=True)
+    return _get_metadata(
+        loaded.data.shape, loaded.x_axis, loaded.units, loaded.data.dtype
+    )
+
+
+def probe(file_path: Union[str, Path]) -> dict:
+    """
+    A function to read the shape, x-axis range, units and dtype of the spectral map in the `file_path` file
+    without reading its spectra. Results are remembered until the file is changed.
+
+    Parameters:
+        file_path (str | Path): Path to the file in any of the formats of `loaders`.
+
+    Returns:
+        metadata (dict): Dict with 'shape' (rows, columns, points), 'x_range' (min, max; None for empty x-axis),
+            'units' (str) and 'dtype' (np.dtype) of the spectra.
+    """
+
+    stat = os.stat(file_path)
+    return _probe(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
@@ -0,0 +1,255 @@
+"""
+Pipelines of the automatic processing saved in files, so that they can be shared and run without the GUI.
+Steps are stored by names of the `SpectralMap` methods with named parameters in JSON (or YAML) file, e.g.
+
+    {
+        "version": 1,
+        "steps": [
+            {"name": "Cosmic Ray Removal", "method": "auto_spike_removal", "params": {}},
+            {"method": "background_removal_poly", "params": {"degree": 5, "ignore_water": true}},
+            {"method": "save_matlab", "params": {"out_folder_path": "processed", "file_tag": "_bgr"}}
+        ]
+    }
+"""
+
+import json
+import inspect
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Union
+
+from ramain.model import batch
+from ramain.model.spectal_map import SpectralMap
+
+VERSION = 1
+
+YAML_EXTENSIONS = (".yaml", ".yml")
+
+# methods that may be steps of the pipeline
+METHODS = {
+    function.__name__: function
+    for function in (
+        SpectralMap.crop_spectra_absolute,
+        SpectralMap.crop_spectra_relative,
+        SpectralMap.auto_spike_removal,
+        SpectralMap.background_removal_imodpoly,
+        SpectralMap.background_removal_airpls,
+        SpectralMap.background_removal_poly,
+        SpectralMap.background_removal_math_morpho,
+        SpectralMap.background_removal_bubblefill,
+        SpectralMap.smoothing_whittaker,
+        SpectralMap.smoothing_savgol,
+        SpectralMap.linearization,
+        SpectralMap.water_normalization,
+        SpectralMap.decomposition_NMF,
+        SpectralMap.decomposition_PCA,
+        SpectralMap.save_matlab,
+        SpectralMap.export_to_graphics,
+        SpectralMap.export_to_text,
+        batch.stitched_decomposition_export,
+    )
+}
+
+# parameters of the methods with the directory of the outputs
+OUTPUT_PARAMS = {
+    "save_matlab": "out_folder_path",
+    "export_to_graphics": "out_dir",
+    "export_to_text": "out_dir",
+    "stitched_decomposition_export": "out_dir",
+}
+
+
+class PipelineError(ValueError):
+    """
+    Raised if the pipeline definition is not valid.
+    """
+
+
+class PipelineStep(NamedTuple):
+    """
+    One step of the pipeline: name of the method and its named parameters.
+    """
+
+    method: str
+    params: dict
+    name: str = ""
+
+
+def _import_yaml():
+    try:
+        import yaml
+
+        return yaml
+
+    except ImportError:
+        raise ImportError("Install PyYAML to use pipelines in YAML files.")
+
+
+def get_function(method: str) -> Callable:
+    """
+    A function to get the function of the `method` step.
+    """
+
+    if method not in METHODS:
+        raise PipelineError(f"Unknown method '{method}'.")
+    return METHODS[method]
+
+
+def _bind(method: str, params: Union[list, dict]) -> inspect.BoundArguments:
+    function = get_function(method)
+
+    try:
+        # the first parameter is the map (maps for the stitched decomposition) the step is applied on
+        if isinstance(params, dict):
+            return inspect.signature(function).bind(None, **params)
+        return inspect.signature(function).bind(None, *params)
+
+    except TypeError as e:
+        raise PipelineError(f"Invalid parameters of '{method}': {e}")
+
+
+def make_step(
+    method: str, params: Union[list, dict] = (), name: str = ""
+) -> PipelineStep:
+    """
+    A function to make a step of the pipeline, the parameters are checked against the signature of the method.
+
+    Parameters:
+        method (str): Name of the method, one of `METHODS`.
+        params (list | dict): Positional (as in the GUI) or named parameters of the method. Default: ().
+        name (str): Name of the step displayed to the user, `method` is used if empty. Default: "".
+
+    Returns:
+        step (PipelineStep): The step with named parameters.
+    """
+
+    if not isinstance(params, (list, tuple, dict)):
+        raise PipelineError(f"Parameters of '{method}' have to be list or dict.")
+
+    arguments = dict(_bind(method, params).arguments)
+    del arguments[next(iter(arguments))]
+
+    return PipelineStep(method, arguments, str(name))
+
+
+def get_label(step: PipelineStep) -> str:
+    """
+    A function to get text of the step for the pipeline list and the logs.
+    """
+
+    params_text = ", ".join(f"{name}: {value}" for name, value in step.params.items())
+    return (step.name or step.method) + (" - " if params_text else "") + params_text
+
+
+def get_positional_params(step: PipelineStep) -> list:
+    """
+    A function to get parameters of the step in the order of the method's signature.
+    """
+
+    bound = _bind(step.method, step.params)
+    bound.apply_defaults()
+    return list(bound.args[1:])
+
+
+def to_batch_steps(steps: List[PipelineStep]) -> List[batch.Step]:
+    """
+    A function to convert the pipeline into the steps `batch.run` applies.
+    """
+
+    return [
+        (get_label(step), get_function(step.method), get_positional_params(step))
+        for step in steps
+    ]
+
+
+def set_output_dir(steps: List[PipelineStep], out_dir: str) -> List[PipelineStep]:
+    """
+    A function to redirect outputs of the saving and export steps into the `out_dir`.
+
+    Parameters:
+        steps (List[PipelineStep]): The pipeline.
+        out_dir (str): Directory of the outputs.
+
+    Returns:
+        steps (List[PipelineStep]): New pipeline with the directory set.
+    """
+
+    return [
+        (
+            step._replace(
+                params={**step.params, OUTPUT_PARAMS[step.method]: str(out_dir)}
+            )
+            if step.method in OUTPUT_PARAMS
+            else step
+        )
+        for step in steps
+    ]
+
+
+def save(file_path: Union[str, Path], steps: List[PipelineStep]) -> None:
+    """
+    A function to save the pipeline into JSON file (YAML file if it has `.yaml` or `.yml` extension).
+
+    Parameters:
+        file_path (str | Path): Path to the file.
+        steps (List[PipelineStep]): The pipeline.
+    """
+
+    definition = {
+        "version": VERSION,
+        "steps": [
+            {"name": step.name, "method": step.method, "params": step.params}
+            for step in steps
+        ],
+    }
+
+    with open(file_path, "w", encoding="utf-8") as file:
+        if Path(file_path).suffix.lower() in YAML_EXTENSIONS:
+            _import_yaml().safe_dump(definition, file, sort_keys=False)
+        else:
+            json.dump(definition, file, indent=4)
+
+
+def load(file_path: Union[str, Path]) -> List[PipelineStep]:
+    """
+    A function to load the pipeline from JSON (or YAML) file.
+
+    Parameters:
+        file_path (str | Path): Path to the file.
+
+    Returns:
+        steps (List[PipelineStep]): The pipeline.
+    """
+
+    with open(file_path, "r", encoding="utf-8") as file:
+        if Path(file_path).suffix.lower() in YAML_EXTENSIONS:
+            yaml = _import_yaml()
+            parse, parse_errors = yaml.safe_load, yaml.YAMLError
+        else:
+            parse, parse_errors = json.load, ValueError
+
+        try:
+            definition = parse(file)
+        except parse_errors as e:
+            raise PipelineError(f"{file_path}: file could not be parsed; {e}")
+
+    if not isinstance(definition, dict) or not isinstance(
+        definition.get("steps"), list
+    ):
+        raise PipelineError(f"{file_path}: pipeline has to contain list of steps.")
+
+    version = definition.get("version", VERSION)
+    if not isinstance(version, int) or version > VERSION:
+        raise PipelineError(
+            f"{file_path}: pipeline version {version} is not supported."
+        )
+
+    steps = []
+    for i, step in enumerate(definition["steps"], 1):
+        if not isinstance(step, dict) or "method" not in step:
+            raise PipelineError(f"{file_path}: step {i} has no method.")
+
+        steps.append(
+            make_step(step["method"], step.get("params", {}), step.get("name", ""))
+        )
+
+    return steps
@@ -1,6 +1,9 @@
+import os
 import scipy.io
 import numpy as np
-from typing import Union, Optional
+from concurrent import futures
+from contextlib import contextmanager
+from typing import Callable, Union, Optional
 from pathlib import Path
 
 import sys
@@ -9,6 +12,14 @@ sys.path.append(".")
 sys.path.append("..")
 
 from ramain.utils import paths
+from ramain.model import (
+    matlab_hdf5,
+    matlab_writer,
+    loaders,
+    cache,
+    history,
+    step_cache,
+)
 from ramain.spectra_processing.cropping import cropping
 from ramain.spectra_processing.artifacts_removal import (
     manual_removal,
@@ -26,15 +37,29 @@ from ramain.spectra_processing.decomposition import PCA, NMF
 from ramain.spectra_processing.export import to_graphics, to_text
 from ramain.spectra_processing.smoothing import whittaker, savgol
 from ramain.spectra_processing.normalization import water_normalization
+from ramain.spectra_processing import executor
 
 from ramain.utils.settings import SETTINGS
 
-from PySide6.QtCore import Signal
+from ramain.utils.progress import ProgressCallback
 
 
 class SpectralMap:
-    def __init__(self, in_file_path: Union[str, Path]) -> None:
+    def __init__(
+        self,
+        in_file_path: Union[str, Path],
+        lazy: bool = False,
+        dtype: Optional[np.dtype] = None,
+        keep_history: bool = False,
+        state: Optional[step_cache.State] = None,
+    ) -> None:
         self.in_file = in_file_path
+        # keep spectra of v7.3 (HDF5) files on disk until they are processed
+        self.lazy = lazy
+        # dtype the spectra are converted to once on load, taken from the settings if not provided
+        self._dtype = dtype
+        # undo/redo history of the edits, kept only if the map is edited interactively
+        self.history = history.History() if keep_history else None
 
         self._mdict = {}  # dict to save matlab dict into
         self.x_axis = None
@@ -42,57 +67,244 @@ class SpectralMap:
         self._spike_info = {}
         self._water_info = {}
         self._components = []
-        self.maxima = None
-        self.averages = None
+
+        # `maxima` and `averages` are computed when they are read, None means they have to be computed
+        # for the whole map, `_dirty` marks spectra that have been changed in place since
+        self._maxima = None
+        self._averages = None
+        self._dirty = None
+
+        if state is not None:
+            # the map is restored from the step cache instead of the file
+            self.set_state(state)
+            return
 
         # Now load from matlab, then identify format and load according to it
         self.load_matlab()
 
     @property
     def shape(self):
-        return self.data.shape
+        return self._data.shape
 
     @property
     def data(self):
+        # lazily loaded spectra are read into memory once they are needed as a whole
+        if isinstance(self._data, matlab_hdf5.MatlabHDF5Array):
+            self._data = np.asarray(self._data)
         return self._data
 
+    def get_spectrum(self, x: int, y: int) -> np.ndarray:
+        """
+        A function to get one spectrum of the map without loading the whole map if it is loaded lazily.
+
+        Parameters:
+            x (int): x coordinate (row) in the spectral map.
+            y (int): y coordinate (column) in the spectral map.
+
+        Returns:
+            spectrum (np.ndarray): Spectrum on the given position.
+        """
+
+        return self._data[x, y]
+
+    @property
+    def maxima(self) -> np.ndarray:
+        self._update_summary()
+        return self._maxima
+
+    @property
+    def averages(self) -> np.ndarray:
+        self._update_summary()
+        return self._averages
+
+    def mark_dirty(self, x=slice(None), y=slice(None)) -> None:
+        """
+        A function to report that spectra of the map have been changed in place, so that only their `maxima`
+        and `averages` are updated once these are read.
+
+        Parameters:
+            x (int | slice | np.ndarray): x coordinates (rows) of the changed spectra. Default: all rows.
+            y (int | slice | np.ndarray): y coordinates (columns) of the changed spectra. Default: all columns.
+        """
+
+        # nothing to do if they are to be computed for the whole map anyway
+        if self._maxima is not None:
+            self._dirty[x, y] = True
+
+    def _update_summary(self) -> None:
+        """
+        Computes `maxima` and `averages` of the whole map or of the changed spectra only.
+        The whole map is computed by blocks of rows, so that the lazily loaded spectra are never in memory at once.
+        """
+
+        if self._maxima is None:
+            maxima = np.empty(self._data.shape[:2], dtype=self._data.dtype)
+            averages = np.empty(
+                self._data.shape[:2], dtype=np.result_type(self._data.dtype, np.float32)
+            )
+            for rows in executor.iterate_row_slices(self._data, temporaries=1):
+                block = self._data[rows]
+                maxima[rows] = np.max(block, axis=2)
+                averages[rows] = np.mean(block, axis=2)
+
+            self._maxima, self._averages = maxima, averages
+            self._dirty = np.zeros(self._data.shape[:2], dtype=bool)
+
+        elif self._dirty.any():
+            x, y = np.nonzero(self._dirty)
+            spectra = self.data[x, y]
+            self._maxima[x, y] = np.max(spectra, axis=-1)
+            self._averages[x, y] = np.mean(spectra, axis=-1)
+            self._dirty[:] = False
+
+    def _set_lazy_data(self, value: matlab_hdf5.MatlabHDF5Array) -> None:
+        """
+        Sets lazily loaded spectra, `maxima` and `averages` are computed by blocks of rows once they are read.
+        """
+
+        self._data = value
+
+        self._maxima = None
+        self._averages = None
+        self._reset_info()
+
     @data.setter
     def data(self, value):
         self._data = value
 
-        self.maxima = np.max(self.data, axis=2)
-        self.averages = np.mean(self.data, axis=2)
+        self._maxima = None
+        self._averages = None
+        self._reset_info()
+
+    def _reset_info(self) -> None:
+        """
+        Resets the information computed from the data (spikes, water, components).
+        """
+
         self._spike_info = {}
         self._water_info = {}
         self._components = []
 
-    def load_matlab(self) -> None:
+    @contextmanager
+    def _history_step(self, kind: str, name: str, *args):
         """
-        Compatible with spectroscopes: TODO
-        - ...
+        Records the step into the history (if it is kept) before it is applied, see `History.record_<kind>`,
+        and keeps the history within its budget after it is applied.
         """
 
+        if self.history is None:
+            yield
+            return
+
+        getattr(self.history, f"record_{kind}")(name, self, *args)
         try:
-            # load .mat data with expected structure
-            matlab_data = scipy.io.loadmat(self.in_file, mdict=self._mdict)
+            yield
+        finally:
+            self.history.evict(self)
+
+    def get_state(self) -> step_cache.State:
+        """
+        A function to get the state of the map kept in the step cache.
+        """
+
+        return step_cache.State(
+            self._mdict, self.data, self.x_axis, self.units, self._components
+        )
+
+    def set_state(self, state: step_cache.State) -> None:
+        """
+        A function to set the state of the map restored from the step cache.
+        """
+
+        self._mdict = state.mdict
+        self.x_axis = state.x_axis
+        self.units = state.units
+        self.data = state.data
+        self._components = state.components
+
+    def undo(self) -> Optional[str]:
+        """
+        A function to revert the last edit of the map.
+
+        Returns:
+            name (str | None): Name of the reverted step, None if there is nothing to undo.
+        """
 
-            name = list(self._mdict)[-1]
-            matlab_data = matlab_data[name][0, 0]
+        return None if self.history is None else self.history.undo(self)
 
-            data = matlab_data[7]
+    def redo(self) -> Optional[str]:
+        """
+        A function to apply the last reverted edit of the map again.
 
-            map_shape = tuple(matlab_data[5][0])
+        Returns:
+            name (str | None): Name of the step, None if there is nothing to redo.
+        """
 
-            self.units = matlab_data[9][1][1]
-            self.x_axis = matlab_data[9][1][0][0]
-            self.data = np.reshape(data, (map_shape[1], map_shape[0], -1))
+        return None if self.history is None else self.history.redo(self)
+
+    def load_matlab(self) -> None:
+        """
+        A function to load the map from the file in any of the formats registered in `loaders`
+        (WITec `.mat` files, `.npy` and `.npz` arrays, ...). The format is detected from the content of the file.
+        """
+
+        try:
+            reader = loaders.get_reader(self.in_file)
+            use_cache = reader.cacheable and cache.is_enabled()
+            cached = cache.load(self.in_file) if use_cache else None
+
+            if cached is not None:
+                # spectra of cached files are memory-mapped from the cache
+                self._mdict, data = cached
+                _, self.x_axis, self.units = loaders.read_witec_fields(
+                    self.in_file, self._mdict
+                )
+            else:
+                # spectra are cached by blocks, so they may stay on the disk until then
+                self._mdict, data, self.x_axis, self.units = reader.read(
+                    Path(self.in_file), lazy=self.lazy or use_cache
+                )
+
+                if use_cache:
+                    cached_data = cache.save(
+                        self.in_file,
+                        self._mdict,
+                        data,
+                        loaders.DATA_FIELD,
+                        self.units,
+                        self.x_axis,
+                    )
+                    # lazy data are read from the cache from now on
+                    if (
+                        isinstance(data, matlab_hdf5.MatlabHDF5Array)
+                        and cached_data is not None
+                    ):
+                        data = cached_data
+
+            # the processing keeps the dtype of the spectra, so they are converted only here
+            dtype = (
+                executor.get_dtype(data.dtype) if self._dtype is None else self._dtype
+            )
+            data = data.astype(dtype, copy=False)
+
+            if isinstance(data, matlab_hdf5.MatlabHDF5Array):
+                if self.lazy:
+                    self._set_lazy_data(data)
+                else:
+                    self.data = np.asarray(data)
+            else:
+                self.data = data
 
             # print(self.data.nbytes / 1024 / 1024)
 
-            # TODO: assert or if with possible raise?
-            assert (
-                self.x_axis.shape[0] == self.data.shape[-1]
-            ), "x-axis shape does not match with the data"
+            if self.x_axis.shape[0] != self.shape[-1]:
+                raise loaders.FormatError(
+                    f"{self.in_file}: x-axis shape does not match with the data"
+                )
+
+        except loaders.FormatError:
+            # the message already says what is wrong with the file
+            raise
 
         except Exception as e:
             print(e)
@@ -100,12 +312,16 @@ class SpectralMap:
             # TODO: what should be returned so that the app still works?
             # -> some window stating this message if not auto processing, else skip and log this message
 
-    def save_matlab(
+    def _prepare_save(
         self,
         out_folder_path: Union[str, Path],
         file_tag: Optional[str] = None,
         file_name: Optional[Union[str, Path]] = None,
-    ) -> None:
+    ) -> str:
+        """
+        Gets the name of the output file and updates the metadata of the struct (x-axis and shape of the map).
+        """
+
         FALLBACK_EXTENSION = ".mat"
         out_file = paths.create_new_file_name(
             out_folder_path,
@@ -114,38 +330,121 @@ class SpectralMap:
             file_tag,
         )
 
+        name = list(self._mdict)[-1]
+        self._mdict[name][0, 0][9][1][0] = [self.x_axis]
+        self._mdict[name][0, 0][5][0] = self.shape[:2][::-1]
+
+        # reserve the name, so that the files saved in the background do not overwrite each other
+        open(out_file, "wb").close()
+
+        return out_file
+
+    def _save(
+        self,
+        out_file: str,
+        file_format: Optional[str] = None,
+        compression: Optional[int] = None,
+    ) -> str:
         try:
-            name = list(self._mdict)[-1]
-            self._mdict[name][0, 0][9][1][0] = [self.x_axis]
-            self._mdict[name][0, 0][7] = np.reshape(
-                self.data, (self.data.shape[0] * self.data.shape[1], -1), order="C"
+            # lazily loaded spectra are saved by blocks without being loaded as a whole
+            matlab_writer.savemat(
+                out_file,
+                self._mdict,
+                self._data,
+                loaders.DATA_FIELD,
+                file_format,
+                compression,
             )
-            self._mdict[name][0, 0][5][0] = self.data.shape[:2][::-1]
 
-            scipy.io.savemat(out_file, appendmat=True, mdict=self._mdict)
+        except Exception as e:
+            if os.path.exists(out_file):
+                os.remove(out_file)
+            raise Exception(f"{self.in_file}: {e}")
 
+        return out_file
+
+    def save_matlab(
+        self,
+        out_folder_path: Union[str, Path],
+        file_tag: Optional[str] = None,
+        file_name: Optional[Union[str, Path]] = None,
+        file_format: Optional[str] = None,
+        compression: Optional[int] = None,
+    ) -> str:
+        """
+        A function to save the map into `.mat` file, the spectra are streamed into the file by blocks.
+
+        Parameters:
+            out_folder_path (str | Path): Folder to save the file into.
+            file_tag (str): Tag appended to the name of the file. Default: None.
+            file_name (str | Path): Name of the file, name of the loaded file is used if not provided. Default: None.
+            file_format (str): 'v5' or 'v7.3' (HDF5), see `matlab_writer.savemat`. Default: None.
+            compression (int): Compression level (0-9), see `matlab_writer.savemat`. Default: None.
+
+        Returns:
+            out_file (str): Path of the saved file.
+        """
+
+        try:
+            out_file = self._prepare_save(out_folder_path, file_tag, file_name)
         except Exception as e:
             raise Exception(f"{self.in_file}: {e}")
 
-    def crop_spectra_absolute(self, crop_start: float, crop_end: float) -> None:
-        self.data, self.x_axis = cropping.crop_spectra_absolute(
-            self.data, self.x_axis, crop_start, crop_end
+        return self._save(out_file, file_format, compression)
+
+    def save_matlab_async(
+        self,
+        out_folder_path: Union[str, Path],
+        file_tag: Optional[str] = None,
+        file_name: Optional[Union[str, Path]] = None,
+        file_format: Optional[str] = None,
+        compression: Optional[int] = None,
+        callback: Optional[Callable[[futures.Future], None]] = None,
+    ) -> futures.Future:
+        """
+        A function to save the map into `.mat` file in the background, see `save_matlab`.
+        The data must not be changed in place until the saving is finished.
+
+        Parameters:
+            callback (Callable): Function called with the finished future from the saving thread. Default: None.
+
+        Returns:
+            future (concurrent.futures.Future): Future of the path of the saved file.
+        """
+
+        try:
+            out_file = self._prepare_save(out_folder_path, file_tag, file_name)
+        except Exception as e:
+            raise Exception(f"{self.in_file}: {e}")
+
+        return matlab_writer.submit(
+            self._save, out_file, file_format, compression, callback=callback
         )
 
+    def crop_spectra_absolute(self, crop_start: float, crop_end: float) -> None:
+        with self._history_step("replace", "Cropping"):
+            self.data, self.x_axis = cropping.crop_spectra_absolute(
+                self.data, self.x_axis, crop_start, crop_end
+            )
+
     def crop_spectra_relative(self, crop_first: int, crop_last: int) -> None:
-        self.data, self.x_axis = cropping.crop_spectra_relative(
-            self.data, self.x_axis, crop_first, crop_last
-        )
+        with self._history_step("replace", "Cropping"):
+            self.data, self.x_axis = cropping.crop_spectra_relative(
+                self.data, self.x_axis, crop_first, crop_last
+            )
 
     def crop_spectral_map(self, left: int, top: int, right: int, bottom: int) -> None:
-        self.data = cropping.crop_map(self.data, left, top, right, bottom)
+        with self._history_step("replace", "Cropping"):
+            self.data = cropping.crop_map(self.data, left, top, right, bottom)
 
     def interpolate_withing_range(
         self, x_index: int, y_index: int, start: float, end: float
     ) -> None:
-        self.data[x_index, y_index] = manual_removal.interpolate_within_range(
-            self.data[x_index, y_index], self.x_axis, start, end
-        )
+        with self._history_step("pixels", "Manual Spike Removal", x_index, y_index):
+            self.data[x_index, y_index] = manual_removal.interpolate_within_range(
+                self.data[x_index, y_index], self.x_axis, start, end
+            )
+        self.mark_dirty(x_index, y_index)
 
     def _calculate_spikes_indices(self) -> None:
         map_indices, peak_positions = custom_auto_removal.calculate_spikes_indices(
@@ -158,45 +457,62 @@ class SpectralMap:
     def auto_spike_removal(self) -> None:
         if not self._spike_info:
             self._calculate_spikes_indices()
-        self.data = custom_auto_removal.remove_spikes(
-            self.data,
-            self._spike_info["map_indices"],
-            self._spike_info["peak_positions"],
+        # spikes are removed in place, so only the spectra with spikes are changed
+        map_indices = np.array(self._spike_info["map_indices"], dtype=int).reshape(
+            (-1, 2)
         )
+        with self._history_step(
+            "pixels", "Auto Spike Removal", map_indices[:, 0], map_indices[:, 1]
+        ):
+            custom_auto_removal.remove_spikes(
+                self.data,
+                self._spike_info["map_indices"],
+                self._spike_info["peak_positions"],
+            )
+
+        self.mark_dirty(map_indices[:, 0], map_indices[:, 1])
+
+        self._spike_info = {}
+        self._water_info = {}
+        self._components = []
 
     def background_removal_math_morpho(
         self,
         ignore_water: bool,
-        signal_to_emit: Signal = None,
+        fast: bool = False,
+        signal_to_emit: ProgressCallback = None,
         one_spectrum: Optional[np.ndarray] = None,
     ) -> Optional[np.ndarray]:
         if one_spectrum is not None:
-            return math_morpho._math_morpho_on_spectrum(
-                one_spectrum, self.x_axis, ignore_water
+            return math_morpho.math_morpho_batch(
+                one_spectrum[np.newaxis, :], self.x_axis, ignore_water
+            )[0]
+        with self._history_step("snapshot", "Background Removal"):
+            self.data = math_morpho.math_morpho(
+                self.data, self.x_axis, ignore_water, signal_to_emit, fast
             )
-        self.data = math_morpho.math_morpho(
-            self.data, self.x_axis, ignore_water, signal_to_emit
-        )
 
     def background_removal_imodpoly(
         self,
         degree: int,
         ignore_water: bool,
-        signal_to_emit: Signal = None,
+        signal_to_emit: ProgressCallback = None,
         one_spectrum: Optional[np.ndarray] = None,
     ) -> Optional[np.ndarray]:
         if one_spectrum is not None:
             return imodpoly.imodpoly_bg(one_spectrum, self.x_axis, degree, ignore_water)
-        self.data = imodpoly.imodpoly(
-            self.data, self.x_axis, degree, ignore_water, signal_to_emit
-        )
+        with self._history_step("snapshot", "Background Removal"):
+            self.data = imodpoly.imodpoly(
+                self.data, self.x_axis, degree, ignore_water, signal_to_emit
+            )
 
     def background_removal_poly(
         self, degree: int, ignore_water: bool, one_spectrum: Optional[np.ndarray] = None
     ) -> Optional[np.ndarray]:
         if one_spectrum is not None:
             return poly.poly_bg(one_spectrum, self.x_axis, degree, ignore_water)
-        self.data = poly.poly(self.data, self.x_axis, degree, ignore_water)
+        with self._history_step("snapshot", "Background Removal"):
+            self.data = poly.poly(self.data, self.x_axis, degree, ignore_water)
 
     def background_removal_airpls(
         self,
@@ -204,14 +520,15 @@ class SpectralMap:
         one_spectrum: Optional[np.ndarray] = None,
     ) -> Optional[np.ndarray]:
         if one_spectrum is not None:
-            return airpls.airPLS_spectrum(one_spectrum, self.x_axis, lambda_)
-        self.data = airpls.airPLS(self.data, lambda_)
+            return airpls.airPLS_spectrum(one_spectrum, lambda_)
+        with self._history_step("snapshot", "Background Removal"):
+            self.data = airpls.airPLS(self.data, lambda_)
 
     def background_removal_bubblefill(
         self,
         bubble_size: int,
         water_bubble_size: int,
-        signal_to_emit: Signal = None,
+        signal_to_emit: ProgressCallback = None,
         one_spectrum: Optional[np.ndarray] = None,
     ) -> None:
         # TODO: tune this
@@ -223,12 +540,16 @@ class SpectralMap:
             return bubblefill.bubblefill_bg(
                 one_spectrum, self.x_axis, min_bubble_widths
             )
-        self.data = bubblefill.bubblefill(
-            self.data, self.x_axis, min_bubble_widths, signal_to_emit=signal_to_emit
-        )
+        with self._history_step("snapshot", "Background Removal"):
+            self.data = bubblefill.bubblefill(
+                self.data, self.x_axis, min_bubble_widths, signal_to_emit=signal_to_emit
+            )
 
     def linearization(self, step: float) -> None:
-        self.data, self.x_axis = linearization.linearize(self.data, self.x_axis, step)
+        with self._history_step("replace", "Linearization"):
+            self.data, self.x_axis = linearization.linearize(
+                self.data, self.x_axis, step
+            )
 
     def decomposition_PCA(
         self,
@@ -239,7 +560,7 @@ class SpectralMap:
     def decomposition_NMF(
         self,
         n_components: int,
-        signal_to_emit: Signal = None,
+        signal_to_emit: ProgressCallback = None,
     ) -> None:
         self._components = NMF.NMF(self.data, n_components, signal_to_emit)
 
@@ -275,7 +596,10 @@ class SpectralMap:
     ):
         if one_spectrum is not None:
             return whittaker.whittaker(one_spectrum, lam, diff)
-        self.data = whittaker.whittaker(self.data, lam, diff)
+        with self._history_step("snapshot", "Smoothing"):
+            self.data = executor.map_spectra(
+                self.data, whittaker.whittaker, lam, diff, out=self.data
+            )
 
     def smoothing_savgol(
         self,
@@ -285,7 +609,10 @@ class SpectralMap:
     ):
         if one_spectrum is not None:
             return savgol.savgol(one_spectrum, window_length, polyorder)
-        self.data = savgol.savgol(self.data, window_length, polyorder)
+        with self._history_step("snapshot", "Smoothing"):
+            self.data = executor.map_spectra(
+                self.data, savgol.savgol, window_length, polyorder, out=self.data
+            )
 
     def _calculate_average_water(self, threshold: float = 0.3) -> None:
         average_water, water_mask = water_normalization._get_average_water(
@@ -300,9 +627,10 @@ class SpectralMap:
         if not self._water_info:
             self._calculate_average_water()
 
-        self.data = water_normalization.water_normalization(
-            self.data, self.x_axis, self._water_info["average_water"]
-        )
+        with self._history_step("replace", "Normalization"):
+            self.data = water_normalization.water_normalization(
+                self.data, self.x_axis, self._water_info["average_water"]
+            )
 
 
 if __name__ == "__main__":
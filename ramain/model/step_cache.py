@@ -0,0 +1,230 @@
+"""
+Cache of the intermediate states of the maps processed by the automatic pipelines, it is off by default.
+States are keyed by the input file (its path, size and modification time, or its content if `step_cache/content_keys`
+is set) and by the steps made so far (functions and their parameters), so a rerun of the pipeline with changed last
+steps (e.g. number of the NMF components) resumes from the longest cached prefix.
+Only the last state before the first saving or export step is cached for each file, the outputs are always made again.
+Entries are stored like the ones of `cache`: spectra as `.npy` (read back memory-mapped), components as `.npz`
+and the rest as `.json` metadata; the least recently used entries are removed above the maximal size.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Union
+
+from ramain.model import cache, loaders
+from ramain.spectra_processing import executor
+from ramain.utils.settings import SETTINGS
+
+CACHE_VERSION = 1
+
+# maximal size (in MB) of the cached states, the least recently used entries are removed above it
+DEFAULT_MAX_SIZE = 2 * 1024
+
+# steps that write the outputs, neither they nor the steps after them are cached
+OUTPUT_STEPS = ("save_matlab", "export_to_graphics", "export_to_text")
+
+# steps that do not change the spectra, their entries share the spectra of the previous entry
+KEEP_DATA_STEPS = ("decomposition_NMF", "decomposition_PCA")
+
+CHUNK_SIZE = 1 << 20
+
+
+class State(NamedTuple):
+    """
+    State of the `SpectralMap` kept in the cache.
+    """
+
+    mdict: dict
+    data: np.ndarray
+    x_axis: np.ndarray
+    units: str
+    components: list
+
+
+def is_enabled() -> bool:
+    return SETTINGS.value("step_cache/enabled", False, type=bool)
+
+
+def get_cache_dir() -> Path:
+    """
+    A function to get the directory of the step cache (inside the directory of `cache`).
+    """
+
+    return cache.get_cache_dir().joinpath("steps")
+
+
+def _get_source_key(source_path: Union[str, Path]) -> str:
+    """
+    Hashes the identity of the file (path, size and modification time) and the dtype it is processed in.
+    The content of the file is hashed instead if `step_cache/content_keys` is set, so that copies of the file
+    share the entries, but the whole file is read then.
+    """
+
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{CACHE_VERSION}|{executor.get_dtype(np.float64)}".encode())
+
+    if SETTINGS.value("step_cache/content_keys", False, type=bool):
+        with open(source_path, "rb") as file:
+            while chunk := file.read(CHUNK_SIZE):
+                digest.update(chunk)
+    else:
+        stat = os.stat(source_path)
+        digest.update(
+            f"|{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}".encode()
+        )
+
+    return digest.hexdigest()
+
+
+def get_keys(source_path: Union[str, Path], steps: List[tuple]) -> List[str]:
+    """
+    A function to get keys of the states after the cacheable steps of the pipeline.
+
+    Parameters:
+        source_path (str | Path): Path to the input file.
+        steps (List[batch.Step]): The pipeline, steps are (text, function, params).
+
+    Returns:
+        keys (List[str]): Key of the state after each step before the first output step.
+    """
+
+    keys = []
+    key = _get_source_key(source_path)
+    for _, function, params in steps:
+        if function.__name__ in OUTPUT_STEPS:
+            break
+
+        step = json.dumps(
+            [function.__module__, function.__qualname__, list(params)], default=repr
+        )
+        key = hashlib.blake2b(f"{key}|{step}".encode(), digest_size=20).hexdigest()
+        keys.append(key)
+
+    return keys
+
+
+def load(key: str, cache_dir: Optional[Path] = None) -> Optional[State]:
+    """
+    A function to load the cached state.
+
+    Parameters:
+        key (str): Key of the state, see `get_keys`.
+        cache_dir (Path): Cache directory, taken from the settings if not provided. Default: None.
+
+    Returns:
+        state (State | None): The state with the spectra memory-mapped copy-on-write, None if it is not cached.
+    """
+
+    cache_dir = get_cache_dir() if cache_dir is None else Path(cache_dir)
+    metadata_path = cache_dir.joinpath(f"{key}.json")
+
+    if not metadata_path.exists():
+        return None
+
+    try:
+        with open(metadata_path, "r") as file:
+            metadata = json.load(file)
+
+        if metadata["version"] != CACHE_VERSION:
+            return None
+
+        data_path = cache_dir.joinpath(f"{metadata['data']}.npy")
+        data = np.load(data_path, mmap_mode="c")
+
+        components = []
+        if metadata["components"]:
+            with np.load(cache_dir.joinpath(f"{key}.npz")) as arrays:
+                components = [
+                    {"map": arrays[f"map_{i}"], "plot": arrays[f"plot_{i}"]}
+                    for i in range(metadata["components"])
+                ]
+
+        mdict = {metadata["name"]: cache._decode(metadata["struct"])}
+
+    except (OSError, ValueError, KeyError):
+        # spectra of the entry have been evicted
+        metadata_path.unlink(missing_ok=True)
+        cache_dir.joinpath(f"{key}.npz").unlink(missing_ok=True)
+        return None
+
+    # mark the entry as recently used
+    os.utime(data_path)
+
+    return State(
+        mdict, data, np.array(metadata["x_axis"]), metadata["units"], components
+    )
+
+
+def save(
+    key: str,
+    state: State,
+    data_key: Optional[str] = None,
+    cache_dir: Optional[Path] = None,
+    evict: bool = True,
+) -> bool:
+    """
+    A function to save the state into the cache. Caching is optional, so the entry is just not created
+    if the state cannot be saved.
+
+    Parameters:
+        key (str): Key of the state, see `get_keys`.
+        state (State): The state.
+        data_key (str): Key of the cached state with the same spectra, the spectra are saved if not provided.
+            Default: None.
+        cache_dir (Path): Cache directory, taken from the settings if not provided. Default: None.
+        evict (bool): Whether to keep the directory within the maximal size of the cache. Default: True.
+
+    Returns:
+        saved (bool): Whether the entry was created.
+    """
+
+    cache_dir = get_cache_dir() if cache_dir is None else Path(cache_dir)
+
+    try:
+        name = list(state.mdict)[-1]
+        skeleton = state.mdict[name].copy()
+        skeleton[0, 0][loaders.DATA_FIELD] = np.empty((0, 0))
+
+        metadata = {
+            "version": CACHE_VERSION,
+            "data": key if data_key is None else data_key,
+            "name": name,
+            "units": str(state.units),
+            "x_axis": np.asarray(state.x_axis).tolist(),
+            "components": len(state.components),
+            "struct": cache._encode(skeleton),
+        }
+
+    except (TypeError, ValueError):
+        return False
+
+    writers = {}
+    if data_key is None:
+        writers[".npy"] = lambda path: np.save(path, state.data)
+    if state.components:
+        arrays = {}
+        for i, component in enumerate(state.components):
+            arrays[f"map_{i}"] = component["map"]
+            arrays[f"plot_{i}"] = component["plot"]
+        writers[".npz"] = lambda path: np.savez(path, **arrays)
+    # metadata are the last, so that the entry is complete once they exist
+    writers[".json"] = lambda path: cache.write_json(path, metadata)
+
+    if not cache.write_entry(cache_dir, key, writers):
+        return False
+
+    if evict:
+        # entries sharing the removed spectra are removed once they are loaded
+        cache.evict(
+            cache_dir,
+            "step_cache/max_size",
+            DEFAULT_MAX_SIZE,
+            keep=(key, data_key),
+            suffixes=(".npz", ".json"),
+        )
+
+    return True
@@ -0,0 +1,150 @@
+"""
+Index of the `averages` and `maxima` images and summary statistics of the spectral maps, so that the maps
+can be previewed (e.g. in the file list) without loading their spectra. Entries are stored as `.npz` files
+in the cache directory and keyed the same way as the conversion cache, i.e. invalidated by modification time.
+"""
+
+import os
+import numpy as np
+from pathlib import Path
+from typing import Optional, Union
+
+from ramain.model import cache
+from ramain.model.spectal_map import SpectralMap
+from ramain.utils.settings import SETTINGS
+
+THUMBNAILS_VERSION = 1
+
+
+def is_enabled() -> bool:
+    return SETTINGS.value("thumbnails/enabled", True, type=bool)
+
+
+def get_index_dir() -> Path:
+    """
+    A function to get the directory of the index (inside of the cache directory).
+    """
+
+    return cache.get_cache_dir().joinpath("thumbnails")
+
+
+def get_summary(averages: np.ndarray, maxima: np.ndarray) -> dict:
+    """
+    A function to get summary statistics of the map from its `averages` and `maxima` images.
+
+    Parameters:
+        averages (np.ndarray): Averages of the spectra, 2D array.
+        maxima (np.ndarray): Maxima of the spectra, 2D array.
+
+    Returns:
+        summary (dict): Mean and standard deviation of the averages and the maximal intensity.
+    """
+
+    return {
+        "mean": float(np.mean(averages)),
+        "std": float(np.std(averages)),
+        "max": float(np.max(maxima)),
+    }
+
+
+def load(
+    source_path: Union[str, Path], index_dir: Optional[Path] = None
+) -> Optional[dict]:
+    """
+    A function to load the indexed thumbnail of the `source_path` file.
+
+    Parameters:
+        source_path (str | Path): Path to the source `.mat` file.
+        index_dir (Path): Directory of the index, taken from the settings if not provided. Default: None.
+
+    Returns:
+        thumbnail (dict | None): Dict with 'averages', 'maxima' and the summary (see `get_summary`),
+            None if the file is not indexed or it has been changed since.
+    """
+
+    index_dir = get_index_dir() if index_dir is None else Path(index_dir)
+
+    try:
+        with np.load(index_dir.joinpath(f"{cache._get_key(source_path)}.npz")) as entry:
+            if int(entry["version"]) != THUMBNAILS_VERSION:
+                return None
+            averages, maxima = entry["averages"], entry["maxima"]
+
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return {"averages": averages, "maxima": maxima, **get_summary(averages, maxima)}
+
+
+def compute(source_path: Union[str, Path]) -> dict:
+    """
+    A function to compute the thumbnail of the `source_path` file.
+    Spectra of v7.3 files are processed by blocks, i.e. they are never loaded as a whole.
+
+    Parameters:
+        source_path (str | Path): Path to the source `.mat` file.
+
+    Returns:
+        thumbnail (dict): See `load`.
+    """
+
+    spectral_map = SpectralMap(source_path, lazy=True)
+    averages, maxima = spectral_map.averages, spectral_map.maxima
+
+    return {"averages": averages, "maxima": maxima, **get_summary(averages, maxima)}
+
+
+def save(
+    source_path: Union[str, Path], thumbnail: dict, index_dir: Optional[Path] = None
+) -> None:
+    """
+    A function to save the `thumbnail` of the `source_path` file into the index.
+    The index is optional, so the entry is just not created if it cannot be saved.
+
+    Parameters:
+        source_path (str | Path): Path to the source `.mat` file.
+        thumbnail (dict): See `load`.
+        index_dir (Path): Directory of the index, taken from the settings if not provided. Default: None.
+    """
+
+    index_dir = get_index_dir() if index_dir is None else Path(index_dir)
+
+    key = cache._get_key(source_path)
+    temp_path = index_dir.joinpath(f"{key}.tmp.npz")
+
+    try:
+        index_dir.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            temp_path,
+            version=THUMBNAILS_VERSION,
+            averages=thumbnail["averages"],
+            maxima=thumbnail["maxima"],
+        )
+        os.replace(temp_path, index_dir.joinpath(f"{key}.npz"))
+
+    except OSError:
+        temp_path.unlink(missing_ok=True)
+
+
+def get_thumbnail(
+    source_path: Union[str, Path], index_dir: Optional[Path] = None
+) -> dict:
+    """
+    A function to get the thumbnail of the `source_path` file from the index, it is computed and indexed
+    if it is not there yet.
+
+    Parameters:
+        source_path (str | Path): Path to the source `.mat` file.
+        index_dir (Path): Directory of the index, taken from the settings if not provided. Default: None.
+
+    Returns:
+        thumbnail (dict): See `load`.
+    """
+
+    thumbnail = load(source_path, index_dir)
+
+    if thumbnail is None:
+        thumbnail = compute(source_path)
+        save(source_path, thumbnail, index_dir)
+
+    return thumbnail
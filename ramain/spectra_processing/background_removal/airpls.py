@@ -34,15 +34,76 @@ import numpy as np
 import scipy.sparse as ss
 from scipy.sparse import linalg
 
+from ramain.utils import banded
+from ramain.spectra_processing import executor
+
 
 def airPLS(spectral_map: np.ndarray, lambda_: int) -> None:
     """
     A function to perform airPLS algorithm on the whole spectral map in the auto processing module.
     """
 
-    backgrounds = np.apply_along_axis(airPLS_spectrum, 2, spectral_map, lambda_)
-    spectral_map -= backgrounds
-    return spectral_map
+    return executor.subtract_backgrounds(
+        spectral_map, airPLS_batch, lambda_, temporaries=8
+    )
+
+
+def airPLS_batch(
+    spectra: np.ndarray, lambda_: int = 10**4, porder: int = 1, itermax: int = 20
+) -> np.ndarray:
+    """
+    Adaptive iteratively reweighted penalized least squares for baseline fitting of many spectra at once.
+    Same algorithm as `airPLS_spectrum`, but the penalty band `lambda_` * D^T D is built only once
+    (and cached) and all reweighted systems of one iteration are solved together by a banded Cholesky solver.
+    Spectra that have already converged drop out of the following iterations.
+
+    Parameters:
+        spectra (np.ndarray): 2D array of spectra, one spectrum per row.
+        lambda_ (int): Parameter that can be adjusted by user. The larger lambda is,  the smoother the resulting background. Default: 10**4.
+        porder (int): Order of the difference of penalties. Default: 1.
+        itermax (int): Maximum iterations. Default: 20.
+
+    Returns:
+        result (np.ndarray): The fitted backgrounds, same shape as `spectra`.
+    """
+
+    x = spectra.astype(np.float64)
+    penalty = banded.difference_penalty_band(x.shape[1], lambda_, porder)
+
+    w = np.ones(x.shape)
+    backgrounds = np.empty(x.shape)
+    abs_sums = np.abs(x).sum(axis=1)
+    active = np.arange(x.shape[0])
+
+    for i in range(1, itermax + 1):
+        x_active, w_active = x[active], w[active]
+        z = banded.solveh_banded_batch(penalty, w_active, w_active * x_active)
+        backgrounds[active] = z
+
+        d = x_active - z
+        negative = d < 0
+        dssn = np.abs(np.where(negative, d, 0).sum(axis=1))
+
+        if i == itermax:
+            break
+
+        not_converged = dssn >= 0.001 * abs_sums[active]
+        active = active[not_converged]
+        if active.size == 0:
+            break
+
+        d, negative = d[not_converged], negative[not_converged]
+        dssn = dssn[not_converged, np.newaxis]
+
+        # d>0 means that this point is part of a peak, so its weight is set to 0 in order to ignore it
+        w_new = np.where(negative, np.exp(i * np.where(negative, -d, 0) / dssn), 0)
+        w_new[:, 0] = np.exp(
+            i * np.where(negative, d, -np.inf).max(axis=1) / dssn[:, 0]
+        )
+        w_new[:, -1] = w_new[:, 0]
+        w[active] = w_new
+
+    return backgrounds.astype(spectra.dtype, copy=False)
 
 
 def airPLS_spectrum(
@@ -4,9 +4,16 @@
 from typing import Tuple
 
 import numpy as np
-from scipy.signal import savgol_filter
 
-from PySide6.QtCore import Signal
+from ramain.utils.progress import ProgressCallback
+
+from ramain.spectra_processing import executor
+from ramain.spectra_processing.smoothing import savgol
+
+try:
+    from numba import prange
+except ImportError:
+    prange = range
 
 
 # njit decorator
@@ -207,12 +214,121 @@ def bubbleloop(
     return baseline
 
 
+@njit(cache=True)
+def bubbleloop_array(
+    spectrum: np.ndarray, baseline: np.ndarray, min_bubble_widths: np.ndarray
+) -> np.ndarray:
+    """
+    bubbleloop_array is the same as bubbleloop, but the range queue is a preallocated
+    array instead of a list so that the whole loop can be JIT-compiled.
+
+    Parameters
+    ----------
+    spectrum : np.ndarray
+        the input spectrum
+    baseline : np.ndarray
+        the initial baseline should be akin to np.zeros(spectrum.shape)
+    min_bubble_widths : np.ndarray
+        the minimum bubble widths to use, one for each x-coordinate.
+
+    Returns
+    -------
+    baseline : np.ndarray
+        the updated baseline
+    """
+    length = len(spectrum)
+
+    # NOTE: bubbles always shrink, so there are at most 2*len(s) - 1 non-empty
+    # and len(s) empty ranges in the queue
+    range_cue = np.empty((3 * length + 1, 2), dtype=np.int64)
+    range_cue[0, 0] = 0
+    range_cue[0, 1] = length
+    cue_end = 1
+
+    i = 0
+    while i < cue_end:
+        # Bubble parameter from bubblecue
+        left_bound = range_cue[i, 0]
+        right_bound = range_cue[i, 1]
+        i += 1
+
+        if left_bound == right_bound:
+            continue
+
+        min_bubble_width = min_bubble_widths[(left_bound + right_bound) // 2]
+
+        if left_bound == 0 and right_bound != length:
+            # half bubble right
+            alignment = "left"
+        elif left_bound != 0 and right_bound == length:
+            alignment = "right"
+            # half bubble left
+        else:
+            # Reached minimum bubble width
+            if (right_bound - left_bound) < min_bubble_width:
+                continue
+            # centered bubble
+            alignment = "center"
+
+        # new bubble
+        bubble, relative_touching_point = grow_bubble(
+            spectrum[left_bound:right_bound], alignment
+        )
+        touching_point = relative_touching_point + left_bound
+
+        # add bubble to baseline by keeping largest value
+        baseline[left_bound:right_bound] = np.maximum(
+            baseline[left_bound:right_bound], bubble
+        )
+        # Add new bubble(s) to bubblecue
+        if touching_point == left_bound:
+            range_cue[cue_end, 0] = touching_point + 1
+            range_cue[cue_end, 1] = right_bound
+            cue_end += 1
+        elif touching_point == right_bound:
+            range_cue[cue_end, 0] = left_bound
+            range_cue[cue_end, 1] = touching_point - 1
+            cue_end += 1
+        else:
+            range_cue[cue_end, 0] = left_bound
+            range_cue[cue_end, 1] = touching_point
+            range_cue[cue_end + 1, 0] = touching_point
+            range_cue[cue_end + 1, 1] = right_bound
+            cue_end += 2
+
+    return baseline
+
+
+@njit(cache=True, parallel=True)
+def bubbleloop_batch(spectra: np.ndarray, min_bubble_widths: np.ndarray) -> np.ndarray:
+    """
+    bubbleloop_batch runs bubbleloop_array on every spectrum (row) of `spectra`,
+    spectra are processed in parallel.
+
+    Parameters
+    ----------
+    spectra : np.ndarray
+        2D array of the input spectra, one spectrum per row
+    min_bubble_widths : np.ndarray
+        the minimum bubble widths to use, one for each x-coordinate.
+
+    Returns
+    -------
+    baselines : np.ndarray
+        the baselines of the spectra
+    """
+    baselines = np.zeros(spectra.shape)
+    for k in prange(spectra.shape[0]):
+        bubbleloop_array(spectra[k], baselines[k], min_bubble_widths)
+    return baselines
+
+
 def bubblefill_bg(
     spectrum: np.ndarray,
     x_axis: np.ndarray,
     min_bubble_widths: list = 50,
     fit_order: int = 1,
-    signal_to_emit: Signal = None,
+    signal_to_emit: ProgressCallback = None,
 ) -> Tuple[np.ndarray, np.ndarray]:
     """
     bubblefill splits a spectrum into it's raman and baseline components.
@@ -251,35 +367,72 @@ def bubblefill_bg(
     """
 
     if signal_to_emit is not None:
-        signal_to_emit.emit()
+        signal_to_emit.emit(1)
+
+    return bubblefill_bg_batch(
+        spectrum[np.newaxis, :], x_axis, min_bubble_widths, fit_order
+    )[0]
+
+
+def bubblefill_bg_batch(
+    spectra: np.ndarray,
+    x_axis: np.ndarray,
+    min_bubble_widths: list = 50,
+    fit_order: int = 1,
+) -> np.ndarray:
+    """
+    bubblefill_bg_batch is bubblefill_bg for many spectra at once. Slope removal and
+    final smoothing are done for all the spectra together, the bubble loops run in parallel.
+
+    Parameters
+    ----------
+    spectra : np.ndarray
+        2D array of the input spectra, one spectrum per row
+    min_bubble_widths: list or int
+        see bubblefill_bg
+    fit_order : int
+        see bubblefill_bg
+
+    Returns
+    -------
+    baselines : np.ndarray
+        the spectra's baseline components, one per row
+    """
+
+    if isinstance(min_bubble_widths, int):
+        filter_width = max(min_bubble_widths, 10)
+    else:
+        filter_width = max(min(min_bubble_widths), 10)
+    min_bubble_widths = np.broadcast_to(
+        np.asarray(min_bubble_widths, dtype=np.int64), x_axis.shape
+    )
 
     # Remove general slope
-    poly_fit = np.poly1d(np.polyfit(x_axis, spectrum, fit_order))(x_axis)
-    spectrum_ = spectrum - poly_fit
+    poly_fit = np.polyval(
+        np.polyfit(x_axis, spectra.T, fit_order), x_axis[:, np.newaxis]
+    ).T
+    spectra_ = spectra - poly_fit
 
     # Normalization
-    smin = spectrum_.min()  # value needed to return to the original scaling
-    spectrum_ = spectrum_ - smin
-    scale = spectrum_.max() / len(spectrum)
-    spectrum_ = spectrum_ / scale  # Rescale spectrum to X:Y=1:1 (square aspect ratio)
-
-    baseline = np.zeros(spectrum_.shape)
+    smin = spectra_.min(
+        axis=1, keepdims=True
+    )  # values needed to return to the original scaling
+    spectra_ = spectra_ - smin
+    scale = spectra_.max(axis=1, keepdims=True) / spectra.shape[1]
+    spectra_ = spectra_ / scale  # Rescale spectra to X:Y=1:1 (square aspect ratio)
 
     # Bubble loop (this is the bulk of the algorithm)
-    baseline = bubbleloop(spectrum_, baseline, min_bubble_widths)
+    baselines = bubbleloop_batch(spectra_, np.ascontiguousarray(min_bubble_widths))
 
     # Bringing baseline back in original scale
-    baseline = baseline * scale + poly_fit + smin
-
-    # Final smoothing of baseline (only if bubblewidth is not a list!!!)
-    if not isinstance(min_bubble_widths, int):
-        filter_width = max(min(min_bubble_widths), 10)
-    else:
-        filter_width = max(min_bubble_widths, 10)
+    baselines = baselines * scale + poly_fit + smin
 
-    baseline = savgol_filter(baseline, int(2 * (filter_width // 4) + 3), 3)
+    # Final smoothing of baseline
+    baselines = savgol.savgol(
+        baselines, int(2 * (filter_width // 4) + 3), 3, out=baselines
+    )
 
-    return baseline
+    return baselines
 
 
 def bubblefill(
@@ -287,17 +440,14 @@ def bubblefill(
     x_axis: np.ndarray,
     min_bubble_widths: list = 50,
     fit_order: int = 1,
-    signal_to_emit: Signal = None,
+    signal_to_emit: ProgressCallback = None,
 ):
-    backgrounds = np.apply_along_axis(
-        bubblefill_bg,
-        2,
+    return executor.subtract_backgrounds(
         spectral_map,
+        bubblefill_bg_batch,
         x_axis,
         min_bubble_widths,
         fit_order,
-        signal_to_emit,
+        signal_to_emit=signal_to_emit,
+        temporaries=5,
     )
-    spectral_map -= backgrounds
-
-    return spectral_map
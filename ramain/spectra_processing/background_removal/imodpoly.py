@@ -1,6 +1,7 @@
 import numpy as np
-from ramain.utils import indices
-from PySide6.QtCore import Signal
+from ramain.utils import indices, polynomial
+from ramain.spectra_processing import executor
+from ramain.utils.progress import ProgressCallback
 
 
 def imodpoly(
@@ -8,7 +9,7 @@ def imodpoly(
     x_axis: np.ndarray,
     degree: int,
     ignore_water: bool = True,
-    signal_to_emit: Signal = None,
+    signal_to_emit: ProgressCallback = None,
 ) -> np.ndarray:
     """
     A function that applies the I-ModPoly algorithm on the whole spectral map. Zhao et al (doi: 10.1366/000370207782597003)
@@ -19,12 +20,15 @@ def imodpoly(
         ignore_water (bool): Info whether variation of the algo with water ignorace should be performed. Default: True.
     """
 
-    backgrounds = np.apply_along_axis(
-        imodpoly_bg, 2, spectral_map, x_axis, degree, ignore_water, signal_to_emit
+    return executor.subtract_backgrounds(
+        spectral_map,
+        imodpoly_bg_batch,
+        x_axis,
+        degree,
+        ignore_water,
+        signal_to_emit=signal_to_emit,
+        temporaries=8,
     )
-    spectral_map -= backgrounds
-
-    return spectral_map
 
 
 def imodpoly_bg(
@@ -32,7 +36,7 @@ def imodpoly_bg(
     x_axis: np.ndarray,
     degree: int,
     ignore_water: bool = True,
-    signal_to_emit: Signal = None,
+    signal_to_emit: ProgressCallback = None,
 ) -> np.ndarray:
     """
     Implementation of I-ModPoly algorithm for bg subtraction (Zhao et al, doi: 10.1366/000370207782597003), added version
@@ -49,7 +53,7 @@ def imodpoly_bg(
     """
 
     if signal_to_emit is not None:
-        signal_to_emit.emit()
+        signal_to_emit.emit(1)
 
     x = x_axis
 
@@ -84,3 +88,117 @@ def imodpoly_bg(
 
     # NOTE: ploynomial has to be evaluated at every point of `x_axis` here as it is background for the whole spectrum
     return poly_obj(x_axis)
+
+
+def _solve_normal_equations(
+    normal_matrices: np.ndarray, right_sides: np.ndarray
+) -> np.ndarray:
+    """
+    Solves the batch of the normal equations. Systems of the spectra with fewer fitted points than coefficients
+    are singular, they get the least-squares (minimum norm) solution as `Polynomial.fit` gives.
+    """
+
+    singular = np.linalg.matrix_rank(normal_matrices, hermitian=True) < (
+        normal_matrices.shape[-1]
+    )
+    coefs = np.empty(right_sides.shape)
+
+    regular = ~singular
+    if regular.any():
+        coefs[regular] = np.linalg.solve(
+            normal_matrices[regular], right_sides[regular][..., np.newaxis]
+        )[..., 0]
+    if singular.any():
+        coefs[singular] = (
+            np.linalg.pinv(normal_matrices[singular], hermitian=True)
+            @ right_sides[singular][..., np.newaxis]
+        )[..., 0]
+
+    return coefs
+
+
+def imodpoly_bg_batch(
+    spectra: np.ndarray,
+    x_axis: np.ndarray,
+    degree: int,
+    ignore_water: bool = True,
+) -> np.ndarray:
+    """
+    Vectorized version of `imodpoly_bg` that iterates all the `spectra` simultaneously.
+    Points removed from the fit are represented by per-spectrum weight masks on the shared
+    Vandermonde basis, so weighted normal equations of all the spectra are solved as one batch.
+    Spectra that have already converged drop out of the following iterations.
+
+    Parameters:
+        spectra (np.ndarray): 2D array of spectra, one spectrum per row.
+        x_axis (np.ndarray): Values of the x-axis shared by all the spectra.
+        degree (int): Degree of the polynomial used for interpolation.
+        ignore_water (bool): Info whether variation of the algo with water ignorace should be performed. Default: True.
+
+    Returns:
+        result (np.ndarray): Estimated backgrounds of the provided `spectra`, same shape as `spectra`.
+    """
+
+    # ignore indices of water
+    if ignore_water:
+        to_fit = indices.get_no_water_indices(x_axis)
+    else:
+        to_fit = np.ones(x_axis.shape[0], dtype=bool)
+
+    vander = polynomial.scaled_vandermonde(x_axis, x_axis[to_fit], degree)
+    vander_fit = vander[to_fit]
+    n_points, n_coefs = vander_fit.shape
+
+    # products of all pairs of basis functions -> weighted normal matrices are then one matrix product
+    basis_products = (
+        vander_fit[:, :, np.newaxis] * vander_fit[:, np.newaxis, :]
+    ).reshape(n_points, n_coefs * n_coefs)
+
+    signals = spectra[:, to_fit].astype(np.float64)
+    weights = np.ones(signals.shape, dtype=bool)
+    coefficients = np.zeros((signals.shape[0], n_coefs))
+    prev_devs = np.zeros(signals.shape[0])
+
+    active = np.arange(signals.shape[0])
+    first_iter = True
+
+    # algorithm based on the article, one iteration for all not yet converged spectra
+    while active.size > 0:
+        signal = signals[active]
+        weight = weights[active].astype(np.float64)
+
+        normal_matrices = (weight @ basis_products).reshape(-1, n_coefs, n_coefs)
+        right_sides = (weight * signal) @ vander_fit
+        coefs = _solve_normal_equations(normal_matrices, right_sides)
+        poly = coefs @ vander_fit.T
+
+        # mean and deviation of residuals computed from the points that are still fitted
+        residual = signal - poly
+        counts = weight.sum(axis=1)
+        residual_mean = (weight * residual).sum(axis=1) / counts
+        DEV = np.sqrt(
+            (weight * (residual - residual_mean[:, np.newaxis]) ** 2).sum(axis=1)
+            / counts
+        )
+
+        if first_iter:  # remove peaks from fitting in first iteration
+            weights[active] = signal <= poly + DEV[:, np.newaxis]
+            first_iter = False
+        else:  # reconstruction
+            signals[active] = np.minimum(signal, poly + DEV[:, np.newaxis])
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            criterium = np.abs((DEV - prev_devs[active]) / DEV)
+
+        prev_devs[active] = DEV
+        coefficients[active] = coefs
+
+        # NOTE: NaN criterium (zero deviation) ends the iteration as in `imodpoly_bg`
+        not_converged = criterium > 0.05
+
+        active = active[not_converged]
+
+    # NOTE: ploynomial has to be evaluated at every point of `x_axis` here as it is background for the whole spectrum
+    backgrounds = coefficients @ vander.T
+
+    return backgrounds.astype(spectra.dtype, copy=False)
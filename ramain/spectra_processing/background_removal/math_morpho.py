@@ -1,6 +1,10 @@
 import numpy as np
+from sklearn import cluster
+from typing import Optional, Tuple
+
 from ramain.utils import math_morphology
-from PySide6.QtCore import Signal
+from ramain.spectra_processing import executor
+from ramain.utils.progress import ProgressCallback
 
 
 def get_optimal_structuring_element_width(values: np.ndarray) -> int:
@@ -42,7 +46,7 @@ def _math_morpho_step(y: np.ndarray, window_width: int) -> np.ndarray:
     Implementation of algorithm by Perez-Pueyo et al (doi: 10.1366/000370210791414281).
 
     Parameters:
-        y (np.ndarray): Values on which mathematical morphology methods are performed.
+        y (np.ndarray): Values on which mathematical morphology methods are performed (one spectrum or 2D stack of spectra).
         window_width (int): Width of the structuring element for MM operations.
 
     Returns:
@@ -53,81 +57,191 @@ def _math_morpho_step(y: np.ndarray, window_width: int) -> np.ndarray:
     approximation = np.mean(
         math_morphology.erosion(spectrum_opening, window_width)
         + math_morphology.dilation(spectrum_opening, window_width),
-        axis=0,
+        axis=-1,
+        keepdims=True,
     )
     return np.minimum(spectrum_opening, approximation)
 
 
-def _math_morpho_on_spectrum(
-    spectrum: np.ndarray,
+def get_optimal_structuring_element_widths(spectra: np.ndarray) -> np.ndarray:
+    """
+    Incremental version of `get_optimal_structuring_element_width` that searches the optimal widths of
+    many spectra at once. Openings with a growing structuring element are nested, i.e. opening of the
+    previous opening is the opening of the original values, and erosion with width `w` + 1 is erosion
+    of the erosion with width `w` by width 1. Only one unit erosion and one dilation are therefore
+    computed per width and spectra whose opening did not change `max_sim_counter` times in a row
+    drop out of the search.
+
+    Parameters:
+        spectra (np.ndarray): 2D array of values, one spectrum per row.
+
+    Returns:
+        window_widths (np.ndarray): Optimal structuring element width of each spectrum.
+    """
+
+    # how many similar results have to occur to end the algorithm
+    max_sim_counter = 3
+
+    window_widths = np.zeros(spectra.shape[0], dtype=int)
+    active = np.arange(spectra.shape[0])
+    similarity_counters = np.zeros(spectra.shape[0], dtype=int)
+
+    window_width = 1
+    eroded_array = math_morphology.erosion(spectra, window_width)
+    opened_array = math_morphology.dilation(eroded_array, window_width)
+
+    while active.size > 0:
+        window_width += 1
+        eroded_array = math_morphology.erosion(eroded_array, 1)
+        new_opened_array = math_morphology.dilation(eroded_array, window_width)
+
+        changed = np.any(new_opened_array != opened_array, axis=1)
+        similarity_counters = np.where(changed, 0, similarity_counters + 1)
+        opened_array = new_opened_array
+
+        # restore window width of the first similar result
+        finished = similarity_counters == max_sim_counter
+        window_widths[active[finished]] = window_width - max_sim_counter + 1
+
+        active = active[~finished]
+        eroded_array = eroded_array[~finished]
+        opened_array = opened_array[~finished]
+        similarity_counters = similarity_counters[~finished]
+
+    return window_widths
+
+
+def fit_structuring_element_width_clusters(
+    spectral_map: np.ndarray,
+    water_start_index: int,
+    n_clusters: int = 10,
+    max_spectra: int = 4096,
+) -> Tuple[cluster.MiniBatchKMeans, np.ndarray]:
+    """
+    A function to cluster similar spectra of the map and to estimate optimal structuring element width
+    once per cluster (on its center) instead of for every spectrum. Clusters are fitted on a random sample
+    of at most `max_spectra` spectra so that the map is not copied.
+
+    Parameters:
+        spectral_map (np.ndarray): 3D spectral map.
+        water_start_index (int): Index where the water part of the spectra starts (not clustered).
+        n_clusters (int): Number of clusters of the spectra. Default: 10.
+        max_spectra (int): Maximal number of spectra used for fitting of the clusters. Default: 4096.
+
+    Returns:
+        clusters (Tuple[cluster.MiniBatchKMeans, np.ndarray]): Fitted clustering and structuring element width of each cluster.
+    """
+
+    n_spectra = spectral_map.shape[0] * spectral_map.shape[1]
+    sample = np.random.default_rng(42).permutation(n_spectra)[:max_spectra]
+    map_rows, map_cols = np.unravel_index(np.sort(sample), spectral_map.shape[:2])
+    spectra = spectral_map[map_rows, map_cols, :water_start_index]
+
+    clf = cluster.MiniBatchKMeans(
+        n_clusters=min(n_clusters, spectra.shape[0]), random_state=42, n_init="auto"
+    )
+    clf.fit(spectra)
+
+    cluster_widths = get_optimal_structuring_element_widths(clf.cluster_centers_)
+
+    return clf, cluster_widths
+
+
+def _get_water_start_index(x_axis: np.ndarray, ignore_water: bool) -> int:
+    """
+    Index of the first point of water part of the spectra, length of the spectra if water is not ignored.
+    """
+
+    if ignore_water:
+        water_start_point = 2800
+        return int(np.argmin(np.abs(x_axis - water_start_point)))
+    return x_axis.shape[0]
+
+
+def math_morpho_batch(
+    spectra: np.ndarray,
     x_axis: np.ndarray,
     ignore_water: bool,
-    signal_to_emit: Signal = None,
+    clusters: Optional[Tuple[cluster.MiniBatchKMeans, np.ndarray]] = None,
 ) -> np.ndarray:
     """
-    A function to perform math morpho algorithm on one spectrum, icluding water ignorance and signal emiting.
-    Implementation of changed algorithm by Perez-Pueyo et al (doi: 10.1366/000370210791414281).
+    A function to estimate math morpho backgrounds of many spectra at once, icluding water ignorance.
+    Spectra with the same structuring element width are processed together as one stack.
 
     Parameters:
-        spectrum (np.ndarray): Spectrum on which the algorithm will be performed.
-        x_axis (np.ndarray): TBD
+        spectra (np.ndarray): 2D array of spectra, one spectrum per row.
+        x_axis (np.ndarray): Values of the x-axis shared by all the spectra.
         ignore_water (bool): Info whether variation of the algo with water ignorace should be performed.
+        clusters (Tuple[cluster.MiniBatchKMeans, np.ndarray]): Clusters from `fit_structuring_element_width_clusters`
+            to take the structuring element widths from, widths are estimated for every spectrum if not provided.
+            Default: None.
 
     Returns:
-        result (np.ndarray): Estimated background of the provided spectrum `spectrum`.
+        result (np.ndarray): Estimated backgrounds of the provided `spectra`, same shape as `spectra`.
     """
 
-    if signal_to_emit is not None:
-        signal_to_emit.emit()
+    backgrounds = np.empty(
+        spectra.shape, dtype=np.result_type(spectra.dtype, np.float32)
+    )
+
+    water_start_index = _get_water_start_index(x_axis, ignore_water)
 
     if ignore_water:
-        water_start_point = 2800
-        water_start_index = np.argmin(np.abs(x_axis - water_start_point))
+        water_part_y = spectra[:, water_start_index:]
+        window_width_water = int(np.round(water_part_y.shape[1] / 3))  # TODO: best??
+        backgrounds[:, water_start_index:] = _math_morpho_step(
+            water_part_y, window_width_water
+        )
 
-        water_part_y = spectrum[water_start_index:]
-        not_water_part_y = spectrum[:water_start_index]
+    not_water_part_y = spectra[:, :water_start_index]
 
-        window_width_water = int(np.round(len(water_part_y) / 3))  # TODO: best??
-        window_width_no_water = get_optimal_structuring_element_width(not_water_part_y)
+    if clusters is None:
+        window_widths = get_optimal_structuring_element_widths(not_water_part_y)
+    else:
+        clf, cluster_widths = clusters
+        window_widths = cluster_widths[clf.predict(not_water_part_y)]
 
-        bg_water = _math_morpho_step(water_part_y, window_width_water)
-        bg_no_water = _math_morpho_step(not_water_part_y, window_width_no_water)
+    for window_width in np.unique(window_widths):
+        same_width = window_widths == window_width
+        backgrounds[same_width, :water_start_index] = _math_morpho_step(
+            not_water_part_y[same_width], window_width
+        )
 
-        background = np.concatenate((bg_no_water, bg_water))
-        return background
-
-    window_width = get_optimal_structuring_element_width(spectrum)
-
-    spectrum_opening = math_morphology.opening(spectrum, window_width)
-    approximation = np.mean(
-        math_morphology.erosion(spectrum_opening, window_width)
-        + math_morphology.dilation(spectrum_opening, window_width),
-        axis=0,
-    )
-    background = np.minimum(spectrum_opening, approximation)
-    return background
+    return backgrounds
 
 
 def math_morpho(
     spectral_map: np.ndarray,
     x_axis: np.ndarray,
     ignore_water: bool,
-    signal_to_emit: Signal = None,
+    signal_to_emit: ProgressCallback = None,
+    fast: bool = False,
 ) -> np.ndarray:
     """
-    No speed-up version of the math morpho bg subtraction algorithm Perez-Pueyo et al (doi: 10.1366/000370210791414281)
+    Math morpho bg subtraction algorithm Perez-Pueyo et al (doi: 10.1366/000370210791414281)
     with version for water ignorance. Algorithm is performed on all spectra in the spectral map.
-
-    Possible speed-ups: clustering for optimal structuring element estimation, multithreading.
+    Optimal structuring element widths are searched for all the spectra at once.
 
     Parameters:
         TBD
         ignore_water (bool): Info whether variation of the algo with water ignorace should be performed.
+        fast (bool): Whether the optimal structuring element width should be estimated once per cluster
+            of similar spectra instead of for every spectrum. Default: False.
     """
 
-    backgrounds = np.apply_along_axis(
-        _math_morpho_on_spectrum, 2, spectral_map, x_axis, ignore_water, signal_to_emit
+    clusters = None
+    if fast:
+        # clusters have to be fitted on the whole map, not just on one block of it
+        clusters = fit_structuring_element_width_clusters(
+            spectral_map, _get_water_start_index(x_axis, ignore_water)
+        )
+
+    return executor.subtract_backgrounds(
+        spectral_map,
+        math_morpho_batch,
+        x_axis,
+        ignore_water,
+        clusters,
+        signal_to_emit=signal_to_emit,
+        temporaries=8,
     )
-    spectral_map -= backgrounds
-
-    return spectral_map
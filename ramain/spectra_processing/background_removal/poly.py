@@ -1,5 +1,6 @@
 import numpy as np
-from ramain.utils import indices
+from ramain.utils import indices, polynomial
+from ramain.spectra_processing import executor
 
 
 def poly_bg(
@@ -17,16 +18,42 @@ def poly_bg(
     Returns:
         result (np.ndarray): Estimated background of the provided spectrum `y`.
     """
-    x = x_axis
+
+    return poly_bg_batch(spectrum[np.newaxis, :], x_axis, degree, ignore_water)[0]
+
+
+def poly_bg_batch(
+    spectra: np.ndarray, x_axis: np.ndarray, degree: int, ignore_water: bool = True
+) -> np.ndarray:
+    """
+    A function to estimate polynomial backgrounds of many spectra at once. As all the spectra share
+    the same `x_axis` (and water mask), the least squares system is built only once and all the spectra
+    are fitted by one multiplication with its pseudo-inverse.
+
+    Parameters:
+        spectra (np.ndarray): 2D array of spectra, one spectrum per row.
+        x_axis (np.ndarray): Values of the x-axis shared by all the spectra.
+        degree (int): Degree of the polynomial used for interpolation.
+        ignore_water (bool): Info whether variation of the algo with water ignorace should be performed. Default: True.
+
+    Returns:
+        result (np.ndarray): Estimated backgrounds of the provided `spectra`, same shape as `spectra`.
+    """
 
     if ignore_water:
-        no_water_indices = indices.get_no_water_indices(x)
-        x = x[no_water_indices]
-        spectrum = spectrum[no_water_indices]
+        to_fit = indices.get_no_water_indices(x_axis)
+    else:
+        to_fit = np.ones(x_axis.shape[0], dtype=bool)
+
+    vander = polynomial.scaled_vandermonde(x_axis, x_axis[to_fit], degree)
+
+    # least squares coefficients of all the spectra, one column per spectrum
+    coefficients = np.linalg.pinv(vander[to_fit]) @ spectra[:, to_fit].T
 
-    poly_obj = np.polynomial.Polynomial(None).fit(x, spectrum, deg=degree)
     # NOTE: ploynomial has to be evaluated at every point of `x_axis` here as it is background for the whole spectrum
-    return poly_obj(x_axis)
+    backgrounds = (vander @ coefficients).T
+
+    return backgrounds.astype(spectra.dtype, copy=False)
 
 
 def poly(
@@ -41,9 +68,6 @@ def poly(
         ignore_water (bool): Info whether variation of the algo with water ignorace should be performed.
     """
 
-    backgrounds = np.apply_along_axis(
-        poly_bg, 2, spectral_map, x_axis, degree, ignore_water
+    return executor.subtract_backgrounds(
+        spectral_map, poly_bg_batch, x_axis, degree, ignore_water, temporaries=3
     )
-    spectral_map -= backgrounds
-
-    return spectral_map
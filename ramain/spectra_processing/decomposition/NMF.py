@@ -1,10 +1,10 @@
 import numpy as np
 from ramain.spectra_processing.decomposition.sklearn_NMF import NMF as sklearn_NMF
-from PySide6.QtCore import Signal
+from ramain.utils.progress import ProgressCallback
 
 
 def NMF(
-    spectral_map: np.ndarray, n_components: int, signal_to_emit: Signal = None
+    spectral_map: np.ndarray, n_components: int, signal_to_emit: ProgressCallback = None
 ) -> list:
     """
     A function to perform NMF method on the spectral map with NNDSVD initialization,
@@ -13,7 +13,7 @@ def NMF(
 
     Parameters:
         n_components (int): Number of component to be estimated.
-        signal_to_emit (PySide6.QtCore.Signal): Signal to emit while executing the algorithm. Default: None.
+        signal_to_emit (ProgressCallback): Progress callback emitted while executing the algorithm. Default: None.
     """
 
     components = []
@@ -1,48 +1,199 @@
+import tempfile
 import numpy as np
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+from sklearn.decomposition import MiniBatchNMF
+
+from ramain.spectra_processing import executor
 from ramain.spectra_processing.decomposition.sklearn_NMF import NMF as sklearn_NMF
-from PySide6.QtCore import Signal
+from ramain.utils.progress import ProgressCallback
+
+# passes of the mini-batch NMF over all the stitched spectra
+MAX_EPOCHS = 50
+
+# relative change of the components between the passes at which the mini-batch NMF stops
+EPOCH_TOL = 1e-3
+
+
+def get_unified_x_axis(x_axes: List[np.ndarray]) -> np.ndarray:
+    """
+    A function to get the x axis common to all the maps: their overlap with the average step size.
+
+    Parameters:
+        x_axes (List[np.ndarray]): x axes of the maps.
+
+    Returns:
+        new_x_axis (np.ndarray): The common x axis.
+    """
+
+    min_x = np.max([x[0] for x in x_axes])
+    max_x = np.min([x[-1] for x in x_axes])
+
+    # get average step size in x axes
+    mean_step_size = np.mean([np.mean(np.diff(x_axis)) for x_axis in x_axes])
+
+    return np.arange(min_x, max_x, mean_step_size)
+
+
+def resample(
+    spectra: np.ndarray, x_axis: np.ndarray, new_x_axis: np.ndarray
+) -> np.ndarray:
+    """
+    A function to linearly interpolate the spectra onto the `new_x_axis`, all of them at once.
+    Same as `np.interp` on each spectrum.
+
+    Parameters:
+        spectra (np.ndarray): 2D array of the spectra.
+        x_axis (np.ndarray): Increasing x axis of the spectra.
+        new_x_axis (np.ndarray): x axis to interpolate onto.
+
+    Returns:
+        new_spectra (np.ndarray): 2D array of the interpolated spectra.
+    """
+
+    right = np.clip(
+        np.searchsorted(x_axis, new_x_axis, side="right"), 1, len(x_axis) - 1
+    )
+    left = right - 1
+
+    # values outside of the x axis are the ones at its ends
+    weights = np.clip(
+        (new_x_axis - x_axis[left]) / (x_axis[right] - x_axis[left]), 0, 1
+    )
+
+    return spectra[:, left] * (1 - weights) + spectra[:, right] * weights
+
+
+def stitch(
+    spectral_maps: list,
+    new_x_axis: np.ndarray,
+    out_of_core: bool = False,
+    temp_dir: Optional[Union[str, Path]] = None,
+) -> np.ndarray:
+    """
+    A function to stack the spectra of all the maps interpolated onto the common x axis into one 2D array
+    (absolute values as NMF requires non-negative values). The maps are interpolated by blocks of rows,
+    so that only the stacked array is allocated.
+
+    Parameters:
+        spectral_maps (list): The maps (`SpectralMap`), their spectra may be memory-mapped.
+        new_x_axis (np.ndarray): The common x axis, see `get_unified_x_axis`.
+        out_of_core (bool): Whether to stack the spectra into a temporary memory-mapped file. Default: False.
+        temp_dir (str | Path): Directory of the temporary file, system one is used if not provided. Default: None.
+
+    Returns:
+        data (np.ndarray): Spectra of all the maps one after another, row per spectrum.
+    """
+
+    n_spectra = sum(sm.data.shape[0] * sm.data.shape[1] for sm in spectral_maps)
+    shape = (n_spectra, len(new_x_axis))
+    dtype = executor.get_dtype(np.float64)
+
+    if out_of_core:
+        data = np.memmap(tempfile.TemporaryFile(dir=temp_dir), dtype, "w+", shape=shape)
+    else:
+        data = np.empty(shape, dtype=dtype)
+
+    start = 0
+    for sm in spectral_maps:
+        for rows in executor.iterate_row_slices(sm.data):
+            block = sm.data[rows]
+            spectra = block.reshape((-1, block.shape[-1]))
+            end = start + spectra.shape[0]
+            data[start:end] = np.abs(resample(spectra, sm.x_axis, new_x_axis))
+            start = end
+
+    return data
+
+
+def _fit_minibatch_NMF(
+    data: np.ndarray, n_components: int, signal_to_emit: ProgressCallback = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fits the mini-batch NMF by passes over blocks of rows of the (memory-mapped) `data` and transforms
+    the data block by block, so that only one block is in the memory at once.
+    """
+
+    block_rows = executor.get_block_rows(data)
+    rng = np.random.default_rng(0)
+
+    nmf = MiniBatchNMF(
+        n_components=n_components,
+        init="nndsvd",
+        batch_size=block_rows,
+        random_state=0,
+    )
+
+    # the components are initialized from the spectra sampled from all the maps
+    sample = np.sort(
+        rng.choice(data.shape[0], min(block_rows, data.shape[0]), replace=False)
+    )
+    nmf.partial_fit(data[sample])
+
+    blocks = [
+        slice(start, start + block_rows)
+        for start in range(0, data.shape[0], block_rows)
+    ]
+    for _ in range(MAX_EPOCHS):
+        components = nmf.components_.copy()
+        for i in rng.permutation(len(blocks)):
+            nmf.partial_fit(data[blocks[i]])
+
+        if signal_to_emit is not None:
+            signal_to_emit.emit()
+
+        change = np.linalg.norm(nmf.components_ - components)
+        if change <= EPOCH_TOL * np.linalg.norm(components):
+            break
+
+    nmf_transformed_data = np.empty((data.shape[0], n_components), dtype=data.dtype)
+    for rows in blocks:
+        nmf_transformed_data[rows] = nmf.transform(data[rows])
+
+    return nmf_transformed_data, nmf.components_
 
 
 def stitched_NMF(
-    spectral_maps: list, n_components: int, signal_to_emit: Signal = None
+    spectral_maps: list,
+    n_components: int,
+    signal_to_emit: ProgressCallback = None,
+    out_of_core: Optional[bool] = None,
+    temp_dir: Optional[Union[str, Path]] = None,
 ) -> list:
     """
     A function to perform NMF method on the spectral map with NNDSVD initialization,
     that is initialization based on SVD/PCA for better estimation.
     Note that NMF method is local check point from sklear implementation.
+    Stitched spectra larger than the memory budget are decomposed out of core: they are stacked into
+    a memory-mapped file and decomposed by mini-batch NMF over its blocks.
 
     Parameters:
         n_components (int): Number of component to be estimated.
-        signal_to_emit (PySide6.QtCore.Signal): Signal to emit while executing the algorithm. Default: None.
+        signal_to_emit (ProgressCallback): Progress callback emitted while executing the algorithm. Default: None.
+        out_of_core (bool): Whether to decompose out of core, decided by the memory budget if not provided.
+            Default: None.
+        temp_dir (str | Path): Directory of the memory-mapped file, system temporary one is used if not provided.
+            Default: None.
     """
 
-    x_axes = [sm.x_axis for sm in spectral_maps]
-    dataset = [sm.data for sm in spectral_maps]
-
     # Unify the x axis for all spectra
-    min_x = np.max([x[0] for x in x_axes])
-    max_x = np.min([x[-1] for x in x_axes])
+    new_x_axis = get_unified_x_axis([sm.x_axis for sm in spectral_maps])
 
-    # get average step size in x axes
-    mean_step_size = np.mean([np.mean(np.diff(x_axis)) for x_axis in x_axes])
-
-    # interpolate each spectrum and get values for the new common x axis
-    new_x_axis = np.arange(min_x, max_x, mean_step_size)
-    new_dataset = []
-    for i, (x_axis, data) in enumerate(zip(x_axes, dataset)):
-        new_data = np.zeros((data.shape[0], data.shape[1], len(new_x_axis)))
-        for j in range(data.shape[0]):
-            for k in range(data.shape[1]):
-                new_data[j, k] = np.interp(new_x_axis, x_axis, data[j, k])
-        new_dataset.append(new_data)
+    if out_of_core is None:
+        n_spectra = sum(sm.data.shape[0] * sm.data.shape[1] for sm in spectral_maps)
+        data_bytes = (
+            n_spectra * len(new_x_axis) * executor.get_dtype(np.float64).itemsize
+        )
+        out_of_core = data_bytes > executor.get_memory_budget()
 
     # stitch
-    dataset = new_dataset
-    data = np.concatenate(
-        [data.reshape((-1, data.shape[-1])) for data in dataset], axis=0
-    )
+    data = stitch(spectral_maps, new_x_axis, out_of_core, temp_dir)
 
-    reshaped_data = np.abs(data.reshape((-1, data.shape[-1])))
+    if out_of_core:
+        nmf_transformed_data, nmf_components = _fit_minibatch_NMF(
+            data, n_components, signal_to_emit
+        )
+        return nmf_transformed_data, nmf_components, new_x_axis
 
     init = "nndsvd"
     max_iter = 200
@@ -54,6 +205,6 @@ def stitched_NMF(
         signal_to_emit=signal_to_emit,
     )
 
-    nmf_transformed_data = nmf.fit_transform(reshaped_data)
+    nmf_transformed_data = nmf.fit_transform(data)
 
     return nmf_transformed_data, nmf.components_, new_x_axis
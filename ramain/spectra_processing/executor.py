@@ -0,0 +1,254 @@
+import os
+import numpy as np
+from concurrent import futures
+from typing import Callable, Iterator, Optional, Tuple
+
+from ramain.utils.settings import SETTINGS
+from ramain.utils.progress import ProgressCallback
+
+# memory (in MB) that temporary arrays of blocks of spectra may take
+DEFAULT_MEMORY_BUDGET = 512
+
+# how the blocks of spectra are processed
+BACKENDS = ("serial", "thread", "process")
+DEFAULT_BACKEND = "serial"
+
+
+def get_memory_budget() -> int:
+    """
+    A function to get the memory budget for processing of one block of spectra from the settings.
+
+    Returns:
+        memory_budget (int): Memory budget in bytes.
+    """
+
+    memory_budget = int(
+        SETTINGS.value("processing/memory_budget", DEFAULT_MEMORY_BUDGET)
+    )
+    return memory_budget * 1024**2
+
+
+def get_block_rows(
+    spectral_map: np.ndarray,
+    temporaries: int = 4,
+    memory_budget: Optional[int] = None,
+) -> int:
+    """
+    A function to get how many rows of the `spectral_map` can be processed at once so that
+    the temporary arrays fit into the memory budget.
+
+    Parameters:
+        spectral_map (np.ndarray): 3D spectral map to be processed.
+        temporaries (int): Estimated number of float64 arrays of the block size the algorithm allocates. Default: 4.
+        memory_budget (int): Memory budget in bytes, taken from the settings if not provided. Default: None.
+
+    Returns:
+        block_rows (int): Number of map rows in one block (at least 1).
+    """
+
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+
+    row_bytes = np.prod(spectral_map.shape[1:]) * np.dtype(np.float64).itemsize
+    return max(int(memory_budget // (row_bytes * temporaries)), 1)
+
+
+def get_backend() -> Tuple[str, int]:
+    """
+    A function to get the backend for processing of the blocks of spectra and number of its workers from the settings.
+
+    Returns:
+        backend (Tuple[str, int]): One of `BACKENDS` and number of workers.
+    """
+
+    backend = str(SETTINGS.value("processing/backend", DEFAULT_BACKEND))
+    n_workers = int(SETTINGS.value("processing/workers", os.cpu_count() or 1))
+    return backend, max(n_workers, 1)
+
+
+def get_dtype(dtype: np.dtype) -> np.dtype:
+    """
+    A function to get dtype the spectra loaded with `dtype` are processed in, i.e. single precision
+    if it is set in the settings (halves the memory and bandwidth), the loaded one otherwise.
+
+    Parameters:
+        dtype (np.dtype): dtype of the loaded spectra.
+
+    Returns:
+        dtype (np.dtype): dtype of the spectra for the processing.
+    """
+
+    if SETTINGS.value("processing/float32", False, type=bool):
+        return np.dtype(np.float32)
+    return np.dtype(dtype)
+
+
+def iterate_row_slices(
+    spectral_map: np.ndarray,
+    temporaries: int = 4,
+    memory_budget: Optional[int] = None,
+) -> Iterator[slice]:
+    """
+    A function to iterate over blocks of rows of the `spectral_map`.
+
+    Parameters:
+        spectral_map (np.ndarray): 3D spectral map to be processed.
+        temporaries (int): See `get_block_rows`. Default: 4.
+        memory_budget (int): See `get_block_rows`. Default: None.
+
+    Yields:
+        rows (slice): Slice of the map rows in the block.
+    """
+
+    block_rows = get_block_rows(spectral_map, temporaries, memory_budget)
+
+    for start in range(0, spectral_map.shape[0], block_rows):
+        yield slice(start, start + block_rows)
+
+
+def _apply_kernel(
+    kernel: Callable[..., np.ndarray], spectra: np.ndarray, args: tuple, batched: bool
+) -> np.ndarray:
+    """
+    Applies the `kernel` on the 2D array of `spectra`, either at once or spectrum by spectrum.
+    Module level function so that it can be sent to the worker processes.
+    """
+
+    if batched:
+        return kernel(spectra, *args)
+    return np.stack([kernel(spectrum, *args) for spectrum in spectra])
+
+
+def map_spectra(
+    spectral_map: np.ndarray,
+    kernel: Callable[..., np.ndarray],
+    *args,
+    batched: bool = True,
+    out: Optional[np.ndarray] = None,
+    subtract: bool = False,
+    signal_to_emit: ProgressCallback = None,
+    backend: Optional[str] = None,
+    n_workers: Optional[int] = None,
+    temporaries: int = 4,
+    memory_budget: Optional[int] = None,
+) -> np.ndarray:
+    """
+    A function to apply the `kernel` on all the spectra of the `spectral_map`. The map is processed by blocks of rows,
+    each block is flattened to 2D array of spectra (one per row) and the results are written into `out`.
+
+    Parameters:
+        spectral_map (np.ndarray): 3D spectral map.
+        kernel (Callable): Function taking 2D array of spectra and `args` if `batched`, one spectrum and `args` otherwise,
+            returning array of the same shape as its input. Has to be picklable for the 'process' backend.
+        batched (bool): Whether the `kernel` processes the whole block at once. Default: True.
+        out (np.ndarray): Array of the map shape (possibly `spectral_map` itself) to write the results into. Default: None.
+        subtract (bool): Whether the results should be subtracted from `out` instead of written into it. Default: False.
+        signal_to_emit (ProgressCallback): Emitted with the number of spectra of each finished block. Default: None.
+        backend (str): One of `BACKENDS`, taken from the settings if not provided. Default: None.
+        n_workers (int): Number of workers of the 'thread' and 'process' backends, taken from the settings if not provided.
+            Default: None.
+        temporaries (int): See `get_block_rows`. Default: 4.
+        memory_budget (int): See `get_block_rows`, the budget is shared by all the workers. Default: None.
+
+    Returns:
+        out (np.ndarray): The results of the `kernel`.
+    """
+
+    settings_backend, settings_n_workers = get_backend()
+    backend = settings_backend if backend is None else backend
+    n_workers = settings_n_workers if n_workers is None else n_workers
+
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend '{backend}', expected one of {BACKENDS}")
+
+    if out is None:
+        out = np.empty(
+            spectral_map.shape, dtype=np.result_type(spectral_map.dtype, np.float32)
+        )
+
+    def get_spectra(rows: slice) -> np.ndarray:
+        return spectral_map[rows].reshape((-1, spectral_map.shape[-1]))
+
+    def write_result(rows: slice, result: np.ndarray) -> None:
+        # NOTE: `out[rows]` may not be contiguous (e.g. after cropping), so the result is written
+        # into the view itself instead of into its (possibly copied) reshape
+        out_rows = out[rows]
+        if subtract:
+            out_rows -= result.reshape(out_rows.shape)
+        else:
+            out_rows[...] = result.reshape(out_rows.shape)
+
+        if signal_to_emit is not None:
+            signal_to_emit.emit(result.shape[0])
+
+    if backend == "serial" or n_workers == 1:
+        for rows in iterate_row_slices(spectral_map, temporaries, memory_budget):
+            write_result(rows, _apply_kernel(kernel, get_spectra(rows), args, batched))
+        return out
+
+    if memory_budget is None:
+        memory_budget = get_memory_budget()
+
+    pool_executor = (
+        futures.ThreadPoolExecutor
+        if backend == "thread"
+        else futures.ProcessPoolExecutor
+    )
+
+    # at most `n_workers` blocks are in progress at once, each within its share of the budget;
+    # results are written (and progress emitted) from the calling thread only
+    with pool_executor(max_workers=n_workers) as pool:
+        pending = {}
+        for rows in iterate_row_slices(
+            spectral_map, temporaries, memory_budget // n_workers
+        ):
+            if len(pending) >= n_workers:
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    write_result(pending.pop(future), future.result())
+
+            future = pool.submit(
+                _apply_kernel, kernel, get_spectra(rows), args, batched
+            )
+            pending[future] = rows
+
+        for future in futures.as_completed(pending):
+            write_result(pending[future], future.result())
+
+    return out
+
+
+def subtract_backgrounds(
+    spectral_map: np.ndarray,
+    background_function: Callable[..., np.ndarray],
+    *args,
+    signal_to_emit: ProgressCallback = None,
+    temporaries: int = 4,
+    memory_budget: Optional[int] = None,
+) -> np.ndarray:
+    """
+    A function to estimate and subtract backgrounds of the `spectral_map` block by block,
+    so that the backgrounds of the whole map are never allocated at once.
+
+    Parameters:
+        spectral_map (np.ndarray): 3D spectral map, backgrounds are subtracted in place.
+        background_function (Callable): Function taking 2D array of spectra (one per row) and `args`
+            and returning their backgrounds.
+        signal_to_emit (ProgressCallback): See `map_spectra`. Default: None.
+        temporaries (int): See `get_block_rows`. Default: 4.
+        memory_budget (int): See `get_block_rows`. Default: None.
+
+    Returns:
+        spectral_map (np.ndarray): The `spectral_map` with the backgrounds subtracted.
+    """
+
+    return map_spectra(
+        spectral_map,
+        background_function,
+        *args,
+        out=spectral_map,
+        subtract=True,
+        signal_to_emit=signal_to_emit,
+        temporaries=temporaries,
+        memory_budget=memory_budget,
+    )
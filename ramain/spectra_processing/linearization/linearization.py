@@ -2,6 +2,20 @@ import numpy as np
 import scipy.interpolate as si
 from typing import Tuple
 
+from ramain.spectra_processing import executor
+
+
+def _linearize_spectra(
+    spectra: np.ndarray, x_axis: np.ndarray, new_x: np.ndarray
+) -> np.ndarray:
+    """
+    Evaluates cubic splines of the 2D array of `spectra` (one per row) on the `new_x` axis.
+    Module level function so that it can be sent to the worker processes.
+    """
+
+    spectrum_spline = si.CubicSpline(x_axis, spectra, axis=1, extrapolate=False)
+    return spectrum_spline(new_x)
+
 
 def linearize(
     spectral_map: np.ndarray, x_axis: np.ndarray, step: float
@@ -9,15 +23,22 @@ def linearize(
     """
     A function to perform data linearization on the whole spectral map.
     That means that there will be equal steps between the data points.
+    Splines are computed by blocks of rows and the result keeps the dtype of the `spectral_map`.
 
     Parameters:
         step (float): Required step between the data points.
         TODO
     """
 
-    spectrum_spline = si.CubicSpline(x_axis, spectral_map, axis=2, extrapolate=False)
     new_x = np.arange(np.ceil(x_axis[0]), np.floor(x_axis[-1]), step)
-    x_axis = new_x
-    spectral_map = spectrum_spline(new_x)
 
-    return spectral_map, x_axis
+    out = np.empty(
+        spectral_map.shape[:-1] + new_x.shape,
+        dtype=np.result_type(spectral_map.dtype, np.float32),
+    )
+    # NOTE: spline coefficients are 4 arrays of the block size
+    spectral_map = executor.map_spectra(
+        spectral_map, _linearize_spectra, x_axis, new_x, out=out, temporaries=8
+    )
+
+    return spectral_map, new_x
@@ -59,6 +59,9 @@ def water_normalization(
     water_band_integral = np.trapz(water_band, x_axis[start_index:end_index])
 
     normalization_factor = NORMALIZED_INTEGRAL_VALUE / water_band_integral
-    normalized_spectral_map = spectral_map * normalization_factor
+    # factor is converted so that single precision map is not upcasted
+    normalized_spectral_map = spectral_map * np.asarray(
+        normalization_factor, dtype=np.result_type(spectral_map.dtype, np.float32)
+    )
 
     return normalized_spectral_map
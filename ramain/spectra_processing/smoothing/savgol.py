@@ -1,24 +1,75 @@
 import numpy as np
-from scipy.signal import savgol_filter
+from scipy.ndimage import convolve1d
+from scipy.signal import savgol_coeffs
+from functools import lru_cache
+from typing import Optional, Tuple
+
+
+@lru_cache(maxsize=16)
+def _savgol_kernels(
+    window_length: int, polyorder: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convolution coefficients of Savitzky-Golay filter together with matrices that evaluate the polynomial
+    fitted to the first (last) window at the first (last) half-window points, which is what `savgol_filter`
+    does on the edges in its default 'interp' mode. Cached as they depend only on the parameters.
+    """
+
+    coeffs = savgol_coeffs(window_length, polyorder)
+
+    # hat matrix of polynomial least squares fit on one window
+    vander = np.vander(np.arange(window_length, dtype=np.float64), polyorder + 1)
+    projection = vander @ np.linalg.pinv(vander)
+
+    halflen = window_length // 2
+    left_edge = projection[:halflen]
+    right_edge = projection[-halflen:]
+
+    for kernel in (coeffs, left_edge, right_edge):
+        kernel.setflags(write=False)
+
+    return coeffs, left_edge, right_edge
 
 
 def savgol(
-    spectral_map: np.ndarray, window_length: int = 5, polyorder: int = 2
+    spectral_map: np.ndarray,
+    window_length: int = 5,
+    polyorder: int = 2,
+    out: Optional[np.ndarray] = None,
 ) -> np.ndarray:
-    spectral_map_ = spectral_map.reshape((-1, spectral_map.shape[-1]))
-    if spectral_map_.ndim != 2:
-        raise ValueError("Input must be a 2D array")
+    """
+    A function to apply Savitzky-Golay filter along the spectral (last) axis of the whole spectral map
+    (or of one spectrum) at once. Results are the same as of `scipy.signal.savgol_filter` in 'interp' mode.
+
+    Parameters:
+        window_length (int): Length of the filter window, has to be odd. Default: 5.
+        polyorder (int): Order of the polynomial fitted in the window. Default: 2.
+        out (np.ndarray): Array (possibly `spectral_map` itself) to write the result into. Default: None.
+    """
 
     # Check if window_length is odd and greater than polyorder
     if window_length % 2 == 0 or window_length <= polyorder:
         raise ValueError("window_length must be odd and greater than polyorder")
 
-    # Apply Savitzky-Golay filter to each spectrum
-    smoothed_data = np.array(
-        [
-            savgol_filter(spectral_map_[i, :], window_length, polyorder)
-            for i in range(spectral_map_.shape[0])
-        ]
-    )
-    smoothed_data = smoothed_data.reshape(spectral_map.shape)
-    return smoothed_data
+    if window_length > spectral_map.shape[-1]:
+        raise ValueError("window_length must not be greater than the spectra length")
+
+    coeffs, left_edge, right_edge = _savgol_kernels(window_length, polyorder)
+    halflen = window_length // 2
+
+    # edges have to be computed before the data are (possibly) overwritten
+    left_values = spectral_map[..., :window_length] @ left_edge.T
+    right_values = spectral_map[..., -window_length:] @ right_edge.T
+
+    if out is None:
+        out = np.empty(
+            spectral_map.shape, dtype=np.result_type(spectral_map.dtype, np.float32)
+        )
+
+    convolve1d(spectral_map, coeffs, axis=-1, output=out, mode="constant")
+
+    if halflen > 0:
+        out[..., :halflen] = left_values
+        out[..., -halflen:] = right_values
+
+    return out
@@ -1,6 +1,24 @@
-from scipy import sparse
+from scipy.linalg import cholesky_banded, cho_solve_banded
+from functools import lru_cache
 import numpy as np
 
+from ramain.utils import banded
+
+
+@lru_cache(maxsize=8)
+def _whittaker_factor(length: int, lam: float, diff: int) -> np.ndarray:
+    """
+    Banded Cholesky factor of I + `lam` * D^T D, cached so that it is not recomputed for every call
+    with the same spectra length and parameters (e.g. in the live preview).
+    """
+
+    ab = banded.difference_penalty_band(length, lam, diff).copy()
+    ab[-1] += 1
+
+    factor = cholesky_banded(ab, check_finite=False)
+    factor.setflags(write=False)
+    return factor
+
 
 def whittaker(spectral_map: np.ndarray, lam: int = 1600, diff: int = 2) -> np.ndarray:
     spectral_map_ = spectral_map.reshape((-1, spectral_map.shape[-1]))
@@ -8,15 +26,20 @@ def whittaker(spectral_map: np.ndarray, lam: int = 1600, diff: int = 2) -> np.nd
         raise ValueError("Input must be a 2D array")
 
     num_spectra, L = spectral_map_.shape
-    E = sparse.csc_matrix(np.diff(np.eye(L), diff))
-    W = sparse.spdiags(np.ones(L), 0, L, L)
-    Z = W + lam * E.dot(E.transpose())
+    factor = _whittaker_factor(L, lam, diff)
+
+    # spectra are solved as multiple right-hand sides of one system, in blocks to bound the memory
+    block_size = 4096
 
-    # Pre-factorize Z for efficiency
-    Z_inv = sparse.linalg.factorized(Z)
+    smoothed_data = np.empty(
+        spectral_map_.shape, dtype=np.result_type(spectral_map_.dtype, np.float32)
+    )
+    for start in range(0, num_spectra, block_size):
+        block = spectral_map_[start : start + block_size]
+        smoothed_data[start : start + block_size] = cho_solve_banded(
+            (factor, False), block.T, check_finite=False
+        ).T
 
-    # Solve for each spectrum (each row in Y)
-    smoothed_data = np.array([Z_inv(spectral_map_[i, :]) for i in range(num_spectra)])
     smoothed_data = smoothed_data.reshape(spectral_map.shape)
 
     return smoothed_data
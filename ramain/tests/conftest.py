@@ -0,0 +1,12 @@
+import pytest
+
+from ramain.model import cache
+
+
+@pytest.fixture(autouse=True, scope="session")
+def cache_dir(tmp_path_factory):
+    # do not fill the user cache directory with the test data
+    cache_dir = tmp_path_factory.mktemp("cache")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(cache, "get_cache_dir", lambda: cache_dir)
+        yield cache_dir
@@ -5,8 +5,37 @@ import uuid
 import numpy as np
 import os
 import copy
+import io
+import shutil
+import scipy.io
+import subprocess
+import sys
 from sklearn.utils._testing import ignore_warnings
 from sklearn.exceptions import ConvergenceWarning
+from scipy.signal import savgol_filter
+
+from ramain.spectra_processing.background_removal import (
+    poly,
+    imodpoly,
+    airpls,
+    math_morpho,
+    bubblefill,
+)
+from ramain.spectra_processing import executor
+from ramain.spectra_processing.decomposition import stitched_NMF
+from ramain.model import (
+    batch,
+    cache,
+    journal,
+    loaders,
+    metadata,
+    pipeline,
+    step_cache,
+    thumbnails,
+)
+from ramain.utils import indices, math_morphology
+from ramain.utils.progress import FunctionProgress
+from ramain.utils.settings import SETTINGS, MemorySettingsBackend, Settings
 
 
 TEST_FILE_DIR = pathlib.Path(__file__).parent.resolve()
@@ -22,6 +51,44 @@ def test_load_matlab():
     assert x_axis.shape == (1600,)
 
 
+def test_load_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        SETTINGS, "backend", MemorySettingsBackend({"cache/enabled": True})
+    )
+
+    source_path = tmp_path.joinpath("test_data.mat")
+    shutil.copyfile(TEST_FILE_PATH, source_path)
+
+    sm = SpectralMap(source_path)
+    assert not isinstance(sm.data, np.memmap)
+
+    # second load is memory-mapped from the cache
+    sm_cached = SpectralMap(source_path)
+    assert isinstance(sm_cached.data, np.memmap)
+    assert np.array_equal(sm_cached.data, sm.data)
+    assert np.array_equal(sm_cached.x_axis, sm.x_axis)
+    assert np.array_equal(sm_cached.units, sm.units)
+
+    # changes are not written into the cache
+    sm_cached.background_removal_poly(5, True)
+    assert np.array_equal(SpectralMap(source_path).data, sm.data)
+
+    sm_cached.save_matlab(tmp_path, file_name="test_data_saved.mat")
+    sm_saved = SpectralMap(tmp_path.joinpath("test_data_saved.mat"))
+    assert np.array_equal(sm_saved.data, sm_cached.data)
+
+    # memory-mapped entries cannot be removed on Windows, the eviction skips them
+    def unlink(path, missing_ok=False):
+        raise PermissionError(path)
+
+    SETTINGS.setValue("cache/max_size", 0)
+    monkeypatch.setattr(pathlib.Path, "unlink", unlink)
+    other_path = tmp_path.joinpath("other.mat")
+    shutil.copyfile(TEST_FILE_PATH, other_path)
+    SpectralMap(other_path)
+    assert isinstance(SpectralMap(other_path).data, np.memmap)
+
+
 def test_save_matlab():
     test_file2_name = f"test_data_{uuid.uuid4()}.mat"
     test_file2_path = TEST_FILE_DIR.joinpath(test_file2_name)
@@ -34,6 +101,584 @@ def test_save_matlab():
         os.remove(test_file2_path)
 
 
+def test_save_matlab_streamed(tmp_path):
+    sm = SpectralMap(TEST_FILE_PATH)
+    name = list(sm._mdict)[-1]
+    original = scipy.io.loadmat(TEST_FILE_PATH)[name][0, 0]
+
+    # compressed v5 file has the same struct as the loaded one
+    saved_path = sm.save_matlab(tmp_path, file_name="compressed.mat", compression=1)
+    saved = scipy.io.loadmat(saved_path)[name][0, 0]
+    assert saved.dtype.names == original.dtype.names
+    assert np.array_equal(saved[7], original[7])
+    assert np.array_equal(saved[9][1][0], original[9][1][0])
+
+    # cropped map (not contiguous data) in single precision, saved as v7.3 in the background
+    sm_cropped = SpectralMap(TEST_FILE_PATH, dtype=np.float32)
+    sm_cropped.crop_spectral_map(2, 3, 20, 15)
+    sm_cropped.crop_spectra_relative(5, 7)
+
+    future = sm_cropped.save_matlab_async(
+        tmp_path, file_name="hdf5.mat", file_format="v7.3", compression=4
+    )
+    sm_saved = SpectralMap(future.result())
+    assert sm_saved.data.dtype == np.float32
+    assert np.array_equal(sm_saved.data, sm_cropped.data)
+    assert np.array_equal(sm_saved.x_axis, sm_cropped.x_axis)
+
+
+def _save_matlab_hdf5(file_path, mdict):
+    # writes the loaded struct the way MATLAB v7.3 does: HDF5 with 512 bytes user block,
+    # column-major arrays, cells as object references
+    h5py = pytest.importorskip("h5py")
+
+    with h5py.File(file_path, "w", userblock_size=512) as h5_file:
+        refs = h5_file.create_group("#refs#")
+
+        def write(group, name, value):
+            if value.dtype.kind == "U":
+                dataset = group.create_dataset(
+                    name, data=np.array([[ord(c)] for c in value[0]], dtype=np.uint16)
+                )
+                dataset.attrs["MATLAB_class"] = np.bytes_("char")
+            elif value.dtype == object:
+                references = np.empty(value.shape[::-1], dtype=h5py.ref_dtype)
+                for index, item in np.ndenumerate(value):
+                    item_name = f"{name}_{index[0]}_{index[1]}"
+                    references[index[::-1]] = write(refs, item_name, item).ref
+                dataset = group.create_dataset(name, data=references)
+                dataset.attrs["MATLAB_class"] = np.bytes_("cell")
+            else:
+                dataset = group.create_dataset(name, data=value.T)
+                dataset.attrs["MATLAB_class"] = np.bytes_("double")
+            return dataset
+
+        name = list(mdict)[-1]
+        struct = mdict[name][0, 0]
+        group = h5_file.create_group(name)
+        group.attrs["MATLAB_class"] = np.bytes_("struct")
+        group.attrs.create(
+            "MATLAB_fields",
+            np.array(
+                [np.array(list(field), dtype="S1") for field in struct.dtype.names],
+                dtype=object,
+            ),
+            dtype=h5py.vlen_dtype(np.dtype("S1")),
+        )
+        for field in struct.dtype.names:
+            write(group, field, struct[field])
+
+
+def test_load_matlab_hdf5(tmp_path):
+    sm = SpectralMap(TEST_FILE_PATH)
+    hdf5_path = tmp_path.joinpath("test_data_hdf5.mat")
+
+    # spectra field is empty in the struct if the map was loaded from the cache
+    name = list(sm._mdict)[-1]
+    struct = sm._mdict[name].copy()
+    struct[0, 0][7] = sm.data.reshape((-1, sm.data.shape[-1]))
+    _save_matlab_hdf5(hdf5_path, {name: struct})
+
+    sm_eager = SpectralMap(hdf5_path)
+    sm_lazy = SpectralMap(hdf5_path, lazy=True)
+
+    assert np.array_equal(sm_eager.data, sm.data)
+    assert np.array_equal(sm_eager.x_axis, sm.x_axis)
+
+    # only the requested spectra are read until the data are needed as a whole
+    assert sm_lazy.shape == sm.shape
+    assert np.allclose(sm_lazy.averages, sm.averages)
+    assert np.array_equal(sm_lazy.maxima, sm.maxima)
+    assert np.array_equal(sm_lazy.get_spectrum(3, 7), sm.data[3, 7])
+    assert np.array_equal(sm_lazy._data[2:4, ::3, 10:20], sm.data[2:4, ::3, 10:20])
+    assert np.array_equal(sm_lazy._data[:, 5], sm.data[:, 5])
+    assert np.array_equal(sm_lazy._data[::2, ::3], sm.data[::2, ::3])
+    assert np.array_equal(sm_lazy._data[[3, 1, 3], 4], sm.data[[3, 1, 3], 4])
+    assert np.array_equal(np.asarray(sm_lazy._data), sm.data)
+
+    sm_lazy.background_removal_poly(5, True)
+    sm.background_removal_poly(5, True)
+    assert np.array_equal(sm_lazy.data, sm.data)
+
+    sm_lazy.save_matlab(tmp_path, file_name="test_data_saved.mat")
+    sm_saved = SpectralMap(tmp_path.joinpath("test_data_saved.mat"))
+    assert np.array_equal(sm_saved.data, sm.data)
+
+
+def test_loaders(tmp_path):
+    sm = SpectralMap(TEST_FILE_PATH)
+
+    np.save(tmp_path.joinpath("cube.npy"), sm.data)
+    np.savez(tmp_path.joinpath("cube.npz"), data=sm.data, x_axis=sm.x_axis, units="1/cm")
+    cache.save(
+        TEST_FILE_PATH,
+        sm._mdict,
+        sm.data,
+        loaders.DATA_FIELD,
+        sm.units,
+        sm.x_axis,
+        tmp_path,
+    )
+    (cache_path,) = tmp_path.glob(f"{cache._get_key(TEST_FILE_PATH)}.npy")
+
+    for file_name, reader in [
+        ("cube.npy", loaders.NumpyReader),
+        ("cube.npz", loaders.NumpyArchiveReader),
+        (cache_path.name, loaders.CacheReader),
+    ]:
+        file_path = tmp_path.joinpath(file_name)
+        assert isinstance(loaders.get_reader(file_path), reader)
+
+        # lazily read spectra are memory-mapped
+        for lazy in [False, True]:
+            sm_loaded = SpectralMap(file_path, lazy=lazy)
+            assert isinstance(sm_loaded.data, np.memmap) == lazy
+            assert np.array_equal(sm_loaded.data, sm.data)
+
+        if reader is not loaders.NumpyReader:
+            assert np.array_equal(sm_loaded.x_axis, sm.x_axis)
+            assert metadata.probe(file_path)["units"] == "1/cm"
+
+    # maps read from other formats can be saved as WITec files
+    saved_path = sm_loaded.save_matlab(tmp_path, file_name="saved.mat")
+    assert isinstance(loaders.get_reader(saved_path), loaders.WITecReader)
+    assert np.array_equal(SpectralMap(saved_path).data, sm.data)
+
+    tmp_path.joinpath("unknown.mat").write_bytes(b"unknown" * 100)
+    with pytest.raises(loaders.FormatError):
+        SpectralMap(tmp_path.joinpath("unknown.mat"))
+
+
+def test_probe_metadata(tmp_path):
+    sm = SpectralMap(TEST_FILE_PATH)
+    expected = {
+        "shape": sm.shape,
+        "x_range": (sm.x_axis.min(), sm.x_axis.max()),
+        "units": sm.units[0],
+        "dtype": sm.data.dtype,
+    }
+
+    name = list(sm._mdict)[-1]
+    struct = sm._mdict[name].copy()
+    struct[0, 0][7] = sm.data.reshape((-1, sm.data.shape[-1]))
+
+    # uncompressed and compressed v5, v7.3 and cached files
+    scipy.io.savemat(tmp_path.joinpath("plain.mat"), {name: struct})
+    scipy.io.savemat(
+        tmp_path.joinpath("compressed.mat"), {name: struct}, do_compression=True
+    )
+    _save_matlab_hdf5(tmp_path.joinpath("hdf5.mat"), {name: struct})
+
+    for file_name in ["plain.mat", "compressed.mat", "hdf5.mat"]:
+        assert metadata.probe(tmp_path.joinpath(file_name)) == expected
+
+    assert metadata.probe(TEST_FILE_PATH) == expected
+
+
+def test_thumbnails(tmp_path):
+    source_path = tmp_path.joinpath("test_data.mat")
+    shutil.copyfile(TEST_FILE_PATH, source_path)
+    index_dir = tmp_path.joinpath("thumbnails")
+    sm = SpectralMap(source_path)
+
+    assert thumbnails.load(source_path, index_dir) is None
+    thumbnail = thumbnails.get_thumbnail(source_path, index_dir)
+    assert np.allclose(thumbnail["averages"], sm.averages)
+    assert np.array_equal(thumbnail["maxima"], sm.maxima)
+    assert thumbnail["max"] == sm.maxima.max()
+
+    indexed = thumbnails.load(source_path, index_dir)
+    assert np.array_equal(indexed["averages"], thumbnail["averages"])
+    assert indexed["mean"] == thumbnail["mean"]
+
+    # changed files are not in the index anymore
+    stat = os.stat(source_path)
+    os.utime(source_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert thumbnails.load(source_path, index_dir) is None
+
+
+def _exit_process(spectral_map):
+    os._exit(1)
+
+
+def test_batch_pipeline(tmp_path, monkeypatch):
+    # cached steps would be logged differently by the two runs
+    monkeypatch.setattr(
+        SETTINGS, "backend", MemorySettingsBackend({"step_cache/enabled": False})
+    )
+
+    file_names = []
+    for i in range(2):
+        file_names.append(str(tmp_path.joinpath(f"test_data_{i}.mat")))
+        shutil.copy(TEST_FILE_PATH, file_names[-1])
+    file_names.insert(1, str(tmp_path.joinpath("missing.mat")))
+
+    steps = [
+        ("Cropping", SpectralMap.crop_spectra_relative, [15, 20]),
+        ("Export", SpectralMap.save_matlab, [str(tmp_path), "processed"]),
+    ]
+
+    logs_serial, logs_parallel = io.StringIO(), io.StringIO()
+    progress = []
+    batch.run_pipeline(file_names, steps, logs_serial, n_workers=1)
+    batch.run_pipeline(
+        file_names,
+        steps,
+        logs_parallel,
+        n_workers=2,
+        progress=FunctionProgress(progress.append),
+    )
+
+    # the same logs in the order of the files, the missing file does not stop the others
+    log_lines = [
+        line for line in logs_parallel.getvalue().splitlines() if line.startswith("[")
+    ]
+    assert log_lines == [
+        line for line in logs_serial.getvalue().splitlines() if line.startswith("[")
+    ]
+    assert [line for line in log_lines if line.startswith("[FILE")] == [
+        f"[FILE {i}/3]: {name}" for i, name in enumerate(file_names, 1)
+    ]
+    assert logs_parallel.getvalue().count("[ERROR]") == 1
+    assert sum(progress) == len(file_names) * len(steps)
+
+    sm = SpectralMap(TEST_FILE_PATH)
+    sm_processed = SpectralMap(tmp_path.joinpath("test_data_1processed(2).mat"))
+    assert sm_processed.shape == (*sm.shape[:2], sm.shape[2] - 35)
+
+    # the steps reported before the worker process died are not counted again
+    progress = []
+    failed_files = batch.run_pipeline(
+        file_names[::2],
+        [steps[0], ("Exit", _exit_process, [])],
+        io.StringIO(),
+        n_workers=2,
+        progress=FunctionProgress(progress.append),
+    )
+    assert failed_files == file_names[::2]
+    assert sum(progress) == 2 * len(steps)
+
+
+def test_pipeline_yaml(tmp_path):
+    pytest.importorskip("yaml")
+
+    steps = [
+        pipeline.make_step("crop_spectra_relative", [15, 20], "Cropping"),
+        pipeline.make_step("save_matlab", {"out_folder_path": "", "file_tag": "_cli"}),
+    ]
+    pipeline.save(tmp_path.joinpath("pipeline.yaml"), steps)
+    assert pipeline.load(tmp_path.joinpath("pipeline.yaml")) == steps
+
+
+def test_pipeline_cli(tmp_path):
+    steps = [
+        pipeline.make_step("crop_spectra_relative", [15, 20], "Cropping"),
+        pipeline.make_step("save_matlab", {"out_folder_path": "", "file_tag": "_cli"}),
+    ]
+    assert steps[0].params == {"crop_first": 15, "crop_last": 20}
+
+    pipeline.save(tmp_path.joinpath("pipeline.json"), steps)
+    assert pipeline.load(tmp_path.joinpath("pipeline.json")) == steps
+
+    with pytest.raises(pipeline.PipelineError):
+        pipeline.make_step("crop_spectra_relative", {"crop_start": 15})
+    with pytest.raises(pipeline.PipelineError):
+        pipeline.make_step("__init__", [])
+
+    data_dir = tmp_path.joinpath("data", "day1")
+    data_dir.mkdir(parents=True)
+    for i in range(2):
+        shutil.copy(TEST_FILE_PATH, data_dir.joinpath(f"test_data_{i}.mat"))
+
+    # the runner does not need Qt, outputs are redirected into the output directory
+    result = subprocess.run(
+        [
+            sys.executable,
+            "cli.py",
+            str(tmp_path.joinpath("pipeline.json")),
+            str(tmp_path.joinpath("data", "**", "*.mat")),
+            "--out-dir",
+            str(tmp_path.joinpath("out")),
+            "--logs-dir",
+            str(tmp_path.joinpath("logs")),
+        ],
+        cwd=TEST_FILE_DIR.parent.parent,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "[DONE]: 2/2 files processed" in result.stderr
+
+    sm = SpectralMap(TEST_FILE_PATH)
+    for i in range(2):
+        sm_processed = SpectralMap(tmp_path.joinpath("out", f"test_data_{i}_cli.mat"))
+        assert sm_processed.shape == (*sm.shape[:2], sm.shape[2] - 35)
+
+    # the run is journaled next to its logs
+    (logs_file,) = tmp_path.joinpath("logs").glob("*.txt")
+    assert journal.read_header(journal.get_journal_path(logs_file))[0] == [
+        str(tmp_path.joinpath("data", "day1", f"test_data_{i}.mat")) for i in range(2)
+    ]
+    # the step cache is off by default
+    logs = logs_file.read_text()
+    assert logs.count("[SUCCESS]") == 4
+    assert "[ERROR]" not in logs
+
+
+def test_step_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        SETTINGS,
+        "backend",
+        MemorySettingsBackend(
+            {"cache/dir": str(tmp_path), "step_cache/enabled": True}
+        ),
+    )
+
+    def run(n_components):
+        steps = [
+            ("Smoothing", SpectralMap.smoothing_savgol, [7, 2]),
+            ("Cropping", SpectralMap.crop_spectra_relative, [15, 20]),
+            ("NMF", SpectralMap.decomposition_NMF, [n_components]),
+            ("Export", SpectralMap.export_to_text, [str(tmp_path), "_nmf"]),
+        ]
+        with ignore_warnings(category=ConvergenceWarning):
+            logs, succeeded = batch.process_file(str(TEST_FILE_PATH), 1, 1, steps)
+        assert succeeded, logs
+        return [line for line in logs.splitlines() if line in ("[SUCCESS]", "[CACHED]")]
+
+    assert run(2) == ["[SUCCESS]"] * 4
+    # outputs are always made again, changed decomposition resumes after the cropping
+    assert run(2) == ["[CACHED]", "[CACHED]", "[CACHED]", "[SUCCESS]"]
+    assert run(3) == ["[CACHED]", "[CACHED]", "[SUCCESS]", "[SUCCESS]"]
+
+    # only the last states are cached, the decomposition shares the spectra of the cropping
+    steps = [
+        ("Smoothing", SpectralMap.smoothing_savgol, [7, 2]),
+        ("Cropping", SpectralMap.crop_spectra_relative, [15, 20]),
+    ]
+    _, key = step_cache.get_keys(TEST_FILE_PATH, steps)
+    assert len(list(step_cache.get_cache_dir().glob("*.npy"))) == 1
+    assert len(list(step_cache.get_cache_dir().glob("*.json"))) == 3
+
+    sm = SpectralMap(TEST_FILE_PATH)
+    sm.smoothing_savgol(7, 2)
+    sm.crop_spectra_relative(15, 20)
+    sm_cached = SpectralMap(TEST_FILE_PATH, state=step_cache.load(key))
+    assert np.array_equal(sm_cached.data, sm.data)
+    assert np.array_equal(sm_cached.x_axis, sm.x_axis)
+
+    # the least recently used entries are removed above the maximal size
+    SETTINGS.setValue("step_cache/max_size", 0)
+    step_cache.save("other", sm.get_state())
+    assert step_cache.load(key) is None
+    assert step_cache.load("other") is not None
+
+
+def test_batch_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        SETTINGS, "backend", MemorySettingsBackend({"step_cache/enabled": False})
+    )
+
+    file_names = []
+    for i in range(2):
+        file_names.append(str(tmp_path.joinpath(f"test_data_{i}.mat")))
+        shutil.copy(TEST_FILE_PATH, file_names[-1])
+
+    out_dir = tmp_path.joinpath("out")
+    out_dir.mkdir()
+    steps = [
+        ("Cropping", SpectralMap.crop_spectra_relative, [15, 20]),
+        ("Saving", SpectralMap.save_matlab, [str(out_dir), "_journal"]),
+    ]
+    journal_path = journal.get_journal_path(tmp_path.joinpath("logs.txt"))
+
+    with journal.Journal(journal_path, file_names, steps) as batch_journal:
+        assert batch.run(file_names, steps, io.StringIO(), journal=batch_journal) == []
+
+    # the run is interrupted while saving the second file
+    lines = pathlib.Path(journal_path).read_text().splitlines(keepends=True)
+    assert len(lines) == 1 + 2 * len(steps)
+    pathlib.Path(journal_path).write_text("".join(lines[:-1]) + lines[-1][:10])
+    out_dir.joinpath("test_data_1_journal.mat").unlink()
+
+    with pytest.raises(journal.JournalError):
+        journal.Journal(journal_path, file_names[:1], steps, resume=True)
+
+    assert journal.read_header(journal_path)[0] == file_names
+    with journal.Journal(journal_path, file_names, steps, resume=True) as batch_journal:
+        assert batch_journal.get_finished_steps(1) == {
+            0: None,
+            1: str(out_dir.joinpath("test_data_0_journal.mat")),
+        }
+        logs = io.StringIO()
+        assert batch.run(file_names, steps, logs, journal=batch_journal) == []
+
+    # the finished outputs are not made again
+    statuses = [
+        line
+        for line in logs.getvalue().splitlines()
+        if line in ("[SUCCESS]", "[FINISHED]")
+    ]
+    # the cropping of the second file is needed for its saving
+    assert statuses == ["[FINISHED]", "[FINISHED]", "[SUCCESS]", "[SUCCESS]"]
+    assert sorted(path.name for path in out_dir.iterdir()) == [
+        "test_data_0_journal.mat",
+        "test_data_1_journal.mat",
+    ]
+    with journal.Journal(journal_path, file_names, steps, resume=True) as batch_journal:
+        assert set(batch_journal.get_finished_steps(2)) == {0, 1}
+
+    # processed maps of the stitched pipeline are checkpointed until the final step is finished
+    steps = [
+        ("Cropping", SpectralMap.crop_spectra_relative, [15, 20]),
+        ("Stitched", batch.stitched_decomposition_export, [2, "journal", str(out_dir)]),
+    ]
+    journal_path = tmp_path.joinpath("stitched.journal.jsonl")
+    with journal.Journal(journal_path, file_names, steps) as batch_journal:
+        sm = SpectralMap(file_names[0])
+        sm.crop_spectra_relative(15, 20)
+        batch_journal.save_checkpoint(1, sm)
+        assert batch_journal.checkpoints_dir.exists()
+
+        logs = io.StringIO()
+        with ignore_warnings(category=ConvergenceWarning):
+            assert batch.run(file_names, steps, logs, journal=batch_journal) == []
+        assert logs.getvalue().count("[FINISHED]") == 1
+        assert not batch_journal.checkpoints_dir.exists()
+
+    with journal.Journal(journal_path, file_names, steps, resume=True) as batch_journal:
+        logs = io.StringIO()
+        assert batch.run(file_names, steps, logs, journal=batch_journal) == []
+        assert "[SUCCESS]" not in logs.getvalue()
+
+    # steps of the GUI have the positional parameters without the defaults, the resumed ones have all of them
+    steps = [
+        ("Background", SpectralMap.background_removal_imodpoly, [5, True]),
+        ("Saving", SpectralMap.save_matlab, [str(out_dir), "_journal"]),
+    ]
+    journal_path = tmp_path.joinpath("gui.journal.jsonl")
+    journal.Journal(journal_path, file_names, steps).close()
+
+    resumed_files, resumed_steps, labels = journal.read_header(journal_path)
+    resumed_steps = [
+        (label, pipeline.get_function(step.method), pipeline.get_positional_params(step))
+        for label, step in zip(labels, resumed_steps)
+    ]
+    assert resumed_steps[0][2] == [5, True, None, None]
+    with journal.Journal(journal_path, resumed_files, resumed_steps, resume=True):
+        pass
+    with journal.Journal(journal_path, file_names, steps, resume=True):
+        pass
+
+
+def test_stitched_NMF_out_of_core(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        SETTINGS, "backend", MemorySettingsBackend({"cache/dir": str(tmp_path)})
+    )
+
+    sm = SpectralMap(TEST_FILE_PATH)
+    sm.crop_spectral_map(0, 0, 10, 10)
+    sm2 = copy.deepcopy(sm)
+    sm2.crop_spectra_relative(15, 20)
+    maps = [sm, sm2]
+
+    new_x_axis = stitched_NMF.get_unified_x_axis([sm.x_axis, sm2.x_axis])
+    spectra = sm.data.reshape((-1, sm.shape[2]))[:10]
+    expected = np.array([np.interp(new_x_axis, sm.x_axis, s) for s in spectra])
+    assert np.allclose(stitched_NMF.resample(spectra, sm.x_axis, new_x_axis), expected)
+
+    data = stitched_NMF.stitch(maps, new_x_axis)
+    assert data.shape == (200, len(new_x_axis))
+
+    def get_error(transformed, components):
+        return np.linalg.norm(data - transformed @ components) / np.linalg.norm(data)
+
+    with ignore_warnings(category=ConvergenceWarning):
+        transformed, components, _ = stitched_NMF.stitched_NMF(maps, 3)
+
+        # blocks of 30 spectra, stitched ones are memory-mapped from the temporary file
+        SETTINGS.setValue("processing/memory_budget", 30 * data[0].nbytes * 4 / 1024**2)
+        transformed_ooc, components_ooc, _ = stitched_NMF.stitched_NMF(maps, 3)
+
+    assert transformed_ooc.shape == transformed.shape
+    assert components_ooc.shape == components.shape
+    assert get_error(transformed_ooc, components_ooc) < 2 * get_error(
+        transformed, components
+    )
+
+    # processed maps are memory-mapped from the temporary files until the final step is finished
+    shutil.copy(TEST_FILE_PATH, tmp_path.joinpath("test_data.mat"))
+    out_dir = tmp_path.joinpath("out")
+    out_dir.mkdir()
+    steps = [
+        ("Cropping", SpectralMap.crop_spectral_map, [0, 0, 10, 10]),
+        ("Stitched", batch.stitched_decomposition_export, [2, "exp", str(out_dir)]),
+    ]
+    file_names = [str(TEST_FILE_PATH), str(tmp_path.joinpath("test_data.mat"))]
+    SETTINGS.setValue("step_cache/enabled", False)
+    with ignore_warnings(category=ConvergenceWarning):
+        assert batch.run(file_names, steps, io.StringIO()) == []
+    assert list(out_dir.glob("exp_*.pdf"))
+    assert not list(tmp_path.glob("stitched_*"))
+
+
+def test_float32_processing():
+    sm = SpectralMap(TEST_FILE_PATH)
+    sm32 = SpectralMap(TEST_FILE_PATH, dtype=np.float32)
+    assert sm32.data.dtype == np.float32
+
+    for spectral_map in [sm, sm32]:
+        spectral_map.crop_spectra_absolute(500, 3800)
+        spectral_map.background_removal_poly(3, True)
+        spectral_map.smoothing_whittaker(1600, 2)
+        spectral_map.smoothing_savgol(7, 2)
+        spectral_map.linearization(1.0)
+        spectral_map.water_normalization()
+
+    # no step upcasts the spectra and results stay close to double precision ones
+    assert sm32.data.dtype == np.float32
+    assert sm32.averages.dtype == np.float32
+    tolerance = 1e-4 * np.nanmax(np.abs(sm.data))
+    assert np.allclose(sm32.data, sm.data, rtol=1e-4, atol=tolerance, equal_nan=True)
+
+
+def test_history():
+    sm = SpectralMap(TEST_FILE_PATH, keep_history=True)
+
+    states = [(sm.data.copy(), sm.x_axis)]
+    steps = [
+        lambda: sm.crop_spectral_map(2, 3, 20, 30),
+        lambda: sm.background_removal_poly(3, True),
+        lambda: sm.interpolate_withing_range(2, 14, 518.6, 627.1),
+        lambda: sm.linearization(1.0),
+        lambda: sm.smoothing_savgol(7, 2),
+    ]
+    for step in steps:
+        step()
+        states.append((sm.data.copy(), sm.x_axis))
+
+    # step by step back to the loaded map and forward again
+    for data, x_axis in reversed(states[:-1]):
+        assert sm.undo() is not None
+        assert np.array_equal(sm.data, data, equal_nan=True)
+        assert np.array_equal(sm.x_axis, x_axis)
+        assert np.allclose(sm.averages, np.mean(data, axis=2), equal_nan=True)
+    assert sm.undo() is None
+
+    for data, x_axis in states[1:]:
+        assert sm.redo() is not None
+        assert np.array_equal(sm.data, data, equal_nan=True)
+        assert np.array_equal(sm.x_axis, x_axis)
+    assert sm.redo() is None
+
+    # the oldest steps are forgotten first
+    sm.history.memory_budget = 2 * sm.data.nbytes
+    sm.smoothing_whittaker()
+    assert sm.history.get_nbytes(sm) <= sm.history.memory_budget
+    assert sm.history.get_names()[-1] == "Smoothing"
+    assert "Cropping" not in sm.history.get_names()
+
+
 def test_map_cropping():
     sm = SpectralMap(TEST_FILE_PATH)
 
@@ -110,6 +755,26 @@ def test_auto_removal():
     assert np.array_equal(sm.data[1:, 1:], sm2.data[1:, 1:])
 
 
+def test_summary_updates():
+    sm = SpectralMap(TEST_FILE_PATH)
+    averages = sm.averages.copy()
+
+    # only the changed spectra are updated
+    sm.interpolate_withing_range(2, 14, 518.6, 627.1)
+    assert sm.averages[2, 14] == np.mean(sm.data[2, 14])
+    unchanged = np.ones(sm.shape[:2], dtype=bool)
+    unchanged[2, 14] = False
+    assert np.array_equal(sm.averages[unchanged], averages[unchanged])
+
+    sm.data[0, 0, 50] = 10000
+    sm.mark_dirty(0, 0)
+    assert sm.maxima[0, 0] == 10000
+
+    sm.auto_spike_removal()
+    assert np.array_equal(sm.maxima, np.max(sm.data, axis=2))
+    assert np.allclose(sm.averages, np.mean(sm.data, axis=2))
+
+
 def test_math_morpho():
     sm = SpectralMap(TEST_FILE_PATH)
     sm2 = copy.deepcopy(sm)
@@ -119,6 +784,38 @@ def test_math_morpho():
     assert not np.array_equal(sm.data, sm2.data)
 
 
+def test_math_morpho_incremental():
+    sm = SpectralMap(TEST_FILE_PATH)
+    spectra = sm.data[0, :10]
+
+    widths = math_morpho.get_optimal_structuring_element_widths(spectra)
+    for spectrum, width in zip(spectra, widths):
+        assert width == math_morpho.get_optimal_structuring_element_width(spectrum)
+
+    sm2 = copy.deepcopy(sm)
+    sm.background_removal_math_morpho(True, fast=True)
+
+    assert not np.array_equal(sm.data, sm2.data)
+
+
+def test_math_morphology_kernels():
+    sm = SpectralMap(TEST_FILE_PATH)
+    spectra = sm.data[0, :10]
+
+    for window_width in [0, 1, 7, 100, 2000]:
+        padded = np.pad(spectra, ((0, 0), (window_width, window_width)), mode="edge")
+        windows = np.lib.stride_tricks.sliding_window_view(
+            padded, 2 * window_width + 1, axis=1
+        )
+
+        assert np.array_equal(
+            math_morphology.erosion(spectra, window_width), windows.min(axis=2)
+        )
+        assert np.array_equal(
+            math_morphology.dilation(spectra[0], window_width), windows[0].max(axis=1)
+        )
+
+
 def test_airpls():
     sm = SpectralMap(TEST_FILE_PATH)
     sm2 = copy.deepcopy(sm)
@@ -128,6 +825,19 @@ def test_airpls():
     assert not np.array_equal(sm.data, sm2.data)
 
 
+def test_airpls_batched():
+    sm = SpectralMap(TEST_FILE_PATH)
+    spectra = sm.data.reshape(-1, sm.shape[2])[:50]
+
+    for lambda_ in [10**3, 10**5]:
+        batched = airpls.airPLS_batch(spectra, lambda_)
+        expected = np.array(
+            [airpls.airPLS_spectrum(spectrum, lambda_) for spectrum in spectra]
+        )
+
+        assert np.allclose(batched, expected, rtol=1e-7, atol=1e-6)
+
+
 def test_imodpoly():
     sm = SpectralMap(TEST_FILE_PATH)
     sm2 = copy.deepcopy(sm)
@@ -137,6 +847,44 @@ def test_imodpoly():
     assert not np.array_equal(sm.data, sm2.data)
 
 
+def test_imodpoly_batched():
+    sm = SpectralMap(TEST_FILE_PATH)
+    spectra = sm.data.reshape(-1, sm.shape[2])[:50]
+
+    for degree, ignore_water in [(2, True), (5, False)]:
+        batched = imodpoly.imodpoly_bg_batch(spectra, sm.x_axis, degree, ignore_water)
+        expected = np.array(
+            [
+                imodpoly.imodpoly_bg(spectrum, sm.x_axis, degree, ignore_water)
+                for spectrum in spectra
+            ]
+        )
+
+        assert np.allclose(batched, expected, rtol=1e-7, atol=1e-6)
+
+
+def test_imodpoly_degenerate():
+    # fewer points than coefficients remain after the peaks are removed from the first two spectra
+    x_axis = np.linspace(0, 1, 5)
+    spectra = np.array(
+        [
+            [0, 10, 10, 10, 0],
+            [0, 10, 0, 10, 0],
+            [0, 10, 20, 10, 0],
+            [0, 5, 10, 5, 0],
+        ],
+        dtype=np.float64,
+    )
+
+    batched = imodpoly.imodpoly_bg_batch(spectra, x_axis, 3, False)
+    with ignore_warnings(category=np.polynomial.polyutils.RankWarning):
+        expected = np.array(
+            [imodpoly.imodpoly_bg(spectrum, x_axis, 3, False) for spectrum in spectra]
+        )
+
+    assert np.allclose(batched, expected, atol=1e-9)
+
+
 def test_poly():
     sm = SpectralMap(TEST_FILE_PATH)
     sm2 = copy.deepcopy(sm)
@@ -146,6 +894,79 @@ def test_poly():
     assert not np.array_equal(sm.data, sm2.data)
 
 
+def test_subtract_backgrounds_in_blocks():
+    sm = SpectralMap(TEST_FILE_PATH)
+    data = sm.data.astype(np.float64)
+    expected = data - poly.poly_bg_batch(
+        data.reshape((-1, data.shape[-1])), sm.x_axis, 5
+    ).reshape(data.shape)
+
+    # one row per block; cropped map is not contiguous
+    assert executor.get_block_rows(data, memory_budget=1) == 1
+    cropped = data[:, 5:]
+    executor.subtract_backgrounds(
+        cropped, poly.poly_bg_batch, sm.x_axis, 5, memory_budget=1
+    )
+
+    assert np.allclose(cropped, expected[:, 5:])
+
+
+def test_map_spectra_backends():
+    sm = SpectralMap(TEST_FILE_PATH)
+    expected = poly.poly_bg_batch(
+        sm.data.reshape((-1, sm.data.shape[-1])), sm.x_axis, 5
+    ).reshape(sm.data.shape)
+
+    class Progress:
+        def __init__(self):
+            self.steps = []
+
+        def emit(self, steps):
+            self.steps.append(steps)
+
+    for backend in executor.BACKENDS:
+        progress = Progress()
+        result = executor.map_spectra(
+            sm.data,
+            poly.poly_bg,
+            sm.x_axis,
+            5,
+            batched=False,
+            signal_to_emit=progress,
+            backend=backend,
+            n_workers=2,
+            memory_budget=sm.data[:10].nbytes,
+        )
+
+        assert np.allclose(result, expected)
+        assert len(progress.steps) > 1
+        assert sum(progress.steps) == sm.data.shape[0] * sm.data.shape[1]
+
+
+def test_poly_batched():
+    sm = SpectralMap(TEST_FILE_PATH)
+    spectra = sm.data.reshape(-1, sm.shape[2])[:50]
+
+    for degree, ignore_water in [(2, True), (5, False)]:
+        batched = poly.poly_bg_batch(spectra, sm.x_axis, degree, ignore_water)
+
+        to_fit = (
+            indices.get_no_water_indices(sm.x_axis)
+            if ignore_water
+            else np.ones(sm.x_axis.shape, dtype=bool)
+        )
+        expected = np.array(
+            [
+                np.polynomial.Polynomial.fit(
+                    sm.x_axis[to_fit], spectrum[to_fit], deg=degree
+                )(sm.x_axis)
+                for spectrum in spectra
+            ]
+        )
+
+        assert np.allclose(batched, expected, rtol=1e-7, atol=1e-6)
+
+
 def test_linearize():
     sm = SpectralMap(TEST_FILE_PATH)
 
@@ -242,6 +1063,21 @@ def test_whittaker():
     assert not np.array_equal(sm.data, sm2.data)
 
 
+def test_whittaker_direct_solution():
+    sm = SpectralMap(TEST_FILE_PATH)
+    lam, diff = 1600, 2
+    spectra = sm.data[0, :5]
+
+    D = np.diff(np.eye(spectra.shape[1]), diff, axis=0)
+    expected = np.linalg.solve(np.eye(spectra.shape[1]) + lam * D.T @ D, spectra.T).T
+
+    assert np.allclose(
+        sm.smoothing_whittaker(lam, diff, one_spectrum=spectra[0]), expected[0]
+    )
+    sm.smoothing_whittaker(lam, diff)
+    assert np.allclose(sm.data[0, :5], expected)
+
+
 def test_savgol():
     sm = SpectralMap(TEST_FILE_PATH)
     sm2 = copy.deepcopy(sm)
@@ -251,6 +1087,20 @@ def test_savgol():
     assert not np.array_equal(sm.data, sm2.data)
 
 
+def test_savgol_whole_map():
+    sm = SpectralMap(TEST_FILE_PATH)
+    window_length, polyorder = 11, 3
+
+    expected = savgol_filter(sm.data, window_length, polyorder, axis=-1)
+
+    assert np.allclose(
+        sm.smoothing_savgol(window_length, polyorder, one_spectrum=sm.data[2, 3]),
+        expected[2, 3],
+    )
+    sm.smoothing_savgol(window_length, polyorder)
+    assert np.allclose(sm.data, expected)
+
+
 def test_bubblefill():
     sm = SpectralMap(TEST_FILE_PATH)
     sm2 = copy.deepcopy(sm)
@@ -258,3 +1108,72 @@ def test_bubblefill():
     sm.background_removal_bubblefill(100, 700)
 
     assert not np.array_equal(sm.data, sm2.data)
+
+
+def test_bubblefill_batched():
+    sm = SpectralMap(TEST_FILE_PATH)
+    spectra = sm.data[0, :5].astype(np.float64)
+
+    # the original per-spectrum algorithm
+    def bubblefill_bg(spectrum, min_bubble_widths, fit_order):
+        poly_fit = np.poly1d(np.polyfit(sm.x_axis, spectrum, fit_order))(sm.x_axis)
+        spectrum_ = spectrum - poly_fit
+        smin = spectrum_.min()
+        spectrum_ = spectrum_ - smin
+        scale = spectrum_.max() / len(spectrum)
+        spectrum_ = spectrum_ / scale
+
+        baseline = bubblefill.bubbleloop(
+            spectrum_, np.zeros(spectrum_.shape), min_bubble_widths
+        )
+        baseline = baseline * scale + poly_fit + smin
+
+        if not isinstance(min_bubble_widths, int):
+            filter_width = max(min(min_bubble_widths), 10)
+        else:
+            filter_width = max(min_bubble_widths, 10)
+        return savgol_filter(baseline, int(2 * (filter_width // 4) + 3), 3)
+
+    widths = np.linspace(50, 150, sm.x_axis.shape[0]).astype(int).tolist()
+    for min_bubble_widths, fit_order in [(100, 1), (30, 2), (widths, 1)]:
+        batched = bubblefill.bubblefill_bg_batch(
+            spectra, sm.x_axis, min_bubble_widths, fit_order
+        )
+        expected = np.array(
+            [
+                bubblefill_bg(spectrum, min_bubble_widths, fit_order)
+                for spectrum in spectra
+            ]
+        )
+
+        assert np.allclose(batched, expected, rtol=1e-7, atol=1e-6)
+
+
+def test_bubbleloop_array():
+    sm = SpectralMap(TEST_FILE_PATH)
+    spectra = sm.data[0, :5].astype(np.float64)
+    spectra = (spectra - spectra.min(axis=1, keepdims=True)) / 10
+    min_bubble_widths = np.full(spectra.shape[1], 100)
+
+    baselines = bubblefill.bubbleloop_batch(spectra, min_bubble_widths)
+    for spectrum, baseline in zip(spectra, baselines):
+        expected = bubblefill.bubbleloop(spectrum, np.zeros(spectrum.shape), 100)
+        assert np.allclose(baseline, expected)
+
+
+def test_headless_core():
+    # processing core does not import Qt, so that worker processes and scripts start fast without it
+    code = "import sys, ramain.model.spectal_map; print(any(m.startswith('PySide6') for m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=TEST_FILE_DIR.parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "False"
+
+    # text based backends (e.g. INI files of QSettings) store booleans as strings
+    settings = Settings(MemorySettingsBackend({"processing/float32": "true"}))
+    assert settings.value("processing/float32", False, type=bool) is True
+    assert settings.value("processing/backend", "serial") == "serial"
@@ -0,0 +1,65 @@
+import numpy as np
+import scipy.sparse as ss
+from scipy.linalg import solveh_banded
+from functools import lru_cache
+
+
+@lru_cache(maxsize=16)
+def difference_penalty_band(length: int, lambda_: float, order: int) -> np.ndarray:
+    """
+    Function to get `lambda_` * D^T D, where D is the difference matrix of given `order`, in the upper
+    banded form used by `scipy.linalg.solveh_banded`, i.e. `ab[order + i - j, j] == a[i, j]`.
+    The band is cached (and read-only) as it is shared by all the spectra of the same length.
+
+    Parameters:
+        length (int): Number of points of the spectra.
+        lambda_ (float): Weight of the penalty.
+        order (int): Order of the differences.
+
+    Returns:
+        ab (np.ndarray): Penalty matrix in the upper banded form, shape (`order` + 1, `length`).
+    """
+
+    E = ss.eye(length, format="csc")
+    for _ in range(order):
+        E = E[1:] - E[:-1]
+    penalty = (lambda_ * E.T @ E).todia()
+
+    ab = np.zeros((order + 1, length))
+    for offset in range(order + 1):
+        ab[order - offset, offset:] = penalty.diagonal(offset)
+
+    ab.setflags(write=False)
+    return ab
+
+
+def solveh_banded_batch(
+    ab: np.ndarray, diagonals: np.ndarray, rhs: np.ndarray
+) -> np.ndarray:
+    """
+    Function to solve many symmetric positive definite banded systems (`ab` + diag(`diagonals[k]`)) x = `rhs[k]`
+    at once. All the systems share the same band `ab` (upper form, see `difference_penalty_band`) and differ in
+    the main diagonal only, which is the case of reweighted penalized least squares.
+    The systems are stacked into one block diagonal banded system that is solved by a single LAPACK call.
+
+    Parameters:
+        ab (np.ndarray): Shared matrix in the upper banded form, shape (u + 1, m).
+        diagonals (np.ndarray): Values added to the main diagonal, one row per system, shape (n, m).
+        rhs (np.ndarray): Right hand sides, one row per system, shape (n, m).
+
+    Returns:
+        x (np.ndarray): Solutions, one row per system, shape (n, m).
+    """
+
+    u = ab.shape[0] - 1
+    n_systems = diagonals.shape[0]
+
+    # NOTE: first `u` columns of `ab` have zeros above the matrix, so the tiled blocks are not coupled
+    stacked = np.tile(ab, n_systems)
+    stacked[u] += diagonals.ravel()
+
+    solutions = solveh_banded(
+        stacked, rhs.ravel(), overwrite_ab=True, check_finite=False
+    )
+
+    return solutions.reshape(rhs.shape)
@@ -1,24 +1,63 @@
 import numpy as np
 
 
+def _running_extreme(
+    values: np.ndarray, window_width: int, ufunc: np.ufunc
+) -> np.ndarray:
+    """
+    Function to get minimum/maximum (given by `ufunc`) in the sliding window along the last axis of `values`
+    using van Herk/Gil-Werman algorithm, i.e. cost of the computation does not depend on the window width.
+    Values are padded by the side values, so the result is the same as with the window clipped on the sides.
+
+    Parameters:
+        values (np.ndarray): Array of values (one spectrum or 2D stack of spectra, one per row).
+        window_width (int): Half-width of the window, i.e. whole window has size 2*`window_width` + 1
+        ufunc (np.ufunc): `np.minimum` or `np.maximum`.
+    """
+
+    window_size = 2 * window_width + 1
+    length = values.shape[-1]
+
+    # small windows (e.g. unit steps of the incremental opening) are faster as extremes of shifted values
+    if window_width <= 4:
+        pad_width = [(0, 0)] * (values.ndim - 1) + [(window_width, window_width)]
+        padded_values = np.pad(values, pad_width, mode="edge")
+
+        result = padded_values[..., :length].copy()
+        for shift in range(1, window_size):
+            ufunc(result, padded_values[..., shift : shift + length], out=result)
+        return result
+
+    # pad with side values from sides so that padded length is a multiple of window size
+    n_blocks = -(-(length + 2 * window_width) // window_size)
+    pad_right = n_blocks * window_size - length - window_width
+    pad_width = [(0, 0)] * (values.ndim - 1) + [(window_width, pad_right)]
+    padded_values = np.pad(values, pad_width, mode="edge")
+
+    # running extremes from the start and from the end of each block
+    blocks = padded_values.reshape(values.shape[:-1] + (n_blocks, window_size))
+    prefix = ufunc.accumulate(blocks, axis=-1).reshape(padded_values.shape)
+    suffix = ufunc.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(
+        padded_values.shape
+    )
+
+    # each window is covered by suffix of one block and prefix of the following one
+    return ufunc(
+        suffix[..., :length], prefix[..., window_size - 1 : window_size - 1 + length]
+    )
+
+
 def erosion(values: np.ndarray, window_width: int) -> np.ndarray:
     """
     Function to get erosion of `values` array with structuring elements with `window_width` width.
     Erosion ... minimum in the sliding window.
 
     Parameters:
-        values (np.ndarray): Array fo values that are to be eroded.
+        values (np.ndarray): Array fo values that are to be eroded (one spectrum or 2D stack of spectra, one per row).
         window_width (int): Structuring element width, i.e. whole structuring element has size 2*`window_width` + 1
     """
 
-    # pad with side values from sides -> minimum will be the same
-    padded_values = np.pad(values, (window_width, window_width), 'constant', constant_values=(values[0], values[-1]))
-    # view the array as the windows (window slides one position)
-    windows = np.lib.stride_tricks.sliding_window_view(padded_values, 2*window_width + 1)
-    # minimum from each window = erosion
-    mins = np.min(windows, axis=1)
-
-    return mins
+    return _running_extreme(values, window_width, np.minimum)
 
 
 def dilation(values: np.ndarray, window_width: int) -> np.ndarray:
@@ -27,18 +66,11 @@ def dilation(values: np.ndarray, window_width: int) -> np.ndarray:
     Dilatation ... maximum in the sliding window.
 
     Parameters:
-        values (np.ndarray): Array fo values that are to be dilatated.
+        values (np.ndarray): Array fo values that are to be dilatated (one spectrum or 2D stack of spectra, one per row).
         window_width (int): Structuring element width, i.e. whole structuring element has size 2*`window_width` + 1
     """
 
-    # pad with side values from sides -> maximum will be the same
-    padded_values = np.pad(values, (window_width, window_width), 'constant', constant_values=(values[0], values[-1]))
-    # view the array as the windows (window slides one position)
-    windows = np.lib.stride_tricks.sliding_window_view(padded_values, 2*window_width + 1)
-    # maximum from each window = dilatation
-    maxes = np.max(windows, axis=1)
-
-    return maxes
+    return _running_extreme(values, window_width, np.maximum)
 
 
 def opening(values: np.ndarray, window_width: int) -> np.ndarray:
@@ -47,7 +79,7 @@ def opening(values: np.ndarray, window_width: int) -> np.ndarray:
     Opening ... dilatation of the erosion.
 
     Parameters:
-        values (np.ndarray): Array fo values that are to be opened.
+        values (np.ndarray): Array fo values that are to be opened (one spectrum or 2D stack of spectra, one per row).
         window_width (int): Structuring element width, i.e. whole structuring element has size 2*`window_width` + 1
     """
 
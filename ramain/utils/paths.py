@@ -1,4 +1,5 @@
 import os
+import sys
 
 
 def create_new_file_name(folder_path, file_name, fallback_extension, file_tag=None):
@@ -21,3 +22,20 @@ def create_new_file_name(folder_path, file_name, fallback_extension, file_tag=No
         i += 1
 
     return out_file
+
+
+def get_user_cache_dir(app_name="RamAIn"):
+    """
+    A function to get the cache directory of the application in the user cache location of the platform
+    (the same place Qt puts it, without depending on Qt).
+    """
+
+    if sys.platform == "win32":
+        base_dir = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+        return os.path.join(base_dir, app_name, "cache")
+
+    if sys.platform == "darwin":
+        return os.path.join(os.path.expanduser("~/Library/Caches"), app_name)
+
+    base_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base_dir, app_name)
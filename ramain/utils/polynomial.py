@@ -0,0 +1,23 @@
+import numpy as np
+
+
+def scaled_vandermonde(x: np.ndarray, x_fit: np.ndarray, degree: int) -> np.ndarray:
+    """
+    Function to get pseudo-Vandermonde matrix of `x` for polynomial fitting on `x_fit` points.
+    `x` is mapped from the domain of `x_fit` onto [-1, 1] the same way as `np.polynomial.Polynomial.fit` does it.
+    Legendre basis is used instead of the power one as it spans the same polynomials, but the least
+    squares systems are much better conditioned for higher degrees.
+
+    Parameters:
+        x (np.ndarray): Points in which the basis is evaluated.
+        x_fit (np.ndarray): Points that define the domain of the fit.
+        degree (int): Degree of the polynomial.
+
+    Returns:
+        vander (np.ndarray): Matrix of shape (len(`x`), `degree` + 1).
+    """
+
+    x_min, x_max = np.min(x_fit), np.max(x_fit)
+    x_scaled = (2 * x - (x_max + x_min)) / (x_max - x_min)
+
+    return np.polynomial.legendre.legvander(x_scaled, degree)
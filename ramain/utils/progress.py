@@ -0,0 +1,27 @@
+"""
+Reporting of the progress of long running processing. Processing functions take any object with `emit` method
+(e.g. bound Qt signal in the views), so that the processing itself does not depend on Qt.
+"""
+
+from typing import Callable, Protocol
+
+
+class ProgressCallback(Protocol):
+    """
+    Receiver of the progress, `emit` is called with the number of finished steps (or without arguments
+    if the steps are not counted, e.g. iterations of NMF).
+    """
+
+    def emit(self, *args) -> None: ...
+
+
+class FunctionProgress:
+    """
+    Adapter of a plain function to `ProgressCallback`, e.g. for the scripts.
+    """
+
+    def __init__(self, function: Callable[..., None]) -> None:
+        self.function = function
+
+    def emit(self, *args) -> None:
+        self.function(*args)
@@ -1,17 +1,122 @@
+"""
+Settings of the application. `SETTINGS` has the interface of `QSettings` (`value`, `setValue`) without depending
+on Qt: values are kept in memory until a persistent backend is set. The GUI sets `QSettings` as the backend,
+headless jobs may use `JsonSettingsBackend`.
+"""
+
 import os
-from PySide6.QtCore import QSettings
+import json
+from pathlib import Path
+from typing import Any, Optional, Protocol, Union
+
+
+class SettingsBackend(Protocol):
+    """
+    Storage of the settings, e.g. `QSettings`.
+    """
+
+    def value(self, key: str, defaultValue: Any = None) -> Any: ...
+
+    def setValue(self, key: str, value: Any) -> None: ...
+
+
+class MemorySettingsBackend:
+    """
+    Settings kept in memory only.
+    """
+
+    def __init__(self, values: Optional[dict] = None) -> None:
+        self.values = {} if values is None else dict(values)
+
+    def value(self, key: str, defaultValue: Any = None) -> Any:
+        return self.values.get(key, defaultValue)
+
+    def setValue(self, key: str, value: Any) -> None:
+        self.values[key] = value
+
+
+class JsonSettingsBackend(MemorySettingsBackend):
+    """
+    Settings stored in JSON file, e.g. for the batch jobs.
+    """
+
+    def __init__(self, file_path: Union[str, Path]) -> None:
+        self.file_path = Path(file_path)
+
+        values = {}
+        if self.file_path.exists():
+            with open(self.file_path, "r") as file:
+                values = json.load(file)
+
+        super().__init__(values)
+
+    def setValue(self, key: str, value: Any) -> None:
+        super().setValue(key, value)
+
+        with open(self.file_path, "w") as file:
+            json.dump(self.values, file, indent=4)
+
+
+class Settings:
+    """
+    Settings with the interface of `QSettings` over exchangeable backend.
+    """
+
+    def __init__(self, backend: Optional[SettingsBackend] = None) -> None:
+        self.backend = MemorySettingsBackend() if backend is None else backend
+
+    def set_backend(self, backend: SettingsBackend) -> None:
+        """
+        A function to change where the settings are stored, missing defaults are set in the new backend.
+        """
+
+        self.backend = backend
+        set_defaults(self)
+
+    def value(self, key: str, default: Any = None, type: Optional[type] = None) -> Any:
+        """
+        A function to get value of the setting.
+
+        Parameters:
+            key (str): Key of the setting.
+            default (Any): Value returned if the setting is not set. Default: None.
+            type (type): Type the value is converted to. Default: None.
+
+        Returns:
+            value (Any): Value of the setting.
+        """
+
+        value = self.backend.value(key, default)
+        if type is None or value is None:
+            return value
+
+        # text based storages (e.g. INI files of `QSettings`) return booleans as strings
+        if type is bool and isinstance(value, str):
+            return value.lower() in ("true", "1")
+        return type(value)
+
+    def setValue(self, key: str, value: Any) -> None:
+        self.backend.setValue(key, value)
+
+
+def set_defaults(settings: Settings) -> None:
+    """
+    A function to set the default values of the settings that are not set yet.
+    """
+
+    # NOTE: should not be needed as we now have set organization and app name
+    if settings.value("spectral_map/cmap") is None:
+        settings.setValue("spectral_map/cmap", "hot")
 
-SETTINGS = QSettings("RamAIn", "RamAIn")
+    if settings.value("source_dir") is None:
+        settings.setValue("source_dir", os.getcwd())
 
-# NOTE: should not be needed as we now have set organization and app name
-if SETTINGS.value("spectral_map/cmap") is None:
-    SETTINGS.setValue("spectral_map/cmap", "hot")
+    if settings.value("logs_dir") is None:
+        settings.setValue("logs_dir", os.getcwd())
 
-if SETTINGS.value("source_dir") is None:
-    SETTINGS.setValue("source_dir", os.getcwd())
+    if settings.value("export_dir") is None:
+        settings.setValue("export_dir", os.getcwd())
 
-if SETTINGS.value("logs_dir") is None:
-    SETTINGS.setValue("logs_dir", os.getcwd())
 
-if SETTINGS.value("export_dir") is None:
-    SETTINGS.setValue("export_dir", os.getcwd())
+SETTINGS = Settings()
+set_defaults(SETTINGS)
@@ -11,8 +11,10 @@ from PySide6.QtWidgets import (
     QProgressDialog,
     QLabel,
     QWidget,
+    QSpinBox,
+    QMessageBox,
 )
-from PySide6.QtGui import QIcon
+from PySide6.QtGui import QIcon, QPixmap
 from PySide6.QtCore import Qt, QThread, Signal
 
 from typing import List, Callable
@@ -23,17 +25,13 @@ from ramain.views.widgets.auto_method import AutoMethod
 from ramain.views.widgets.input_widget_specifier import InputWidgetSpecifier, WidgetType
 
 from ramain.model.spectal_map import SpectralMap
+from ramain.model import loaders, batch, journal, pipeline
 
 from ramain.utils import validators
 from ramain.utils.settings import SETTINGS
-
-
-from ramain.spectra_processing.decomposition.stitched_NMF import stitched_NMF
-from ramain.spectra_processing.export.to_graphics import export_stitched_maps_graphics
+from ramain.utils.progress import FunctionProgress
 
 import os
-import datetime
-import traceback
 
 
 class FunctionItem(QListWidgetItem):
@@ -48,6 +46,7 @@ class FunctionItem(QListWidgetItem):
         function: Callable = None,
         params: List = None,
         parent: QWidget = None,
+        name: str = "",
     ) -> None:
         """
         The constructor for FunctionItem widget usable in QListWidget.
@@ -57,11 +56,13 @@ class FunctionItem(QListWidgetItem):
             function (Callable): Function that this objects represents. Default: None.
             params (List): Parameters for the `function` function. Default: None.
             parent (QWidget): Parent widget of this widget. Default: None.
+            name (str): Name of the method, saved with the pipeline. Default: "".
         """
 
         super().__init__(label, parent)
         self.function = function
         self.params = params
+        self.name = name
 
 
 class AutoProcessing(QFrame):
@@ -99,6 +100,11 @@ class AutoProcessing(QFrame):
         self.select_logs_dir = QPushButton("Select Logs Directory")
         self.select_logs_dir.clicked.connect(self.logs_dir_dialog)
 
+        # interrupted run resumed from its journal
+        self.resume_journal = None
+        self.resume_batch_btn = QPushButton("Resume Batch")
+        self.resume_batch_btn.clicked.connect(self.resume_batch)
+
         # methods selection
         self.methods_list = QListWidget(self)
         self.methods_list.setObjectName("methods_list")
@@ -136,13 +142,30 @@ class AutoProcessing(QFrame):
         self.clear_pipeline_btn = QPushButton("Clear Pipeline")
         self.clear_pipeline_btn.clicked.connect(self.clear_pipeline)
 
+        self.save_pipeline_btn = QPushButton("Save Pipeline")
+        self.save_pipeline_btn.clicked.connect(self.save_pipeline)
+
+        self.load_pipeline_btn = QPushButton("Load Pipeline")
+        self.load_pipeline_btn.clicked.connect(self.load_pipeline)
+
+        self.init_pipeline_error_widget()
+
         self.apply_button = QPushButton("Apply")
         self.apply_button.clicked.connect(self.apply_pipeline)
         self.apply_button.setEnabled(False)
 
+        # number of files processed at once
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, os.cpu_count() or 1)
+        self.workers_spin.setValue(min(batch.get_workers(), os.cpu_count() or 1))
+        self.workers_spin.valueChanged.connect(
+            lambda value: SETTINGS.setValue("batch/workers", value)
+        )
+
         self.progress = None
         self.pipeline_worker = PipelineWorker(self)
         self.pipeline_worker.progress_update.connect(self.update_progress)
+        self.pipeline_worker.run_error.connect(self.show_run_error)
 
         # put everything into layout
         layout = QVBoxLayout(self)
@@ -159,6 +182,7 @@ class AutoProcessing(QFrame):
         logs_layout = QHBoxLayout()
         logs_layout.addWidget(self.logs_dir_label)
         logs_layout.addStretch()
+        logs_layout.addWidget(self.resume_batch_btn)
         logs_layout.addWidget(self.select_logs_dir)
 
         layout.addLayout(logs_layout)
@@ -184,9 +208,18 @@ class AutoProcessing(QFrame):
         pipeline_btns_layout = QHBoxLayout()
         pipeline_btns_layout.addWidget(self.remove_from_pipeline_btn)
         pipeline_btns_layout.addStretch()
+        pipeline_btns_layout.addWidget(self.load_pipeline_btn)
+        pipeline_btns_layout.addWidget(self.save_pipeline_btn)
         pipeline_btns_layout.addWidget(self.clear_pipeline_btn)
 
         layout.addLayout(pipeline_btns_layout)
+
+        workers_layout = QHBoxLayout()
+        workers_layout.addWidget(QLabel("Parallel Files"))
+        workers_layout.addStretch()
+        workers_layout.addWidget(self.workers_spin)
+
+        layout.addLayout(workers_layout)
         layout.addWidget(self.apply_button)
 
         self.setLayout(layout)
@@ -325,6 +358,12 @@ class AutoProcessing(QFrame):
                     output_type=bool,
                     parameter_order=0,
                 ),
+                "Fast Mode": InputWidgetSpecifier(
+                    widget_type=WidgetType.CHECKBOX,
+                    init_value=False,
+                    output_type=bool,
+                    parameter_order=1,
+                ),
             },
             callback=SpectralMap.background_removal_math_morpho,
             parent=self,
@@ -496,7 +535,7 @@ class AutoProcessing(QFrame):
                     parameter_order=2,
                 ),
             },
-            callback=None,
+            callback=batch.stitched_decomposition_export,
             parent=self,
         )
         auto_methods.append(auto_stitched_decomposition_export)
@@ -605,6 +644,158 @@ class AutoProcessing(QFrame):
             self.pipeline_list.takeItem(item_index)
         self.clear_pipeline_btn.setEnabled(False)
 
+    def init_pipeline_error_widget(self) -> None:
+        """
+        A function initialize a pipeline error widget.
+        """
+
+        self.pipeline_error = QMessageBox()
+        self.pipeline_error.setIconPixmap(QPixmap("ramain/resources/icons/x-circle.svg"))
+        self.pipeline_error.setText("Pipeline could not be saved or loaded.")
+        self.pipeline_error.setWindowTitle("Invalid pipeline")
+        self.pipeline_error.setWindowIcon(QIcon("ramain/resources/icons/message.svg"))
+        self.pipeline_error.setStandardButtons(QMessageBox.Ok)
+
+    def show_pipeline_error(
+        self, error: Exception, text: str = "Pipeline could not be saved or loaded."
+    ) -> None:
+        """
+        A function to show the pipeline error widget with the `error` message.
+        """
+
+        self.pipeline_error.setText(text)
+        self.pipeline_error.setInformativeText(str(error))
+        self.pipeline_error.show()
+
+    def show_run_error(self, message: str) -> None:
+        """
+        A function to show the pipeline error widget if the batch could not be run (e.g. its journal could not
+        be resumed).
+        """
+
+        self.show_pipeline_error(message, "Batch could not be run.")
+
+    def save_pipeline(self) -> None:
+        """
+        A function to show file dialog so that the pipeline can be saved into a file and run later
+        (e.g. by `cli.py` without the GUI).
+        """
+
+        temp_folder = SETTINGS.value("pipelines_dir", os.getcwd())
+        if not os.path.exists(temp_folder):
+            temp_folder = os.getcwd()
+
+        file_name, _ = QFileDialog.getSaveFileName(
+            self,
+            "Save Pipeline",
+            os.path.join(temp_folder, "pipeline.json"),
+            "Pipeline (*.json *.yaml *.yml)",
+        )
+
+        if file_name is None or len(file_name) == 0:
+            return
+
+        SETTINGS.setValue("pipelines_dir", os.path.dirname(file_name))
+
+        try:
+            steps = []
+            for item_index in range(self.pipeline_list.count()):
+                item = self.pipeline_list.item(item_index)
+                steps.append(
+                    pipeline.make_step(item.function.__name__, item.params, item.name)
+                )
+            pipeline.save(file_name, steps)
+
+        except (OSError, ImportError, pipeline.PipelineError) as e:
+            self.show_pipeline_error(e)
+
+    def load_pipeline(self) -> None:
+        """
+        A function to show file dialog so that the saved pipeline can be loaded in place of the current one.
+        """
+
+        temp_folder = SETTINGS.value("pipelines_dir", os.getcwd())
+        if not os.path.exists(temp_folder):
+            temp_folder = os.getcwd()
+
+        file_name, _ = QFileDialog.getOpenFileName(
+            self,
+            "Load Pipeline",
+            temp_folder,
+            "Pipeline (*.json *.yaml *.yml)",
+        )
+
+        if file_name is None or len(file_name) == 0:
+            return
+
+        SETTINGS.setValue("pipelines_dir", os.path.dirname(file_name))
+
+        try:
+            steps = pipeline.load(file_name)
+        except (OSError, ImportError, pipeline.PipelineError) as e:
+            self.show_pipeline_error(e)
+            return
+
+        self.clear_pipeline()
+        for step in steps:
+            self.pipeline_list.addItem(
+                FunctionItem(
+                    pipeline.get_label(step),
+                    pipeline.get_function(step.method),
+                    pipeline.get_positional_params(step),
+                    name=step.name,
+                )
+            )
+
+        has_steps = self.pipeline_list.count() != 0
+        self.clear_pipeline_btn.setEnabled(has_steps)
+        self.remove_from_pipeline_btn.setEnabled(has_steps)
+        self.apply_button.setEnabled(has_steps and self.file_list_widget.count() != 0)
+
+    def resume_batch(self) -> None:
+        """
+        A function to show file dialog so that the run interrupted e.g. by a crash can be resumed from its journal.
+        Files and the pipeline of the run are restored and the steps it finished are not made again.
+        """
+
+        if not os.path.exists(self.logs_dir):
+            self.logs_dir = os.getcwd()
+
+        file_name, _ = QFileDialog.getOpenFileName(
+            self,
+            "Resume Batch",
+            self.logs_dir,
+            f"Journal (*{journal.JOURNAL_EXTENSION})",
+        )
+
+        if file_name is None or len(file_name) == 0:
+            return
+
+        try:
+            file_names, steps, labels = journal.read_header(file_name)
+            functions = [pipeline.get_function(step.method) for step in steps]
+            params = [pipeline.get_positional_params(step) for step in steps]
+        except (OSError, KeyError, journal.JournalError, pipeline.PipelineError) as e:
+            self.show_pipeline_error(e)
+            return
+
+        self.file_list_widget.clear()
+        self.file_list = []
+        for source_file in file_names:
+            self.file_list_widget.addItem(os.path.basename(source_file))
+            self.file_list.append(source_file)
+        self.remove_file_btn.setEnabled(len(file_names) != 0)
+
+        self.clear_pipeline()
+        for label, function, step_params in zip(labels, functions, params):
+            self.pipeline_list.addItem(FunctionItem(label, function, step_params))
+
+        self.clear_pipeline_btn.setEnabled(len(steps) != 0)
+        self.remove_from_pipeline_btn.setEnabled(len(steps) != 0)
+
+        self.resume_journal = file_name
+        self.apply_pipeline()
+
     def add_files(self) -> None:
         """
         A function to show file dialog so that file can be added to the list of files
@@ -616,7 +807,10 @@ class AutoProcessing(QFrame):
             temp_folder = os.getcwd()
 
         file_names, _ = QFileDialog.getOpenFileNames(
-            self, "Select one or more files", temp_folder, "*.mat"
+            self,
+            "Select one or more files",
+            temp_folder,
+            " ".join(f"*{extension}" for extension in loaders.get_extensions()),
         )
 
         if file_names is None or len(file_names) == 0:
@@ -685,6 +879,7 @@ class AutoProcessing(QFrame):
                 curr_item.text() + (" - " if len(params_text) else "") + params_text,
                 function,
                 params,
+                name=curr_item.text(),
             )
         )
 
@@ -722,7 +917,11 @@ class AutoProcessing(QFrame):
         self.remove_from_pipeline_btn.setEnabled(enable)
         self.apply_button.setEnabled(enable)
         self.clear_pipeline_btn.setEnabled(enable)
+        self.save_pipeline_btn.setEnabled(enable)
+        self.load_pipeline_btn.setEnabled(enable)
+        self.resume_batch_btn.setEnabled(enable)
         self.select_logs_dir.setEnabled(enable)
+        self.workers_spin.setEnabled(enable)
         self.parent.setEnabled(enable)
 
         for method in self.auto_methods:
@@ -807,6 +1006,7 @@ class PipelineWorker(QThread):
     """
 
     progress_update = Signal(int)
+    run_error = Signal(str)
 
     def __init__(self, auto_processing_widget: AutoProcessing) -> None:
         """
@@ -834,165 +1034,46 @@ class PipelineWorker(QThread):
         """
 
         # log file has name according to current time
-        logs_file = os.path.join(
-            self.auto_proceesing_widget.logs_dir,
-            "logs_" + datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S") + ".txt",
-        )
+        logs_file = batch.get_logs_path(self.auto_proceesing_widget.logs_dir)
 
-        with open(logs_file, "w", encoding="utf-8") as logs:
-            files_count = len(self.auto_proceesing_widget.file_list)
-            steps_count = self.auto_proceesing_widget.pipeline_list.count()
-            # TODO: upravit
-            if (
-                self.auto_proceesing_widget.pipeline_list.item(steps_count - 1)
-                .text()
-                .split("-")[0]
-                .strip()
-                == "Stitched Decomposition & Export"
-            ):
-                processed_data = []
-                try:
-                    for i, file_name in enumerate(
-                        self.auto_proceesing_widget.file_list, 1
-                    ):
-                        print(f"[FILE {i}/{files_count}]: {file_name}", file=logs)
-                        curr_data = SpectralMap(file_name)
-                        for item_index in range(steps_count - 1):
-                            curr_function = (
-                                self.auto_proceesing_widget.pipeline_list.item(
-                                    item_index
-                                ).function
-                            )
-                            curr_step_text = (
-                                self.auto_proceesing_widget.pipeline_list.item(
-                                    item_index
-                                ).text()
-                            )
-                            if (
-                                curr_step_text.split("-")[0].strip()
-                                == "Stitched Decomposition & Export"
-                            ):
-                                raise Exception(
-                                    "Stitched Decomposition & Export has to be last in the pipeline."
-                                )
-
-                            curr_params = (
-                                self.auto_proceesing_widget.pipeline_list.item(
-                                    item_index
-                                ).params
-                            )
-                            print(
-                                f"[STEP {item_index + 1}/{steps_count}]: {curr_step_text}; function: {curr_function.__name__}",
-                                file=logs,
-                            )
-
-                            # function call
-                            curr_function(curr_data, *curr_params)
-
-                            print("[SUCCESS]", file=logs)
-                            self.progress_update.emit(
-                                (i - 1)
-                                * self.auto_proceesing_widget.pipeline_list.count()
-                                + item_index
-                                + 1
-                            )
-                        processed_data.append(curr_data)
-
-                    n_comps = int(
-                        self.auto_proceesing_widget.pipeline_list.item(
-                            steps_count - 1
-                        ).params[0]
-                    )
-                    in_files = self.auto_proceesing_widget.file_list
-                    file_name = self.auto_proceesing_widget.pipeline_list.item(
-                        steps_count - 1
-                    ).params[1]
-                    out_dir = self.auto_proceesing_widget.pipeline_list.item(
-                        steps_count - 1
-                    ).params[2]
-
-                    print(
-                        f"[FINAL STEP]: stitched decomposition and export",
-                        file=logs,
-                    )
-
-                    nmf_transformed_data, nmf_components, unified_x_axis = stitched_NMF(
-                        processed_data,
-                        n_components=n_comps,
-                    )
-
-                    # TODO: export; item into the auto list and TEST!!! PCA will be added later
-                    export_stitched_maps_graphics(
-                        processed_data,
-                        nmf_transformed_data,
-                        nmf_components,
-                        unified_x_axis,
-                        file_name,
-                        in_files=in_files,
-                        out_dir=out_dir,
-                    )
-
-                    print("[SUCCESS]", file=logs)
-                    # self.progress_update.emit(
-                    #     (i - 1) * self.auto_proceesing_widget.pipeline_list.count()
-                    #     + item_index
-                    #     + 1
-                    # )
-
-                except Exception as e:
-                    em = traceback.format_exc()
-                    print(f"[ERROR]: {e}", file=logs)
-                    print(em, file=logs)
-
-                print(file=logs)
-
-            else:
-                for i, file_name in enumerate(self.auto_proceesing_widget.file_list, 1):
-                    print(f"[FILE {i}/{files_count}]: {file_name}", file=logs)
-                    try:
-                        curr_data = SpectralMap(file_name)
-                        for item_index in range(steps_count):
-                            curr_function = (
-                                self.auto_proceesing_widget.pipeline_list.item(
-                                    item_index
-                                ).function
-                            )
-                            curr_step_text = (
-                                self.auto_proceesing_widget.pipeline_list.item(
-                                    item_index
-                                ).text()
-                            )
-                            if curr_step_text == "Stitched Decomposition & Export":
-                                raise Exception(
-                                    "Stitched Decomposition & Export has to be last in the pipeline."
-                                )
-
-                            curr_params = (
-                                self.auto_proceesing_widget.pipeline_list.item(
-                                    item_index
-                                ).params
-                            )
-                            print(
-                                f"[STEP {item_index + 1}/{steps_count}]: {curr_step_text}; function: {curr_function.__name__}",
-                                file=logs,
-                            )
-
-                            # function call
-                            curr_function(curr_data, *curr_params)
-
-                            print("[SUCCESS]", file=logs)
-                            self.progress_update.emit(
-                                (i - 1)
-                                * self.auto_proceesing_widget.pipeline_list.count()
-                                + item_index
-                                + 1
-                            )
-
-                    except Exception as e:
-                        em = traceback.format_exc()
-                        print(f"[ERROR]: {e}", file=logs)
-                        print(em, file=logs)
-
-                    print(file=logs)
-
-        self.destroy()
+        steps = [
+            (
+                self.auto_proceesing_widget.pipeline_list.item(item_index).text(),
+                self.auto_proceesing_widget.pipeline_list.item(item_index).function,
+                self.auto_proceesing_widget.pipeline_list.item(item_index).params,
+            )
+            for item_index in range(self.auto_proceesing_widget.pipeline_list.count())
+        ]
+
+        # files are processed by `batch` (in parallel), their finished steps are summed up for the progress bar
+        finished_steps = 0
+
+        def update_progress(steps_done: int) -> None:
+            nonlocal finished_steps
+            finished_steps += steps_done
+            self.progress_update.emit(finished_steps)
+
+        # the run is journaled next to its logs, so that it can be resumed if it is interrupted
+        resume_journal = self.auto_proceesing_widget.resume_journal
+        self.auto_proceesing_widget.resume_journal = None
+
+        try:
+            with journal.Journal(
+                resume_journal or journal.get_journal_path(logs_file),
+                self.auto_proceesing_widget.file_list,
+                steps,
+                resume=resume_journal is not None,
+            ) as batch_journal, open(logs_file, "w", encoding="utf-8") as logs:
+                batch.run(
+                    self.auto_proceesing_widget.file_list,
+                    steps,
+                    logs,
+                    progress=FunctionProgress(update_progress),
+                    journal=batch_journal,
+                )
+
+        except (OSError, journal.JournalError) as e:
+            self.run_error.emit(str(e))
+
+        finally:
+            self.destroy()
@@ -49,6 +49,10 @@ class BackgroundRemoval(QFrame):
         self.math_morpho_btn = QRadioButton("Mathematical Morphology")
         self.math_morpho_btn.toggled.connect(self.emit_math_morpho_toggled)
 
+        # estimate structuring element widths per cluster of similar spectra
+        self.math_morpho_fast = QCheckBox("Fast Mode")
+        self.math_morpho_fast.setEnabled(False)
+
         self.init_water_bubble_size = 700
         self.init_bubble_size = 100
 
@@ -96,6 +100,7 @@ class BackgroundRemoval(QFrame):
         layout.addWidget(self.poly_deg, 2, 1)
 
         layout.addWidget(self.math_morpho_btn, 3, 0)
+        layout.addWidget(self.math_morpho_fast, 3, 1)
 
         layout.addWidget(self.bubblefill_btn, 4, 0)
         layout.addWidget(QLabel("Bubble Sizes (non-water | water)"), 5, 0)
@@ -119,6 +124,7 @@ class BackgroundRemoval(QFrame):
         self.poly_deg.setEnabled(not is_checked)
         self.water_bubble_size.setEnabled(not is_checked)
         self.bubble_size.setEnabled(not is_checked)
+        self.math_morpho_fast.setEnabled(is_checked)
 
         # emit whether math_morpho button is checked
         self.math_morpho_toggled.emit(is_checked)
@@ -193,7 +199,7 @@ class BackgroundRemoval(QFrame):
         bubble_size = int(self.bubble_size.text())
         self.bubble_size_changed.emit(bubble_size)
 
-    def get_params(self) -> tuple[int, bool]:
+    def get_params(self) -> tuple[int, bool, int, int, bool]:
         """
         The function to get parameters from all inputs.
 
@@ -206,6 +212,7 @@ class BackgroundRemoval(QFrame):
             self.ignore_water_band.isChecked(),
             int(self.bubble_size.text()),
             int(self.water_bubble_size.text()),
+            self.math_morpho_fast.isChecked(),
         )
         return parameters
 
@@ -216,6 +223,7 @@ class BackgroundRemoval(QFrame):
 
         self.poly_fit_btn.setChecked(True)
         self.ignore_water_band.setChecked(True)
+        self.math_morpho_fast.setChecked(False)
         self.poly_deg.setText(str(self.init_poly_deg))
         self.water_bubble_size.setText(str(self.init_water_bubble_size))
         self.bubble_size.setText(str(self.init_bubble_size))
@@ -5,14 +5,20 @@ from PySide6.QtWidgets import (
     QVBoxLayout,
     QLabel,
     QListWidget,
+    QListWidgetItem,
     QFileDialog,
     QWidget,
 )
-from PySide6.QtCore import Signal, Qt, QSettings
-from PySide6.QtGui import QCursor
+from PySide6.QtCore import Signal, Qt, QSettings, QSize, QThread, QCoreApplication
+from PySide6.QtGui import QCursor, QIcon, QImage, QPixmap
 
+from ramain.utils import colors
 from ramain.utils.settings import SETTINGS
+from ramain.model import metadata, thumbnails
 
+from typing import List, Tuple, Union
+import pyqtgraph as pg
+import numpy as np
 import os
 
 
@@ -23,12 +29,14 @@ class FilesView(QFrame):
 
     folder_changed = Signal(str)  # custom signal that folder has changed
 
-    def __init__(self, format: str, parent: QWidget = None) -> None:
+    def __init__(
+        self, format: Union[str, Tuple[str, ...]], parent: QWidget = None
+    ) -> None:
         """
         The constructor for file list widget that allows selection of the file folder.
 
         Parameters:
-            format (str): Format (extension) of the files to be displayed.
+            format (str | Tuple[str, ...]): Format(s) (extensions) of the files to be displayed.
             parent (QWidget): Parent widget of this widget. Default: None.
         """
 
@@ -44,17 +52,27 @@ class FilesView(QFrame):
         if not os.path.exists(self.data_folder):
             self.data_folder = os.getcwd()
 
-        # .mat files in curr data folder
+        # files of the format in curr data folder
         self.file_list = QListWidget(self)
 
+        # basic information about the map is shown as tooltip, read when the item is hovered for the first time
+        self.file_list.setMouseTracking(True)
+        self.file_list.itemEntered.connect(self.set_item_tooltip)
+
+        # thumbnails of the maps are computed in the background
+        self.file_list.setIconSize(QSize(32, 32))
+        self.thumbnail_worker = ThumbnailWorker()
+        self.thumbnail_worker.thumbnail_ready.connect(self.set_item_thumbnail)
+
         # widget to display
         self.curr_directory = QLabel(f"Current directory: {self.data_folder}")
 
-        # .mat files in given folder
+        # files of the format in given folder
         files = [
             file for file in os.listdir(self.data_folder) if file.endswith(self.format)
         ]
         self.file_list.addItems(files)
+        self.update_thumbnails()
 
         button = QPushButton("Change directory")
         button.setCursor(QCursor(Qt.PointingHandCursor))
@@ -100,7 +118,7 @@ class FilesView(QFrame):
         A function to update the list of visible files.
         """
 
-        # get .mat files in curr data folder
+        # get files of the format in curr data folder
         files = [
             file for file in os.listdir(self.data_folder) if file.endswith(self.format)
         ]
@@ -108,6 +126,72 @@ class FilesView(QFrame):
         self.file_list.clear()
         self.file_list.addItems(files)
         self.curr_directory.setText(f"Current directory: {self.data_folder}")
+        self.update_thumbnails()
+
+    def update_thumbnails(self) -> None:
+        """
+        A function to show thumbnails of the listed files, the missing ones are computed in the background.
+        """
+
+        if not thumbnails.is_enabled():
+            return
+
+        file_paths = []
+        for i in range(self.file_list.count()):
+            file_path = os.path.join(self.data_folder, self.file_list.item(i).text())
+            thumbnail = thumbnails.load(file_path)
+            if thumbnail is None:
+                file_paths.append(file_path)
+            else:
+                self.set_item_thumbnail(file_path, thumbnail)
+
+        self.thumbnail_worker.set_files(file_paths)
+
+    def set_item_thumbnail(self, file_path: str, thumbnail: dict) -> None:
+        """
+        A function to set the averages image of the map as icon of its item in the list.
+        """
+
+        if os.path.dirname(file_path) != self.data_folder:
+            return  # folder has been changed in the meantime
+
+        for item in self.file_list.findItems(
+            os.path.basename(file_path), Qt.MatchExactly
+        ):
+            item.setIcon(QIcon(_make_thumbnail_pixmap(thumbnail["averages"])))
+            # tooltip is made again with the summary of the map
+            item.setToolTip("")
+
+    def set_item_tooltip(self, item: QListWidgetItem) -> None:
+        """
+        A function to set tooltip of the `item` to the shape, x-axis range and dtype of its spectral map.
+        Only the metadata are read, not the spectra, so that hovering over the large files is fast.
+        """
+
+        if item.toolTip():
+            return
+
+        try:
+            info = metadata.probe(os.path.join(self.data_folder, item.text()))
+        except Exception:
+            # the file is checked properly only when it is loaded
+            item.setToolTip("Unknown file structure")
+            return
+
+        rows, cols, points = info["shape"]
+        tooltip = f"{rows} x {cols} spectra, {points} points ({info['dtype']})"
+        if info["x_range"] is not None:
+            x_min, x_max = info["x_range"]
+            tooltip += f"\nx-axis: {x_min:.1f} - {x_max:.1f} {info['units']}"
+
+        thumbnail = thumbnails.load(os.path.join(self.data_folder, item.text()))
+        if thumbnail is not None:
+            tooltip += (
+                f"\nmean: {thumbnail['mean']:.1f} (std {thumbnail['std']:.1f}),"
+                f" max: {thumbnail['max']:.1f}"
+            )
+
+        item.setToolTip(tooltip)
 
     def set_curr_file(self, name: str) -> None:
         """
@@ -117,3 +201,88 @@ class FilesView(QFrame):
         for i in range(self.file_list.count()):
             if self.file_list.item(i).text() == name:
                 self.file_list.setCurrentItem(self.file_list.item(i))
+
+
+def _make_thumbnail_pixmap(image: np.ndarray) -> QPixmap:
+    """
+    Converts 2D `image` into pixmap with the colormap from the settings, oriented as `SpectralMapGraph` shows it.
+    """
+
+    image = np.asarray(image, dtype=float).T
+    value_range = np.ptp(image)
+    normalized = (image - np.min(image)) / (value_range if value_range else 1)
+
+    color_map = colors.COLORMAPS[str(SETTINGS.value("spectral_map/cmap"))]
+    cmap = pg.ColorMap(pos=np.linspace(0.0, 1.0, len(color_map)), color=color_map)
+    rgba = np.ascontiguousarray(cmap.map(normalized, mode="byte"))
+
+    height, width = rgba.shape[:2]
+    # NOTE: QImage does not own the buffer, so it is copied before the array is freed
+    qimage = QImage(rgba.data, width, height, 4 * width, QImage.Format_RGBA8888)
+    return QPixmap.fromImage(qimage.copy())
+
+
+class ThumbnailWorker(QThread):
+    """
+    A worker in another thread that computes and indexes thumbnails of the maps with the lowest priority,
+    so that it runs when the UI is idle.
+    """
+
+    thumbnail_ready = Signal(str, object)
+
+    def __init__(self) -> None:
+        """
+        The constructor of the ThumbnailWorker.
+        """
+
+        QThread.__init__(self)
+        self.file_paths = []
+        self.restart = False
+        self.finished.connect(self._restart)
+
+        # the thread must not be running when the application is closed
+        QCoreApplication.instance().aboutToQuit.connect(self.stop)
+
+    def set_files(self, file_paths: List[str]) -> None:
+        """
+        A function to (re)start computing of the thumbnails of the `file_paths` files.
+        """
+
+        self.file_paths = list(file_paths)
+
+        if self.isRunning():
+            # the current file is finished first, then the worker starts again with the new files
+            self.restart = True
+            self.requestInterruption()
+        elif self.file_paths:
+            self.start(QThread.LowestPriority)
+
+    def stop(self) -> None:
+        """
+        A function to stop the worker after the current file and to wait until it is stopped.
+        """
+
+        self.restart = False
+        self.requestInterruption()
+        self.wait()
+
+    def _restart(self) -> None:
+        if self.restart:
+            self.restart = False
+            self.start(QThread.LowestPriority)
+
+    def run(self) -> None:
+        """
+        A function to compute thumbnails of the files one by one until interrupted.
+        """
+
+        for file_path in list(self.file_paths):
+            if self.isInterruptionRequested():
+                return
+
+            try:
+                thumbnail = thumbnails.get_thumbnail(file_path)
+            except Exception:
+                continue  # not a valid map, error is shown when the file is opened
+
+            self.thumbnail_ready.emit(file_path, thumbnail)
@@ -10,7 +10,7 @@ from PySide6.QtWidgets import (
     QWidget,
 )
 from PySide6.QtCore import QSize, Qt, Signal, QCoreApplication, QEventLoop
-from PySide6.QtGui import QIcon, QPixmap
+from PySide6.QtGui import QIcon, QPixmap, QKeySequence, QShortcut
 
 from ramain.views.widgets.color import Color
 from ramain.views.widgets.files_view import FilesView
@@ -21,6 +21,7 @@ from ramain.views.widgets.spectral_plot import SpectralPlot
 from ramain.views.widgets.plot_mode import PlotMode
 
 from ramain.model.spectal_map import SpectralMap
+from ramain.model import loaders, thumbnails
 
 from ramain.utils.settings import SETTINGS
 
@@ -35,7 +36,10 @@ class ManualPreprocessing(QFrame):
     """
 
     # signal that progress in progress bar should be updatet
-    update_progress = Signal()
+    update_progress = Signal(int)
+
+    # signal that saving in the background has finished, emitted with its future
+    save_finished = Signal(object)
 
     def __init__(self, parent: QWidget = None) -> None:
         """
@@ -52,7 +56,7 @@ class ManualPreprocessing(QFrame):
         self.icon = QIcon("ramain/resources/icons/monitor.svg")
 
         # Nothing set yet
-        self.files_view = FilesView(format=".mat", parent=self)
+        self.files_view = FilesView(format=loaders.get_extensions(), parent=self)
 
         self.curr_folder = self.files_view.data_folder
         self.curr_file = None
@@ -90,8 +94,21 @@ class ManualPreprocessing(QFrame):
         self.save_button.clicked.connect(self.save_file)
         self.save_button.setMaximumWidth(400)
 
+        # step-wise undo/redo of the applied methods
+        self.undo_button = QPushButton("Undo")
+        self.undo_button.clicked.connect(self.undo)
+        self.undo_button.setMaximumWidth(200)
+        QShortcut(QKeySequence.Undo, self, self.undo)
+
+        self.redo_button = QPushButton("Redo")
+        self.redo_button.clicked.connect(self.redo)
+        self.redo_button.setMaximumWidth(200)
+        QShortcut(QKeySequence.Redo, self, self.redo)
+
         buttons_layout = QHBoxLayout()
         buttons_layout.addWidget(self.reload_discard_button)
+        buttons_layout.addWidget(self.undo_button)
+        buttons_layout.addWidget(self.redo_button)
         buttons_layout.addStretch()
         buttons_layout.addWidget(self.save_button)
 
@@ -104,11 +121,14 @@ class ManualPreprocessing(QFrame):
         self.init_normalization()
 
         self.init_file_error_widget()
+        self.init_save_error_widget()
+        self.save_finished.connect(self.on_save_finished)
 
         # disable method selection + buttons until some valid file is selected
         self.methods.list.setEnabled(False)
         self.save_button.setEnabled(False)
         self.reload_discard_button.setEnabled(False)
+        self.update_history_buttons()
 
         layout = QVBoxLayout()
         layout.addWidget(CollapseButton(self.files_view, "Choose File", self))
@@ -132,7 +152,7 @@ class ManualPreprocessing(QFrame):
 
             # initially show [0,0] data
             self.plot = SpectralPlot(
-                self.curr_data.x_axis, self.curr_data.data[0, 0], self
+                self.curr_data.x_axis, self.curr_data.get_spectrum(0, 0), self
             )
             self.curr_plot_indices = (0, 0)
             self.plot.setFixedSize(QSize(700, 300))
@@ -168,7 +188,9 @@ class ManualPreprocessing(QFrame):
             and y < self.curr_data.averages.shape[1]
             and y >= 0
         ):
-            self.plot.update_data(self.curr_data.x_axis, self.curr_data.data[x, y])
+            self.plot.update_data(
+                self.curr_data.x_axis, self.curr_data.get_spectrum(x, y)
+            )
             self.curr_plot_indices = (x, y)
 
             # update also bg line on plot change
@@ -198,10 +220,23 @@ class ManualPreprocessing(QFrame):
         else:
             temp_curr_file = file.text()
 
+        # show indexed averages of the map while its spectra are being loaded
+        thumbnail = thumbnails.load(os.path.join(self.curr_folder, temp_curr_file))
+        if thumbnail is not None and not self._is_placeholder(self.spectral_map_graph):
+            self.spectral_map_graph.update_image(thumbnail["averages"])
+            QCoreApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
+
         try:
-            self.curr_data = SpectralMap(os.path.join(self.curr_folder, temp_curr_file))
+            # spectra of large (v7.3) files are read only when they are needed
+            self.curr_data = SpectralMap(
+                os.path.join(self.curr_folder, temp_curr_file),
+                lazy=True,
+                keep_history=True,
+            )
         except:
             self.file_error.show()
+            if thumbnail is not None and self.curr_data is not None:
+                self.spectral_map_graph.update_image(self.curr_data.averages)
             return
 
         if not self.methods.list.isEnabled():
@@ -213,6 +248,7 @@ class ManualPreprocessing(QFrame):
         self.update_spectral_map()
         self.methods.reset()
         self.curr_method = self.methods.view
+        self.update_history_buttons()
 
     def update_folder(self, new_folder: str) -> None:
         """
@@ -228,6 +264,7 @@ class ManualPreprocessing(QFrame):
 
         self.curr_method.reset()
         self.curr_method = new_method
+        self.update_history_buttons()
 
         if self.curr_method == self.methods.cropping:
             self.plot.set_mode(PlotMode.CROPPING)
@@ -505,15 +542,17 @@ class ManualPreprocessing(QFrame):
             ignore_water,
             bubble_size,
             water_bubble_size,
+            math_morpho_fast,
         ) = self.methods.background_removal.get_params()
         # steps for progress bar
-        steps = np.multiply(*self.curr_data.data.shape[:2])
+        steps = np.multiply(*self.curr_data.shape[:2])
 
         if math_morpho:
             self.progress_bar_function(
                 steps,
                 self.curr_data.background_removal_math_morpho,
                 ignore_water,
+                math_morpho_fast,
                 self.update_progress,
             )
         elif bubblefill:
@@ -545,9 +584,9 @@ class ManualPreprocessing(QFrame):
 
         if self.methods.background_removal.math_morpho_btn.isChecked():
             ignore_water = self.methods.background_removal.ignore_water_band.isChecked()
-            curr_spectrum = self.curr_data.data[
-                self.curr_plot_indices[0], self.curr_plot_indices[1], :
-            ]
+            curr_spectrum = self.curr_data.get_spectrum(
+                self.curr_plot_indices[0], self.curr_plot_indices[1]
+            )
             mm_bg = self.curr_data.background_removal_math_morpho(
                 ignore_water, one_spectrum=curr_spectrum
             )
@@ -557,9 +596,9 @@ class ManualPreprocessing(QFrame):
                 self.methods.background_removal.water_bubble_size.text()
             )
             bubble_size = int(self.methods.background_removal.bubble_size.text())
-            curr_spectrum = self.curr_data.data[
-                self.curr_plot_indices[0], self.curr_plot_indices[1], :
-            ]
+            curr_spectrum = self.curr_data.get_spectrum(
+                self.curr_plot_indices[0], self.curr_plot_indices[1]
+            )
             bf_bg = self.curr_data.background_removal_bubblefill(
                 bubble_size, water_bubble_size, one_spectrum=curr_spectrum
             )
@@ -567,9 +606,9 @@ class ManualPreprocessing(QFrame):
         else:
             degree = int(self.methods.background_removal.poly_deg.text())
             ignore_water = self.methods.background_removal.ignore_water_band.isChecked()
-            curr_spectrum = self.curr_data.data[
-                self.curr_plot_indices[0], self.curr_plot_indices[1], :
-            ]
+            curr_spectrum = self.curr_data.get_spectrum(
+                self.curr_plot_indices[0], self.curr_plot_indices[1]
+            )
             poly_bg = self.curr_data.background_removal_imodpoly(
                 degree, ignore_water, one_spectrum=curr_spectrum
             )
@@ -601,9 +640,9 @@ class ManualPreprocessing(QFrame):
 
         savgol = self.methods.smoothing.savgol_btn.isChecked()
         lam, diff, wl, po = self.methods.smoothing.get_params()
-        curr_spectrum = self.curr_data.data[
-            self.curr_plot_indices[0], self.curr_plot_indices[1], :
-        ]
+        curr_spectrum = self.curr_data.get_spectrum(
+            self.curr_plot_indices[0], self.curr_plot_indices[1]
+        )
         if savgol:
             smoothed = self.curr_data.smoothing_savgol(
                 wl, po, one_spectrum=curr_spectrum
@@ -661,6 +700,26 @@ class ManualPreprocessing(QFrame):
         self.file_error.setWindowIcon(QIcon("ramain/resources/icons/message.svg"))
         self.file_error.setStandardButtons(QMessageBox.Ok)
 
+    def init_save_error_widget(self) -> None:
+        """
+        A function initialize a save error widget.
+        """
+
+        self.save_error = QMessageBox()
+        self.save_error.setIconPixmap(QPixmap("ramain/resources/icons/x-circle.svg"))
+        self.save_error.setText("Data could not be saved.")
+        self.save_error.setWindowTitle("Saving failed")
+        self.save_error.setWindowIcon(QIcon("ramain/resources/icons/message.svg"))
+        self.save_error.setStandardButtons(QMessageBox.Ok)
+
+    def show_save_error(self, error: Exception) -> None:
+        """
+        A function to show the save error widget with the `error` message.
+        """
+
+        self.save_error.setInformativeText(str(error))
+        self.save_error.show()
+
     def enable_widgets(self, enable: bool) -> None:
         """
         A function to enable/disable widgets in ManulPreprocessing instance.
@@ -716,15 +775,18 @@ class ManualPreprocessing(QFrame):
 
         self.progress.forceShow()
 
-    def set_progress(self) -> None:
+    def set_progress(self, steps: int = 1) -> None:
         """
         A function to increment progress in the progress bar dialog.
+
+        Parameters:
+            steps (int): Number of finished steps (e.g. spectra of the processed block). Default: 1.
         """
 
         # process another events that are not user inputs
         QCoreApplication.processEvents(QEventLoop.ExcludeUserInputEvents)
         val = self.progress.value()
-        self.progress.setValue(val + 1)
+        self.progress.setValue(val + steps)
 
     def destroy_progress_bar(self) -> None:
         """
@@ -780,15 +842,97 @@ class ManualPreprocessing(QFrame):
 
         dir_name, file_name = os.path.split(file_name)
 
-        self.curr_data.save_matlab(dir_name, file_name=file_name)
+        # data are saved in the background, they must not be changed until it is finished
+        self.enable_editing(False)
+        try:
+            self.curr_data.save_matlab_async(
+                dir_name, file_name=file_name, callback=self.save_finished.emit
+            )
+        except Exception as e:
+            self.enable_editing(True)
+            self.show_save_error(e)
+            return
 
         SETTINGS.setValue("save_dir", dir_name)
 
         self.files_view.data_folder = dir_name
         self.update_folder(dir_name)
 
+    def on_save_finished(self, future) -> None:
+        """
+        A function to enable editing of the data once they are saved and to show the saved file.
+        Triggered by `save_finished` signal.
+
+        Parameters:
+            future (concurrent.futures.Future): The finished saving.
+        """
+
+        self.enable_editing(True)
+
+        if future.exception() is not None:
+            self.show_save_error(future.exception())
+
         self.update_file_list()
 
+    def enable_editing(self, enable: bool) -> None:
+        """
+        A function to enable/disable the widgets that change the current data.
+
+        Parameters:
+            enable (bool): Whether widgets should be enabled or disabled.
+        """
+
+        self.methods.setEnabled(enable)
+        self.save_button.setEnabled(enable)
+        self.reload_discard_button.setEnabled(enable)
+        if enable:
+            self.update_history_buttons()
+        else:
+            self.undo_button.setEnabled(False)
+            self.redo_button.setEnabled(False)
+
+    def update_history_buttons(self) -> None:
+        """
+        A function to enable undo/redo buttons only if there is a step to undo/redo.
+        """
+
+        history = None if self.curr_data is None else self.curr_data.history
+        self.undo_button.setEnabled(history is not None and history.can_undo())
+        self.redo_button.setEnabled(history is not None and history.can_redo())
+
+    def undo(self) -> None:
+        """
+        A function to revert the last applied method and to display the result.
+        """
+
+        # also triggered by the shortcut, i.e. when the button is disabled
+        if not self.undo_button.isEnabled():
+            return
+
+        if self.curr_data.undo() is not None:
+            self._update_after_history_change()
+
+    def redo(self) -> None:
+        """
+        A function to apply the last reverted method again and to display the result.
+        """
+
+        # also triggered by the shortcut, i.e. when the button is disabled
+        if not self.redo_button.isEnabled():
+            return
+
+        if self.curr_data.redo() is not None:
+            self._update_after_history_change()
+
+    def _update_after_history_change(self) -> None:
+        # shape of the map and x-axis may have changed (e.g. cropping)
+        self.spectral_map_graph.update_image(self.curr_data.averages)
+        x, y = self.curr_plot_indices
+        if not (x < self.curr_data.shape[0] and y < self.curr_data.shape[1]):
+            x, y = 0, 0
+        self.update_plot(x, y)
+        self.update_method(self.curr_method)
+
     def discard_changes(self) -> None:
         """
         A function to load current file once again.
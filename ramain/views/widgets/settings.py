@@ -4,12 +4,16 @@ from PySide6.QtWidgets import (
     QGridLayout,
     QRadioButton,
     QButtonGroup,
+    QCheckBox,
+    QComboBox,
+    QSpinBox,
     QWidget,
 )
 from PySide6.QtGui import QIcon
 from PySide6.QtCore import Qt
 
 from ramain.utils import colors
+from ramain.model import cache, matlab_writer, step_cache
 from ramain.utils.settings import SETTINGS
 
 import pyqtgraph as pg
@@ -87,6 +91,51 @@ class Settings(QFrame):
             # default
             self.viridis.setChecked(True)
 
+        # processing of the spectra in single precision
+        self.float32 = QCheckBox("Single precision (float32) spectra")
+        self.float32.setToolTip(
+            "Spectra are converted to float32 when loaded, halving the memory they take."
+        )
+        self.float32.setChecked(SETTINGS.value("processing/float32", False, type=bool))
+        self.float32.toggled.connect(self.change_float32)
+
+        # cache of the converted files
+        self.cache = QCheckBox("Cache loaded files")
+        self.cache.setToolTip(
+            "Reopened files are memory-mapped from their converted copies, the cache takes disk space "
+            "(a copy of each opened file)."
+        )
+        self.cache.setChecked(cache.is_enabled())
+        self.cache.toggled.connect(self.change_cache)
+
+        # cache of the intermediate states of the automatic pipelines
+        self.step_cache = QCheckBox("Cache pipeline steps")
+        self.step_cache.setToolTip(
+            "Reruns of the automatic pipeline resume from the last cached step, the cache takes disk space "
+            "(a copy of each processed file)."
+        )
+        self.step_cache.setChecked(step_cache.is_enabled())
+        self.step_cache.toggled.connect(self.change_step_cache)
+
+        # format and compression of the saved files
+        file_format, compression = matlab_writer.get_options()
+
+        self.file_format = QComboBox()
+        self.file_format.addItems(matlab_writer.FORMATS)
+        self.file_format.setToolTip(
+            "v7.3 (HDF5) files are saved by chunks, maps too large for v5 are always saved as v7.3."
+        )
+        self.file_format.setCurrentText(file_format)
+        self.file_format.currentTextChanged.connect(self.change_file_format)
+
+        self.compression = QSpinBox()
+        self.compression.setRange(0, 9)
+        self.compression.setToolTip(
+            "0 - no compression (fastest), 9 - the smallest files (slowest)."
+        )
+        self.compression.setValue(compression)
+        self.compression.valueChanged.connect(self.change_compression)
+
         layout = QGridLayout(self)
         layout.addWidget(QLabel("Spectral Map - Colormap"), 0, 0)
 
@@ -102,6 +151,17 @@ class Settings(QFrame):
         layout.addWidget(self.cividis, 4, 0)
         layout.addWidget(cmap_pics[3], 4, 1)
 
+        layout.addWidget(QLabel("Processing"), 5, 0)
+        layout.addWidget(self.float32, 6, 0, 1, 2)
+        layout.addWidget(self.cache, 7, 0, 1, 2)
+        layout.addWidget(self.step_cache, 8, 0, 1, 2)
+
+        layout.addWidget(QLabel("Saving"), 9, 0)
+        layout.addWidget(QLabel("MAT-file format"), 10, 0)
+        layout.addWidget(self.file_format, 10, 1)
+        layout.addWidget(QLabel("Compression level"), 11, 0)
+        layout.addWidget(self.compression, 11, 1)
+
         layout.setAlignment(Qt.AlignTop)
 
         # add stretch for better alignment
@@ -119,6 +179,41 @@ class Settings(QFrame):
         if sender.isChecked():
             SETTINGS.setValue("spectral_map/cmap", sender.text().lower())
 
+    def change_float32(self, checked: bool) -> None:
+        """
+        A function to change whether the spectra are processed in single precision, applies to newly loaded files.
+        """
+
+        SETTINGS.setValue("processing/float32", checked)
+
+    def change_cache(self, checked: bool) -> None:
+        """
+        A function to change whether the loaded files are cached, applies to newly loaded files.
+        """
+
+        SETTINGS.setValue("cache/enabled", checked)
+
+    def change_step_cache(self, checked: bool) -> None:
+        """
+        A function to change whether the states after the steps of the automatic pipelines are cached.
+        """
+
+        SETTINGS.setValue("step_cache/enabled", checked)
+
+    def change_file_format(self, file_format: str) -> None:
+        """
+        A function to change the format of the saved files in the settings.
+        """
+
+        SETTINGS.setValue("saving/format", file_format)
+
+    def change_compression(self, compression: int) -> None:
+        """
+        A function to change the compression level of the saved files in the settings.
+        """
+
+        SETTINGS.setValue("saving/compression", compression)
+
     def get_string_name(self) -> str:
         """
         A function to return name of this widget as a string.
@@ -24,6 +24,7 @@ from ramain.utils.settings import SETTINGS
 import os
 
 from ramain.model.spectal_map import SpectralMap
+from ramain.model import loaders
 
 
 class SpectraDecomposition(QFrame):
@@ -43,7 +44,7 @@ class SpectraDecomposition(QFrame):
         self.icon = QIcon("ramain/resources/icons/pie.svg")
 
         # files
-        self.files_view = FilesView(format=".mat", parent=self)
+        self.files_view = FilesView(format=loaders.get_extensions(), parent=self)
 
         self.curr_folder = self.files_view.data_folder
         self.curr_file = None